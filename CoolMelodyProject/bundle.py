@@ -0,0 +1,165 @@
+import json
+import os
+import re
+import shutil
+import time
+from os.path import isdir, isfile, join
+
+import numpy as np
+
+BUNDLE_FORMAT = 1
+METADATA_FILENAME = 'bundle.json'
+WEIGHTS_FILENAME = 'model.npz'
+# how the weights can be stored, see quantize_weights
+QUANTIZATIONS = ['float32', 'float16', 'int8']
+# weights variants saved in every bundle, the api picks one with MODEL_QUANTIZATION
+BUNDLE_QUANTIZATIONS = QUANTIZATIONS
+VERSION_PATTERN = re.compile(r'^v(\d+)$')
+# layers with one unit per pitch / duration of the vocabulary
+VOCABULARY_LAYERS = ['pitch_output', 'duration_output']
+
+# same defaults as api/sampling.py, a bundle can override them for the model it holds
+SAMPLING_DEFAULTS = {'temperature': 1.0, 'k': 12, 'top_p': None, 'duration_k': 2}
+
+
+def vocabulary(reverse_mapping):
+    """values of a reverse mapping dict (index: value) in index order, without the -1 padding value"""
+    reverse_mapping = {int(index): value for index, value in reverse_mapping.items()}
+    return [reverse_mapping[index] for index in range(len(reverse_mapping) - 1)]
+
+
+def output_units(weights):
+    """units of the pitch and duration output layers of model weights (quantized or not)"""
+    return [np.shape(weights[f'{name}/kernel'])[-1] for name in VOCABULARY_LAYERS]
+
+
+def fit_outputs_to_vocabulary(weights, vocabulary_sizes):
+    """weights whose pitch / duration output layers have exactly one unit per vocabulary entry
+
+    train_model builds the output layers with len(mapping dict) units, which counts the -1 padding entry.
+    That last unit is never a target, so it's dropped and the served model only predicts notes it can decode.
+
+    Raises:
+        ValueError: if an output layer has neither as many units as its vocabulary nor one more
+    """
+    weights = dict(weights)
+    for name, units, size in zip(VOCABULARY_LAYERS, output_units(weights), vocabulary_sizes):
+        if units == size + 1:
+            weights[f'{name}/kernel'] = weights[f'{name}/kernel'][:, :size]
+            weights[f'{name}/bias'] = weights[f'{name}/bias'][:size]
+        elif units != size:
+            raise ValueError(f"{name} has {units} units for a vocabulary of {size}")
+    return weights
+
+
+def weights_filename(quantization='float32'):
+    """model.npz for the float32 weights, model-<quantization>.npz for the others"""
+    return WEIGHTS_FILENAME if quantization == 'float32' else WEIGHTS_FILENAME.replace('.npz', f'-{quantization}.npz')
+
+
+def quantize_weights(weights, quantization):
+    """store the kernels of numpy_model.model_weights with fewer bits, biases stay float32 (they're a tiny part of the model)
+
+    float16 halves the kernels. int8 quarters them: each output unit's column is scaled so its largest
+    weight is +-127 and rounded, and the float32 scales are saved as '<kernel>/scale'.
+    NumpyMelodyModel computes with either as they are, see numpy_model.matmul.
+
+    Args:
+        weights (dict): float32 weights from numpy_model.model_weights
+        quantization (str): one of QUANTIZATIONS
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"quantization must be one of {QUANTIZATIONS}, not {quantization!r}")
+
+    quantized = {}
+    for key, value in weights.items():
+        value = np.asarray(value, dtype=np.float32)
+        if key.endswith('/bias') or quantization == 'float32':
+            quantized[key] = value
+        elif quantization == 'float16':
+            quantized[key] = value.astype(np.float16)
+        else:
+            scale = np.abs(value).max(axis=0) / 127
+            scale[scale == 0] = 1
+            quantized[key] = np.clip(np.round(value / scale), -127, 127).astype(np.int8)
+            quantized[f'{key}/scale'] = scale.astype(np.float32)
+    return quantized
+
+
+def bundle_versions(bundles_dir):
+    """version number: path of every published bundle in bundles_dir"""
+    if not isdir(bundles_dir):
+        return {}
+    versions = {}
+    for name in os.listdir(bundles_dir):
+        match = VERSION_PATTERN.match(name)
+        if match and isfile(join(bundles_dir, name, METADATA_FILENAME)):
+            versions[int(match.group(1))] = join(bundles_dir, name)
+    return versions
+
+
+def latest_bundle(bundles_dir):
+    """path of the newest bundle in bundles_dir, None if there isn't one"""
+    versions = bundle_versions(bundles_dir)
+    return versions[max(versions)] if versions else None
+
+
+def save_bundle(bundles_dir, weights, mapping_dicts, sequence_length, sampling=None, quantizations=BUNDLE_QUANTIZATIONS):
+    """publish everything the api needs to serve a model as the next version in bundles_dir
+
+    A bundle is a folder (v0001, v0002, ...) with the numpy weights, once per quantization, and bundle.json:
+    the mapping dicts the model was trained with, the vocabularies in index order, the sequence length and
+    sampling defaults. The output layers are cut down to the vocabularies, see fit_outputs_to_vocabulary.
+    It's written to a temporary folder and renamed, so a bundle is either complete or not there at all.
+
+    Args:
+        weights (dict): from numpy_model.model_weights
+        mapping_dicts (list): pitch_mapping, pitch_reverse_mapping, duration_mapping, duration_reverse_mapping
+        sequence_length (int): notes the model takes in
+        sampling (dict): sampling defaults to serve the model with, any of SAMPLING_DEFAULTS
+        quantizations (list): weights variants to save, see quantize_weights
+
+    Returns:
+        str: path of the new bundle
+    """
+    pitch_symb = [int(p) for p in vocabulary(mapping_dicts[1])]
+    duration_symb = [float(d) for d in vocabulary(mapping_dicts[3])]
+    weights = fit_outputs_to_vocabulary(weights, [len(pitch_symb), len(duration_symb)])
+
+    os.makedirs(bundles_dir, exist_ok=True)
+    version = max(bundle_versions(bundles_dir), default=0) + 1
+    name = f'v{version:04d}'
+    tmp_dir = join(bundles_dir, f'.tmp-{name}')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    try:
+        for quantization in quantizations:
+            np.savez(join(tmp_dir, weights_filename(quantization)), **quantize_weights(weights, quantization))
+        metadata = {
+            'format': BUNDLE_FORMAT,
+            'version': name,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'sequence_length': int(sequence_length),
+            'pitch_symb': pitch_symb,
+            'duration_symb': duration_symb,
+            'sampling': {**SAMPLING_DEFAULTS, **(sampling or {})},
+            'quantizations': list(quantizations),
+            'mapping_dicts': mapping_dicts,
+        }
+        with open(join(tmp_dir, METADATA_FILENAME), 'w') as f:
+            json.dump(metadata, f, indent=4)
+        os.rename(tmp_dir, join(bundles_dir, name))
+    except BaseException:
+        # don't leave a half written bundle behind
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return join(bundles_dir, name)
+
+
+def load_bundle_metadata(bundle_dir):
+    with open(join(bundle_dir, METADATA_FILENAME), 'r') as f:
+        metadata = json.load(f)
+    if metadata['format'] != BUNDLE_FORMAT:
+        raise ValueError(f"{bundle_dir} is bundle format {metadata['format']}, expected {BUNDLE_FORMAT}")
+    return metadata
@@ -0,0 +1,152 @@
+import json
+import os
+import time
+from os.path import isfile, join
+
+import numpy as np
+from tensorflow.keras.callbacks import Callback, EarlyStopping
+
+CHECKPOINT_FILENAME = 'checkpoint.keras'
+BEST_WEIGHTS_FILENAME = 'best.weights.h5'
+STATE_FILENAME = 'state.json'
+OUTPUT_LAYERS = {'pitch_output': 0, 'duration_output': 2}
+
+
+def load_state(checkpoint_dir):
+    """the training state saved by Checkpointer, None if nothing was saved in checkpoint_dir"""
+    path = join(checkpoint_dir, STATE_FILENAME)
+    if not isfile(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def new_state(mapping_dicts, warm_start=None):
+    """state of a run that hasn't trained yet
+
+    Args:
+        warm_start (dict): state of the run the model was warm-started from
+    """
+    return {'epoch': 0, 'history': {}, 'best': None, 'best_epoch': None, 'seconds': 0.0, 'complete': False,
+            'mapping_dicts': mapping_dicts,
+            # training time from scratch, for warm-started runs it's the one of the run they started from
+            'cold_seconds': None if warm_start is None else warm_start['cold_seconds']}
+
+
+class Checkpointer(Callback):
+    """saves the model with its optimizer state every `every` epochs, so an interrupted run can carry on
+    where it stopped instead of starting again
+
+    Besides the model, checkpoint_dir gets the weights of the best epoch so far and state.json: the
+    epochs done, the whole history, the best validation loss and the training time, so early stopping,
+    the learning curves and the time reports carry on across resumes too.
+
+    Args:
+        checkpoint_dir (str): folder for the checkpoint (created if it doesn't exist)
+        state (dict): state to carry on from, load_state or new_state
+        every (int): epochs between checkpoints
+    """
+
+    def __init__(self, checkpoint_dir, state, every=1, monitor='val_loss'):
+        super().__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.state = state
+        self.every = every
+        self.monitor = monitor
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        state = self.state
+        state['seconds'] += time.perf_counter() - self._start
+        state['epoch'] = epoch + 1
+        for name, value in (logs or {}).items():
+            state['history'].setdefault(name, []).append(float(value))
+
+        current = logs[self.monitor]
+        if state['best'] is None or current < state['best']:
+            state['best'] = float(current)
+            state['best_epoch'] = epoch
+            self.model.save_weights(join(self.checkpoint_dir, BEST_WEIGHTS_FILENAME))
+
+        if (epoch + 1) % self.every == 0:
+            self.save()
+
+    def on_train_end(self, logs=None):
+        self.save()
+
+    def save(self):
+        """write the model, then the state, each replacing the old file in one step, so a crash while
+        saving leaves the last checkpoint as it was"""
+        model_path = join(self.checkpoint_dir, CHECKPOINT_FILENAME)
+        self.model.save(model_path.replace('.keras', '.tmp.keras'))
+        os.replace(model_path.replace('.keras', '.tmp.keras'), model_path)
+        save_state(self.checkpoint_dir, self.state)
+
+
+def save_state(checkpoint_dir, state):
+    path = join(checkpoint_dir, STATE_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+class ResumableEarlyStopping(EarlyStopping):
+    """EarlyStopping that carries on counting from the best epoch of a resumed run instead of starting over"""
+
+    def __init__(self, state, patience):
+        super().__init__(patience=patience)
+        self.state = state
+
+    def on_train_begin(self, logs=None):
+        super().on_train_begin(logs)
+        if self.state['best'] is not None:
+            self.best = self.state['best']
+            self.wait = self.state['epoch'] - 1 - self.state['best_epoch']
+
+
+def model_params(model):
+    """the build_model keyword arguments a model was built with"""
+    return {
+        'lstm_units': model.get_layer('first_LSTM').units,
+        'branch_units': model.get_layer('pitch_LSTM').units,
+        'dense_units': model.get_layer('pitch_dense').units,
+        'dropout': model.get_layer('pitch_dropout').rate,
+        'dense_dropout': model.get_layer('pitch_dropout_2').rate,
+    }
+
+
+def vocabulary_positions(old_mapping, new_mapping):
+    """for every value of the old vocabulary that is still in the new one: (old index, new index)"""
+    new_indexes = {float(value): index for value, index in new_mapping.items() if index >= 0}
+    pairs = [(index, new_indexes[float(value)]) for value, index in old_mapping.items()
+             if index >= 0 and float(value) in new_indexes]
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+
+def warm_start(old_model, new_model, old_mapping_dicts, new_mapping_dicts):
+    """copy a trained model's weights into a new model for a (possibly bigger) vocabulary
+
+    Every layer is copied as it is except the output layers, whose units are moved to where their pitch /
+    duration is in the new vocabulary. Units for values the old model never saw keep their random kernel
+    and get the smallest old bias, so they start out unlikely. Inputs are vocabulary indexes too, so values
+    inserted in the middle of the vocabulary shift the inputs after them a little, fine-tuning makes up for it.
+    """
+    for layer in new_model.layers:
+        if layer.weights and layer.name not in OUTPUT_LAYERS:
+            layer.set_weights(old_model.get_layer(layer.name).get_weights())
+
+    for name, mapping_index in OUTPUT_LAYERS.items():
+        kernel, bias = old_model.get_layer(name).get_weights()
+        new_kernel, new_bias = new_model.get_layer(name).get_weights()
+        new_bias[:] = bias.min()
+
+        positions = vocabulary_positions(old_mapping_dicts[mapping_index], new_mapping_dicts[mapping_index])
+        new_kernel[:, positions[:, 1]] = kernel[:, positions[:, 0]]
+        new_bias[positions[:, 1]] = bias[positions[:, 0]]
+        new_model.get_layer(name).set_weights([new_kernel, new_bias])
+
+    return new_model
+
@@ -0,0 +1,194 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from os.path import getsize, join
+
+import numpy as np
+import pandas as pd
+
+from CoolMelodyProject.csvcleaner import SONATA_PATH, load_pieces, movement_name
+from CoolMelodyProject.csvcombiner import get_movement_filenames
+
+CORPUS_PATH = '../raw_data/sonata_corpus'
+STACKED_CSV_PATH = '../raw_data/stacked_movement_df.csv'
+METADATA_FILENAME = 'metadata.json'
+
+# text columns with few distinct values, stored as integer codes into one list of categories per column
+CATEGORICAL_COLUMNS = ['note_name', 'duration', 'subdiv', 'harm', 'dynamic']
+# pieces csv columns kept for every movement, to choose movements by
+PIECE_COLUMNS = ['key', 'time_sig', 'tempo marking', 'bpm', 'title']
+
+
+def read_movement(path):
+    """one movement csv, with the categorical columns read as text (durations like 4 and '4d' end up the same type)"""
+    return pd.read_csv(path, dtype={name: str for name in CATEGORICAL_COLUMNS})
+
+
+def save_corpus(corpus_dir=CORPUS_PATH, sonata_path=SONATA_PATH, filenames=None, workers=1):
+    """store every movement csv (all of them by default) as one columnar corpus that can be read in parts
+
+    Each column is one .npy file, with the movements one after the other: categorical columns as the smallest
+    integer codes that fit with their categories in the json sidecar, the other columns as the smallest integers
+    that fit. The sidecar also has the rows each movement takes up and its pieces csv entry (key, time_sig, ...),
+    so load_corpus can read just some columns of just some movements.
+
+    Args:
+        corpus_dir (str): folder to save the corpus in (created if it doesn't exist)
+        workers (int): processes reading csvs, None for one per core. The sonata csvs are small, so reading
+                       them in this process (the default, 1) is faster than starting a pool
+
+    Raises:
+        ValueError: if there are no movement csvs to store, or they don't all have the same columns
+    """
+    if filenames is None:
+        filenames = sorted(get_movement_filenames(sonata_path))
+    if not filenames:
+        raise ValueError(f"no movement csvs to store from {sonata_path}")
+    paths = [join(sonata_path, filename) for filename in filenames]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) <= 1:
+        dfs = [read_movement(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            dfs = list(pool.map(read_movement, paths, chunksize=8))
+
+    columns = list(dfs[0].columns)
+    for filename, df in zip(filenames, dfs):
+        if list(df.columns) != columns:
+            raise ValueError(f"{filename} has columns {list(df.columns)}, expected {columns}")
+    stacked = pd.concat(dfs, ignore_index=True)
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    metadata = {'columns': {}, 'movements': {}}
+    for name in columns:
+        if name in CATEGORICAL_COLUMNS:
+            values = pd.Categorical(stacked[name].astype(str))
+            array = values.codes.astype(np.min_scalar_type(len(values.categories)))
+            metadata['columns'][name] = {'dtype': str(array.dtype), 'categories': list(values.categories)}
+        else:
+            array = pd.to_numeric(stacked[name], downcast='integer').to_numpy()
+            metadata['columns'][name] = {'dtype': str(array.dtype)}
+        np.save(join(corpus_dir, f'{name}.npy'), np.ascontiguousarray(array))
+
+    pieces = load_pieces(sonata_path)
+    start = 0
+    for filename, df in zip(filenames, dfs):
+        name = movement_name(filename)
+        piece = pieces.loc[name, PIECE_COLUMNS]
+        metadata['movements'][name] = {'start': start, 'end': start + len(df),
+                                       **{column: None if pd.isna(value) else str(value).strip()
+                                          for column, value in piece.items()}}
+        start += len(df)
+
+    with open(join(corpus_dir, METADATA_FILENAME), 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+
+def load_corpus_metadata(corpus_dir=CORPUS_PATH):
+    with open(join(corpus_dir, METADATA_FILENAME), 'r') as f:
+        return json.load(f)
+
+
+def select_movements(metadata, movements=None, **pieces_filters):
+    """names of the movements in a corpus matching every filter
+
+    Args:
+        movements (list): movement names to choose from, default every movement
+        pieces_filters: pieces csv values to match, eg key='c major' or time_sig=['3/4', '6/8']
+                        ('tempo marking' is tempo_marking here)
+    """
+    names = list(metadata['movements']) if movements is None else list(movements)
+    unknown = set(names) - set(metadata['movements'])
+    if unknown:
+        raise KeyError(f"movements not in the corpus: {sorted(unknown)}")
+
+    for column, wanted in pieces_filters.items():
+        column = column.replace('_marking', ' marking')
+        if column not in PIECE_COLUMNS:
+            raise ValueError(f"can only filter on {PIECE_COLUMNS}, not {column!r}")
+        wanted = {wanted} if isinstance(wanted, str) else set(wanted)
+        names = [name for name in names if metadata['movements'][name][column] in wanted]
+    return names
+
+
+def load_corpus(corpus_dir=CORPUS_PATH, columns=None, movements=None, **pieces_filters):
+    """read the columns asked for of the movements asked for from a corpus saved with save_corpus
+
+    Columns are memory-mapped, so only the rows of the chosen movements are read from disk.
+
+    Args:
+        columns (list): columns to load, default every column
+        movements (list): movement names to load, default every movement
+        pieces_filters: only movements with these pieces csv values, see select_movements
+
+    Returns:
+        pd.DataFrame: a categorical movement column, then the columns asked for (categorical ones as pd.Categorical)
+    """
+    metadata = load_corpus_metadata(corpus_dir)
+    names = select_movements(metadata, movements, **pieces_filters)
+    columns = list(metadata['columns']) if columns is None else list(columns)
+    unknown = set(columns) - set(metadata['columns'])
+    if unknown:
+        raise KeyError(f"columns not in the corpus: {sorted(unknown)}")
+
+    lengths = [metadata['movements'][name]['end'] - metadata['movements'][name]['start'] for name in names]
+    # movements next to each other on disk are read as one slice
+    ranges = []
+    for name in names:
+        start, end = metadata['movements'][name]['start'], metadata['movements'][name]['end']
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+
+    df = {'movement': pd.Categorical.from_codes(np.repeat(np.arange(len(names)), lengths), categories=names)}
+    for name in columns:
+        array = np.load(join(corpus_dir, f'{name}.npy'), mmap_mode='r')
+        values = np.concatenate([array[start:end] for start, end in ranges]) if ranges else array[:0].copy()
+        categories = metadata['columns'][name].get('categories')
+        df[name] = values if categories is None else pd.Categorical.from_codes(values, categories=categories)
+    return pd.DataFrame(df)
+
+
+def corpus_size(corpus_dir=CORPUS_PATH):
+    """bytes the corpus takes up on disk"""
+    return sum(getsize(join(corpus_dir, filename)) for filename in os.listdir(corpus_dir))
+
+
+def compare_with_stacked_csv(corpus_dir=CORPUS_PATH, stacked_csv_path=STACKED_CSV_PATH, n_runs=20):
+    """print the size and load times of the corpus next to the stacked csv made by csvcombiner.export_stacked"""
+
+    def best_time(load):
+        times = []
+        for _ in range(n_runs):
+            start = time.perf_counter()
+            load()
+            times.append(time.perf_counter() - start)
+        return min(times) * 1000
+
+    print(f"stacked csv: {getsize(stacked_csv_path) / 1024:.1f} kB, corpus: {corpus_size(corpus_dir) / 1024:.1f} kB")
+    print(f"everything - stacked csv: {best_time(lambda: pd.read_csv(stacked_csv_path)):.2f} ms, "
+          f"corpus: {best_time(lambda: load_corpus(corpus_dir)):.2f} ms")
+    print(f"note_name, duration of c major movements - stacked csv: "
+          f"{best_time(lambda: stacked_subset(stacked_csv_path, corpus_dir)):.2f} ms, "
+          f"corpus: {best_time(lambda: load_corpus(corpus_dir, ['note_name', 'duration'], key='c major')):.2f} ms")
+
+
+def stacked_subset(stacked_csv_path, corpus_dir=CORPUS_PATH):
+    """what reading note_name, duration of the c major movements takes with the stacked csv"""
+    names = select_movements(load_corpus_metadata(corpus_dir), key='c major')
+    stacked = pd.read_csv(stacked_csv_path, usecols=['movement_name', 'note_name', 'duration'])
+    return stacked[stacked['movement_name'].str.strip().isin(names)]
+
+
+if __name__ == "__main__":
+    from CoolMelodyProject.csvcombiner import export_stacked
+
+    start = time.perf_counter()
+    save_corpus()
+    print(f"corpus saved to {CORPUS_PATH} in {time.perf_counter() - start:.3f}s")
+
+    export_stacked()
+    compare_with_stacked_csv()
@@ -1,10 +1,15 @@
 import pandas as pd
 import numpy as np
 import pretty_midi
-import collections
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 from CoolMelodyProject.csvcombiner import get_movement_filenames
 
+SONATA_PATH = '../raw_data/mozart_sonatas/'
+PIECES_FILENAME = 'mps - pieces.csv'
+
 
 ### set up dictionaries
 
@@ -23,56 +28,151 @@ bpm_converter_dict = {'2': 2, '2d': 3, '4': 1, '4d': 1.5, '8': 0.5}
 beat_dict = {'1': 4, '2': 2, '4': 1, '8': 0.5,'16': 0.25,'32': 0.125,'64': 0.0625}
 
 
+### lookup tables, so whole columns are converted at once instead of parsing every row
 
-def normalize_pitches(note, piece_key_type, piece_key):
-    """change the pitch of notes so that they're in the key of c major / a minor"""
-    if note > 0:
-        if piece_key_type == 'major':
-            note += maj_key_converter_dict[piece_key]
-        else:
-            note += min_key_converter_dict[piece_key]
-    return note
+# note name ('c4', 'f#5', 'bb3', ...): midi number, rests ('r') are 0
+NOTE_NUMBERS = {f'{letter}{accidental}{octave}': pretty_midi.note_name_to_number(f'{letter}{accidental}{octave}')
+                for letter in 'abcdefg' for accidental in ['', '#', 'b'] for octave in range(-1, 10)}
+NOTE_NUMBERS['r'] = 0
 
+# movement key ('c major', 'a minor', ...): half steps to add to get to c major / a minor
+KEY_OFFSETS = {**maj_key_converter_dict, **min_key_converter_dict}
 
-def duration_to_seconds(note, piece_spb):
-    """change the duration of notes so that they're in seconds"""
-    if type(note) != 'str':
-        note = str(note)
-    if note[-2:] == 'dd':
-        s = piece_spb * beat_dict[note[:-2]] * 1.75
-    elif note[-1] == 'd':
-        s = piece_spb * beat_dict[note[:-1]] * 1.5
-    else:
-        s = piece_spb * beat_dict[note]
-    return s
+# duration code ('4', '8d', '16dd', ...): length in beats (d = dotted, dd = double dotted)
+DURATION_BEATS = {f'{note}{dots}': beats * factor for note, beats in beat_dict.items()
+                  for dots, factor in [('', 1), ('d', 1.5), ('dd', 1.75)]}
+
+
+def movement_name(filename):
+    """'mps - K279-I.csv' -> 'K279-I'"""
+    return filename.split(' - ')[1].split('.csv')[0].strip(' ')
+
+
+def load_pieces(sonata_path=SONATA_PATH):
+    """the pieces csv indexed by movement name, with the key offset and seconds per beat of every movement"""
+    pieces = pd.read_csv(os.path.join(sonata_path, PIECES_FILENAME))
+    pieces['name'] = pieces['name'].str.strip()
+    pieces = pieces.set_index('name')
 
+    keys = pieces['key'].str.strip()
+    pieces['key_offset'] = keys.map(KEY_OFFSETS)
+    bpm = pieces['bpm'].str.split('=', expand=True)
+    pieces['spb'] = 60 / (bpm[0].map(bpm_converter_dict) * bpm[1].astype(int)).astype(int)
 
-def process_df(filename: str) -> pd.DataFrame:
+    unknown = keys[pieces['key_offset'].isna()]
+    if len(unknown):
+        raise ValueError(f"unknown keys in {PIECES_FILENAME}: {sorted(set(unknown))}")
+    return pieces
 
-    """from the csv's filename, creates a df with pitch, pitch_norm, and dur(s) columns added"""
 
-    # import pieces df
-    pieces_df = pd.read_csv('../raw_data/mozart_sonatas/mps - pieces.csv')
+def lookup(values, table, column):
+    """map a column through a lookup table, values that aren't in it are a ValueError instead of NaN"""
+    mapped = values.map(table)
+    if mapped.isna().any():
+        raise ValueError(f"unknown {column} values: {sorted(set(values[mapped.isna()]))}")
+    return mapped
 
-    # extract the K number
-    k_num = filename.split(' - ')[1].split('.csv')[0].strip(' ')
 
-    # create df
-    path = '../raw_data/mozart_sonatas/'
-    df = pd.read_csv(path + filename)  # make df
+def convert_notes(df, key_offset, spb):
+    """add pitch, pitch_norm and dur(s) columns to notes read from movement csvs, a whole column at a time
 
-    # normalize pitch
-    df['pitch'] = df.note_name.apply(lambda x: pretty_midi.note_name_to_number(x) if x != 'r' else 0)
-    piece_key = pieces_df[pieces_df['name'] == k_num]['key'].values[0].strip(' ')
-    piece_key_type = piece_key.split(' ')[1].strip(' ')
-    df['pitch_norm'] = df.pitch.apply(normalize_pitches, args=(piece_key_type, piece_key))
+    Args:
+        key_offset (int or array): half steps to c major / a minor, per movement or per row
+        spb (float or array): seconds per beat, per movement or per row
+    """
+    # normalize pitch: transpose everything but rests to c major / a minor
+    df['pitch'] = lookup(df['note_name'], NOTE_NUMBERS, 'note_name').astype(np.int64)
+    df['pitch_norm'] = np.where(df['pitch'] > 0, df['pitch'] + key_offset, df['pitch']).astype(np.int64)
 
     # get duration in seconds
-    piece_bpm = pieces_df[pieces_df['name'] == k_num]['bpm'].values[0].split('=')
-    piece_bpm_norm = int(bpm_converter_dict[piece_bpm[0]] * int(piece_bpm[1]))
-    piece_spb = 60 / piece_bpm_norm
-    df['dur(s)'] = df.duration.apply(duration_to_seconds, args=(piece_spb,))
+    df['dur(s)'] = lookup(df['duration'].astype(str), DURATION_BEATS, 'duration').to_numpy() * spb
+    return df
+
+
+def process_df(filename: str, pieces=None, sonata_path=SONATA_PATH) -> pd.DataFrame:
+
+    """from the csv's filename, creates a df with pitch, pitch_norm, and dur(s) columns added
+
+    Args:
+        pieces (pd.DataFrame): from load_pieces, pass it in when processing many movements so it's only read once
+    """
+    if pieces is None:
+        pieces = load_pieces(sonata_path)
+    piece = pieces.loc[movement_name(filename)]
 
+    df = pd.read_csv(os.path.join(sonata_path, filename))
+    return convert_notes(df, piece['key_offset'], piece['spb'])
+
+
+def process_movements(filenames=None, sonata_path=SONATA_PATH, workers=1):
+    """process_df every movement csv (all of them by default) into one df
+
+    The csvs are read (in a process pool if workers > 1) and stacked, then converted in one go: every row
+    gets its movement's key offset and seconds per beat from the pieces csv, which is only read once.
+    Rows keep the order of filenames, with a movement column (eg 'K279-I') saying which csv they come from.
+
+    Args:
+        workers (int): processes reading csvs, None for one per core. The sonata csvs are small, so reading
+                       them in this process (the default, 1) is faster than starting a pool
+    """
+    if filenames is None:
+        filenames = sorted(get_movement_filenames(sonata_path))
+    pieces = load_pieces(sonata_path)
+    paths = [os.path.join(sonata_path, filename) for filename in filenames]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) <= 1:
+        dfs = [pd.read_csv(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            dfs = list(pool.map(pd.read_csv, paths, chunksize=8))
+
+    names = [movement_name(filename) for filename in filenames]
+    df = pd.concat(dfs, ignore_index=True)
+    df.insert(0, 'movement', np.repeat(names, [len(movement_df) for movement_df in dfs]))
+
+    piece = pieces.loc[df['movement']]
+    return convert_notes(df, piece['key_offset'].to_numpy(), piece['spb'].to_numpy())
+
+
+def note_times(notes: pd.DataFrame) -> pd.DataFrame:
+
+    """start, end, step and duration in seconds of every note (not rest) of processed notes
+
+    Notes are played one after the other, so a note starts where the durations before it add up to
+    and rests only push the next start back: start and end are cumulative sums of dur(s), and rests
+    are masked out afterwards. Same result as writing the notes to midi and reading them back.
+
+    Args:
+        notes (pd.DataFrame): from process_df, or from process_movements (times restart at 0 for every movement,
+                              and the movement column is kept)
+    """
+    durations = notes['dur(s)'].to_numpy(np.float64)
+    movements = notes['movement'].to_numpy() if 'movement' in notes.columns else np.zeros(len(notes))
+    # first row of every movement (movements are contiguous, as process_movements stacks them)
+    first = np.ones(len(notes), dtype=bool)
+    first[1:] = movements[1:] != movements[:-1]
+
+    # numpy's cumsum adds one value at a time like the midi loop did, so the floats come out the same
+    ends = np.concatenate([np.cumsum(segment) for segment in np.split(durations, np.flatnonzero(first)[1:])])
+    starts = np.zeros(len(notes))
+    starts[1:] = ends[:-1]
+    starts[first] = 0.0
+
+    played = (notes['note_name'] != 'r').to_numpy()
+    starts, ends, movements = starts[played], ends[played], movements[played]
+    steps = np.zeros(len(starts))
+    steps[1:] = np.where(movements[1:] == movements[:-1], starts[1:] - starts[:-1], 0.0)
+
+    df = pd.DataFrame({
+        'pitch': notes['pitch_norm'].to_numpy(np.int64)[played],
+        'start': starts,
+        'end': ends,
+        'step': steps,
+        'duration': ends - starts,
+    })
+    if 'movement' in notes.columns:
+        df.insert(0, 'movement', movements)
     return df
 
 
@@ -80,29 +180,14 @@ def notes_to_midi(filename: str) -> pretty_midi.PrettyMIDI:
 
     """from the csv's filename, create a pretty midi object with the midi data for the piece"""
 
-    notes = process_df(filename)
-
     pm = pretty_midi.PrettyMIDI()
     instrument = pretty_midi.Instrument(
         program=pretty_midi.instrument_name_to_program(
             'Acoustic Guitar (nylon)'))
 
-    prev_start = 0
-    for i, note in notes.iterrows():
-        start = float(prev_start)
-        end = float(prev_start + note['dur(s)'])
-        if note['note_name'] == 'r':
-            start += float(note['dur(s)'])
-            prev_start = start
-        else:
-            note = pretty_midi.Note(
-                velocity=100,
-                pitch=note['pitch_norm'],
-                start=start,
-                end=end
-            )
-            instrument.notes.append(note)
-            prev_start = end
+    notes = note_times(process_df(filename))
+    for pitch, start, end in zip(notes['pitch'], notes['start'], notes['end']):
+        instrument.notes.append(pretty_midi.Note(velocity=100, pitch=int(pitch), start=float(start), end=float(end)))
 
     pm.instruments.append(instrument)
     return pm
@@ -110,28 +195,12 @@ def notes_to_midi(filename: str) -> pretty_midi.PrettyMIDI:
 
 def midi_to_notes(filename: str) -> pd.DataFrame:
 
-    """from the csv's filename, create a clean dataframe for training"""
-
-    midi = notes_to_midi(filename)
-
-    instrument = midi.instruments[0]
-    notes = collections.defaultdict(list)
+    """from the csv's filename, create a clean dataframe for training
 
-    # Sort the notes by start time
-    sorted_notes = sorted(instrument.notes, key=lambda note: note.start)
-    prev_start = sorted_notes[0].start
+    Computed straight from the notes with note_times, build a midi with notes_to_midi only to write it to a file.
+    """
 
-    for note in sorted_notes:
-        start = note.start
-        end = note.end
-        notes['pitch'].append(note.pitch)
-        notes['start'].append(start)
-        notes['end'].append(end)
-        notes['step'].append(start-prev_start)
-        notes['duration'].append(end - start)
-        prev_start = start
-
-    return pd.DataFrame({name: np.array(value) for name, value in notes.items()})
+    return note_times(process_df(filename))
 
 
 if __name__ == "__main__":
@@ -143,3 +212,7 @@ if __name__ == "__main__":
     # instrument = example_pm.instruments[0]
     df = midi_to_notes(filenames[12])
     print(df.head())
+
+    start = time.perf_counter()
+    notes = note_times(process_movements())
+    print(f"{notes['movement'].nunique()} movements, {len(notes)} notes processed in {time.perf_counter() - start:.3f}s")
@@ -27,17 +27,23 @@ def get_movement_filenames(mypath='../raw_data/mozart_sonatas', metadata_filenam
     return movement_filenames
 
 
-def get_movement_filepaths():
-    '''make a list of file paths in the data folder'''
+def get_movement_filepaths(movement_filenames=None):
+    '''make a list of file paths in the data folder
 
-    movement_filenames = get_movement_filenames()
+    pass movement_filenames (from get_movement_filenames) in to not list the folder again'''
+
+    if movement_filenames is None:
+        movement_filenames = get_movement_filenames()
     movement_filepaths = [join(mypath, filename) for filename in movement_filenames]
     return movement_filepaths
 
-def get_movement_names():
-    '''make a list of each movements name'''
+def get_movement_names(movement_filenames=None):
+    '''make a list of each movements name
 
-    movement_filenames = get_movement_filenames()
+    pass movement_filenames (from get_movement_filenames) in to not list the folder again'''
+
+    if movement_filenames is None:
+        movement_filenames = get_movement_filenames()
     movement_names = [filename.split('mps - ')[1].split('.csv')[0] for filename in movement_filenames]
     return movement_names
 
@@ -46,8 +52,10 @@ def get_movement_names():
 def get_movement_df_dict():
     '''returns a dictionary with key = movement name, and value = movement dataframe'''
 
-    movement_names = get_movement_names()
-    movement_filepaths = get_movement_filepaths()
+    # the folder is listed once, names and paths both come from that listing
+    movement_filenames = get_movement_filenames()
+    movement_names = get_movement_names(movement_filenames)
+    movement_filepaths = get_movement_filepaths(movement_filenames)
 
     movement_df_dict = {name:pd.read_csv(path) for path, name in zip(movement_filepaths,movement_names)}
     for key in movement_df_dict:
@@ -59,8 +67,9 @@ def get_movement_df_dict():
 def get_movement_df_list():
     '''returns a list of movement dataframes'''
 
-    movement_names = get_movement_names()
-    movement_filepaths = get_movement_filepaths()
+    movement_filenames = get_movement_filenames()
+    movement_names = get_movement_names(movement_filenames)
+    movement_filepaths = get_movement_filepaths(movement_filenames)
 
     movement_df_list = [pd.read_csv(path) for path in movement_filepaths]
     for i in range(len(movement_df_list)):
@@ -0,0 +1,111 @@
+import json
+import os
+from os.path import join
+
+import numpy as np
+
+ARRAY_NAMES = ['X', 'y_pitch', 'y_duration', 'sample_weights']
+MAPPING_NAMES = ['pitch_mapping', 'pitch_reverse_mapping', 'duration_mapping', 'duration_reverse_mapping']
+METADATA_FILENAME = 'metadata.json'
+SHARD_DIRNAME = 'shards'
+
+
+def save_dataset(dataset_dir, arrays, mapping_dicts):
+    """save the training arrays as .npy files that can be memory-mapped, with the mapping dicts in a json sidecar
+
+    Args:
+        dataset_dir (str): folder to save the dataset in (created if it doesn't exist)
+        arrays (dict): X, y_pitch, y_duration and sample_weights arrays
+        mapping_dicts (list): pitch_mapping, pitch_reverse_mapping, duration_mapping, duration_reverse_mapping
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+
+    metadata = {'arrays': {}}
+    for name in ARRAY_NAMES:
+        array = np.ascontiguousarray(arrays[name])
+        np.save(join(dataset_dir, f'{name}.npy'), array)
+        metadata['arrays'][name] = {'dtype': str(array.dtype), 'shape': list(array.shape)}
+
+    for name, mapping in zip(MAPPING_NAMES, mapping_dicts):
+        metadata[name] = mapping
+
+    with open(join(dataset_dir, METADATA_FILENAME), 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+
+def load_dataset(dataset_dir, mmap_mode='r'):
+    """open a dataset saved with save_dataset
+
+    Args:
+        dataset_dir (str): folder the dataset was saved in
+        mmap_mode (str): 'r' memory-maps the arrays (nothing is copied into RAM until it's used),
+                         None reads them into memory
+
+    Returns:
+        arrays (dict), mapping_dicts (list) - the mapping dicts have string keys, same as after a json round trip
+    """
+    arrays = {name: np.load(join(dataset_dir, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+
+    with open(join(dataset_dir, METADATA_FILENAME), 'r') as f:
+        metadata = json.load(f)
+    mapping_dicts = [metadata[name] for name in MAPPING_NAMES]
+
+    return arrays, mapping_dicts
+
+
+def save_sharded_dataset(dataset_dir, arrays, mapping_dicts, shard_size, seed=0):
+    """save_dataset, but split into shards of shard_size samples that can be streamed one at a time
+
+    Samples are shuffled before they're split, so every shard is a random sample of the dataset (the
+    deduplicated windows come out of prepare_data sorted).
+
+    Args:
+        shard_size (int): samples per shard, the last shard gets whatever is left
+        seed (int): seed of the shuffle
+    """
+    os.makedirs(join(dataset_dir, SHARD_DIRNAME), exist_ok=True)
+    n_samples = len(arrays['X'])
+    order = np.random.default_rng(seed).permutation(n_samples)
+
+    metadata = {'arrays': {}, 'shard_size': shard_size, 'shards': []}
+    for shard, start in enumerate(range(0, n_samples, shard_size)):
+        rows = np.sort(order[start:start + shard_size])
+        for name in ARRAY_NAMES:
+            np.save(join(dataset_dir, SHARD_DIRNAME, f'{shard:05d}-{name}.npy'), np.ascontiguousarray(arrays[name][rows]))
+        metadata['shards'].append({'samples': len(rows)})
+
+    for name in ARRAY_NAMES:
+        array = arrays[name]
+        metadata['arrays'][name] = {'dtype': str(array.dtype), 'shape': list(array.shape)}
+    for name, mapping in zip(MAPPING_NAMES, mapping_dicts):
+        metadata[name] = mapping
+
+    with open(join(dataset_dir, METADATA_FILENAME), 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+
+def load_metadata(dataset_dir):
+    """array shapes / dtypes, mapping dicts and (for sharded datasets) the shards of a saved dataset"""
+    with open(join(dataset_dir, METADATA_FILENAME), 'r') as f:
+        return json.load(f)
+
+
+def is_sharded(dataset_dir):
+    return 'shards' in load_metadata(dataset_dir)
+
+
+def load_dataset_shard(dataset_dir, shard, mmap_mode='r'):
+    """the arrays of one shard of a dataset saved with save_sharded_dataset"""
+    return {name: np.load(join(dataset_dir, SHARD_DIRNAME, f'{shard:05d}-{name}.npy'), mmap_mode=mmap_mode)
+            for name in ARRAY_NAMES}
+
+
+def export_json(json_path, arrays, mapping_dicts):
+    """save the dataset in the old data.json format"""
+
+    data_dict = {name: np.asarray(arrays[name]).tolist() for name in ARRAY_NAMES}
+    for name, mapping in zip(MAPPING_NAMES, mapping_dicts):
+        data_dict[name] = mapping
+
+    with open(json_path, 'w') as f:
+        json.dump(data_dict, f, indent=4)
@@ -0,0 +1,152 @@
+import numpy as np
+
+# how many windows remove_repeat_sequences hashes at a time
+CHUNK_SIZE = 1 << 18
+HASH_SEED = np.uint64(0x9E3779B97F4A7C15)
+
+
+def pack_windows(flat, small):
+    """windows (one per row) as uint64 words
+
+    Mapped windows only hold small integers (vocabulary indexes and the -1 padding value), so when
+    small is True each value is stored in one byte and a length 8 pitch / duration window fits in 2
+    words instead of 16. Otherwise the raw 8 byte values are used.
+    """
+    if small:
+        packed = (flat + 1).astype(np.uint8)
+    else:
+        packed = np.ascontiguousarray(flat.astype(np.float64 if flat.dtype.kind == 'f' else np.int64)).view(np.uint8)
+
+    # pad each row with zero bytes to a whole number of words
+    padding = -packed.shape[1] % 8
+    if padding:
+        packed = np.concatenate([packed, np.zeros((len(packed), padding), dtype=np.uint8)], axis=1)
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def mix(hashes):
+    """splitmix64 finalizer, spreads every input bit over the whole hash"""
+    hashes = hashes ^ (hashes >> np.uint64(30))
+    hashes = hashes * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = hashes ^ (hashes >> np.uint64(27))
+    hashes = hashes * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def window_hashes(X):
+    """a 64 bit hash of every window, equal windows always get equal hashes
+
+    Whether a window is packed into bytes only depends on its own values, so a window hashes the same
+    whichever batch it's in.
+    """
+    flat = np.asarray(X).reshape(len(X), -1)
+    small = np.zeros(len(flat), dtype=bool)
+    if flat.dtype.kind in 'iu':
+        small = (flat >= -1).all(axis=1) & (flat < 255).all(axis=1)
+
+    hashes = np.full(len(flat), HASH_SEED, dtype=np.uint64)
+    for rows, rows_small in [(small, True), (~small, False)]:
+        if rows.any():
+            row_hashes = hashes[rows]
+            for column in pack_windows(flat[rows], rows_small).T:
+                row_hashes = mix(row_hashes + column)
+            hashes[rows] = row_hashes
+    return hashes
+
+
+class WindowCounter:
+    """counts how many times each window appears, one batch of windows (a shard or a chunk) at a time
+
+    Only the unique windows are kept: their hash, count and the window / targets of their first
+    appearance, so memory grows with the number of unique windows, not the number of windows seen.
+    Hash collisions are checked for by comparing every window with the stored window of its hash.
+    """
+
+    def __init__(self):
+        self.hashes = None
+        self.counts = None
+        self.windows = None
+        self.target_pitch = None
+        self.target_duration = None
+
+    def add(self, X, y_p, y_d, counts=None):
+        """count a batch of windows and their targets, batches must be added in order
+
+        Args:
+            X (np.ndarray): windows
+            y_p, y_d (np.ndarray): target pitch / duration of each window
+            counts (np.ndarray): how many times each window appears, default once
+        """
+        y_p = np.asarray(y_p).reshape(-1)
+        y_d = np.asarray(y_d).reshape(-1)
+        if self.windows is None:
+            self.hashes = np.zeros(0, dtype=np.uint64)
+            self.counts = np.zeros(0, dtype=np.int64)
+            self.windows = X[:0]
+            self.target_pitch = y_p[:0]
+            self.target_duration = y_d[:0]
+        if not len(X):
+            return
+
+        # unique windows of this batch, with their first appearance and count
+        hashes, first, inverse = np.unique(window_hashes(X), return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        windows = X[first]
+        if (windows[inverse] != X).any():
+            raise ValueError("two different windows have the same hash")
+        batch_counts = np.bincount(inverse, weights=counts, minlength=len(hashes)).astype(np.int64)
+
+        # windows seen in earlier batches keep their first appearance, only their count goes up
+        positions = np.searchsorted(self.hashes, hashes)
+        seen = positions < len(self.hashes)
+        seen[seen] = self.hashes[positions[seen]] == hashes[seen]
+        if (self.windows[positions[seen]] != windows[seen]).any():
+            raise ValueError("two different windows have the same hash")
+        self.counts[positions[seen]] += batch_counts[seen]
+
+        # new windows are inserted so the hashes stay sorted
+        new = ~seen
+        self.hashes = np.insert(self.hashes, positions[new], hashes[new])
+        self.counts = np.insert(self.counts, positions[new], batch_counts[new])
+        self.windows = np.insert(self.windows, positions[new], windows[new], axis=0)
+        self.target_pitch = np.insert(self.target_pitch, positions[new], y_p[first][new])
+        self.target_duration = np.insert(self.target_duration, positions[new], y_d[first][new])
+
+    def result(self, threshold):
+        """windows that appeared less than threshold times with their targets, in the same (sorted)
+        order as np.unique(X, axis=0)"""
+        keep = np.flatnonzero(self.counts < threshold)
+        if len(keep):
+            flat = self.windows[keep].reshape(len(keep), -1)
+            keep = keep[np.lexsort(flat.T[::-1])]
+        return self.windows[keep], self.target_pitch[keep].reshape(-1, 1), self.target_duration[keep].reshape(-1, 1)
+
+
+def remove_repeats(X, y_p, y_d, threshold=25, chunk_size=CHUNK_SIZE):
+    """remove_repeat_sequences, hashing chunk_size windows at a time instead of sorting all of them"""
+    counter = WindowCounter()
+    for start in range(0, max(len(X), 1), chunk_size):
+        counter.add(X[start:start + chunk_size], y_p[start:start + chunk_size], y_d[start:start + chunk_size])
+    return counter.result(threshold)
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    n_windows, sequence_length = 1_000_000, 8
+    # a small pool of phrases so plenty of windows repeat, like the real dataset
+    pool = np.stack([rng.integers(-1, 40, (50_000, sequence_length)), rng.integers(-1, 20, (50_000, sequence_length))], axis=-1)
+    X = pool[rng.integers(0, len(pool), n_windows)]
+    y_p, y_d = rng.integers(0, 40, n_windows), rng.integers(0, 20, n_windows)
+
+    start = time.perf_counter()
+    _, unique_indexes, counts = np.unique(X, axis=0, return_index=True, return_counts=True)
+    indexes = unique_indexes[counts < 25]
+    expected = X[indexes], y_p[indexes].reshape(-1, 1), y_d[indexes].reshape(-1, 1)
+    print(f"np.unique(axis=0): {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    result = remove_repeats(X, y_p, y_d)
+    print(f"hashed, {CHUNK_SIZE} windows at a time: {time.perf_counter() - start:.2f}s")
+    print("same result:", all(np.array_equal(e, r) for e, r in zip(expected, result)))
@@ -0,0 +1,238 @@
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback
+
+from dataset import load_dataset_shard, load_metadata
+
+# the batch size LEARNING_RATE was tuned for, learning rates are scaled from it
+BASE_BATCH_SIZE = 16
+# train_model has always trained with batches of 16. batch_size=256 (with the learning rate scaled
+# for it) makes epochs about 5x faster on cpu, but it's opt-in since it can end up at a different model
+BATCH_SIZE = BASE_BATCH_SIZE
+# 'sqrt' suits adam, 'linear' is the usual rule for sgd, 'none' keeps the learning rate as it is
+LR_SCALING = 'sqrt'
+VALIDATION_SPLIT = 0.2
+SHUFFLE_BUFFER = 10_000
+# how many shards are read from at once when streaming a sharded dataset
+CYCLE_LENGTH = 4
+# samples handed from a shard reader to tf.data at a time
+CHUNK_SIZE = 1024
+
+
+def configure_threads(intra_op_threads=None, inter_op_threads=None):
+    """limit the threads tensorflow uses for one op (intra) and for running ops side by side (inter)
+
+    Has to be called before tensorflow runs anything, None / 0 leaves tensorflow's default (all cores).
+    """
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def scale_learning_rate(learning_rate, batch_size, rule=LR_SCALING, base_batch_size=BASE_BATCH_SIZE):
+    """learning rate for batch_size, given the one that worked for base_batch_size
+
+    A batch k times bigger means k times fewer steps per epoch, so each step is made k (linear) or
+    sqrt(k) (sqrt) times bigger.
+    """
+    ratio = batch_size / base_batch_size
+    if rule == 'linear':
+        return learning_rate * ratio
+    if rule == 'sqrt':
+        return learning_rate * np.sqrt(ratio)
+    if rule == 'none':
+        return learning_rate
+    raise ValueError(f"unknown learning rate scaling rule: {rule}")
+
+
+def train_validation_split(n_samples, validation_split=VALIDATION_SPLIT, seed=0):
+    """indexes of a shuffled train / validation split, instead of keras's validation_split which always
+    holds out the last samples
+
+    Each split is returned sorted, so reading it from a memory-mapped array goes through the file in order.
+    """
+    order = np.random.default_rng(seed).permutation(n_samples)
+    n_validation = int(round(n_samples * validation_split))
+    return np.sort(order[n_validation:]), np.sort(order[:n_validation])
+
+
+def make_dataset(X, y, sample_weights, indexes, batch_size=BATCH_SIZE, shuffle=True, seed=0):
+    """a tf.data pipeline of (X, y, sample weight) batches for model.fit
+
+    Only the indexes go through tf.data, each batch's rows are read from the arrays when the batch is
+    made. A memory-mapped dataset is never copied as a whole, so processes training on the same files
+    (eg sweep trials) share them through the page cache instead of holding a copy each.
+
+    Args:
+        X, sample_weights (np.ndarray): arrays from train_model.load_data (can be memory-mapped)
+        y (dict): pitch_output / duration_output targets
+        indexes (np.ndarray): which samples to use, eg one side of train_validation_split
+        batch_size (int): samples per step
+        shuffle (bool): reshuffle the samples every epoch (training) or keep their order (validation)
+        seed (int): shuffle seed, the same seed gives the same order of batches
+    """
+    arrays = [X, y['pitch_output'], y['duration_output'], sample_weights]
+
+    def read_batch(batch_indexes):
+        # in file order, so a memory-mapped batch is read front to back
+        batch_indexes = np.sort(batch_indexes)
+        return [np.asarray(array[batch_indexes]) for array in arrays]
+
+    def load_batch(batch_indexes):
+        tensors = tf.numpy_function(read_batch, [batch_indexes], [tf.as_dtype(array.dtype) for array in arrays])
+        for tensor, array in zip(tensors, arrays):
+            tensor.set_shape([None, *array.shape[1:]])
+        X_batch, pitch, duration, weights = tensors
+        return X_batch, {'pitch_output': pitch, 'duration_output': duration}, weights
+
+    dataset = tf.data.Dataset.from_tensor_slices(np.asarray(indexes, dtype=np.int64))
+    if shuffle:
+        # the buffer only holds indexes, so the whole split is shuffled
+        dataset = dataset.shuffle(len(indexes), seed=seed, reshuffle_each_iteration=True)
+
+    # batches are read on several threads and the next ones are ready while a step runs
+    dataset = dataset.batch(batch_size).map(load_batch, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def shard_validation_mask(n_samples, shard, validation_split=VALIDATION_SPLIT, seed=0):
+    """which samples of a shard are held out for validation, the same every time for a given seed"""
+    return np.random.default_rng([seed, shard]).random(n_samples) < validation_split
+
+
+class ShardOrder:
+    """generator of (shard, shard seed) pairs, in a new order every time it's iterated (every epoch)
+
+    Epoch e always gets the same order and seeds for a given seed, so runs are reproducible. A shard
+    seed of -1 means the shard's samples aren't shuffled.
+    """
+
+    def __init__(self, n_shards, shuffle=True, seed=0):
+        self.n_shards = n_shards
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def __call__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        self.epoch += 1
+        if not self.shuffle:
+            for shard in range(self.n_shards):
+                yield shard, -1
+            return
+        for shard in rng.permutation(self.n_shards):
+            yield shard, rng.integers(2 ** 31)
+
+
+class ShardReader:
+    """generator of the training or validation samples of one shard, in chunks of chunk_size
+
+    Only the shard being read is in memory, its samples are shuffled with the shard seed.
+    """
+
+    def __init__(self, dataset_dir, validation=False, validation_split=VALIDATION_SPLIT, seed=0, chunk_size=CHUNK_SIZE):
+        self.dataset_dir = dataset_dir
+        self.validation = validation
+        self.validation_split = validation_split
+        self.seed = seed
+        self.chunk_size = chunk_size
+
+    def __call__(self, shard, shard_seed):
+        arrays = load_dataset_shard(self.dataset_dir, int(shard))
+        mask = shard_validation_mask(len(arrays['X']), int(shard), self.validation_split, self.seed)
+        rows = np.flatnonzero(mask == self.validation)
+        if shard_seed >= 0:
+            rows = np.random.default_rng(int(shard_seed)).permutation(rows)
+
+        X, y_pitch, y_duration, sample_weights = [arrays[name][rows] for name in ['X', 'y_pitch', 'y_duration', 'sample_weights']]
+        for start in range(0, len(rows), self.chunk_size):
+            end = start + self.chunk_size
+            yield X[start:end], {'pitch_output': y_pitch[start:end], 'duration_output': y_duration[start:end]}, sample_weights[start:end]
+
+
+def make_sharded_dataset(dataset_dir, validation=False, validation_split=VALIDATION_SPLIT, batch_size=BATCH_SIZE,
+                         shuffle=True, shuffle_buffer=SHUFFLE_BUFFER, cycle_length=CYCLE_LENGTH, seed=0):
+    """make_dataset for a dataset saved with dataset.save_sharded_dataset, streamed from disk a few shards at a time
+
+    Memory stays at about cycle_length shards plus the shuffle buffer, however many shards there are.
+    The shard order and the order inside each shard change every epoch, but are the same from run to
+    run for a given seed.
+
+    Args:
+        validation (bool): stream the validation samples (held out at random in every shard) instead of the training ones
+        cycle_length (int): how many shards are read from at once, consecutive samples come from different shards
+    """
+    metadata = load_metadata(dataset_dir)
+    n_shards = len(metadata['shards'])
+    X_spec = metadata['arrays']['X']
+    chunk_signature = (
+        tf.TensorSpec([None] + X_spec['shape'][1:], X_spec['dtype']),
+        {'pitch_output': tf.TensorSpec([None, 1], metadata['arrays']['y_pitch']['dtype']),
+         'duration_output': tf.TensorSpec([None, 1], metadata['arrays']['y_duration']['dtype'])},
+        tf.TensorSpec([None, 1], metadata['arrays']['sample_weights']['dtype']),
+    )
+
+    order = tf.data.Dataset.from_generator(ShardOrder(n_shards, shuffle, seed),
+                                           output_signature=(tf.TensorSpec([], tf.int64), tf.TensorSpec([], tf.int64)))
+    reader = ShardReader(dataset_dir, validation, validation_split, seed)
+    dataset = order.interleave(
+        lambda shard, shard_seed: tf.data.Dataset.from_generator(reader, args=(shard, shard_seed),
+                                                                 output_signature=chunk_signature).unbatch(),
+        cycle_length=min(cycle_length, n_shards), num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+class TrainingSpeed(Callback):
+    """records the wall time and steps / sec of every epoch (validation included in the wall time)"""
+
+    def __init__(self):
+        super().__init__()
+        self.epoch_times = []
+        self.steps_per_sec = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._steps = 0
+        self._start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_time = time.perf_counter() - self._start
+        self.epoch_times.append(epoch_time)
+        self.steps_per_sec.append(self._steps / epoch_time)
+
+    def summary(self):
+        """mean over every epoch but the first, which also builds the training function"""
+        times = self.epoch_times[1:] or self.epoch_times
+        speeds = self.steps_per_sec[1:] or self.steps_per_sec
+        return f"{len(self.epoch_times)} epochs, {np.mean(times):.2f}s / epoch, {np.mean(speeds):.1f} steps / sec"
+
+
+if __name__ == "__main__":
+    import resource
+    import sys
+
+    from dataset import is_sharded
+    from train_model import DATASET_PATH, load_data
+
+    # stream one epoch of a dataset and report the peak memory it took, eg
+    # python input_pipeline.py data/dataset
+    dataset_path = sys.argv[1] if len(sys.argv) > 1 else DATASET_PATH
+    if is_sharded(dataset_path):
+        train_data = make_sharded_dataset(dataset_path)
+    else:
+        X, y, sample_weights, _ = load_data(dataset_path)
+        train_data = make_dataset(X, y, sample_weights, train_validation_split(len(X))[0])
+
+    start = time.perf_counter()
+    n_samples = sum(len(X_batch) for X_batch, _, _ in train_data)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{n_samples} samples in {time.perf_counter() - start:.1f}s, peak RSS {peak_rss:.0f} MB")
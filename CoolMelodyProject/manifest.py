@@ -0,0 +1,146 @@
+import glob
+import json
+import os
+from os.path import basename, isfile, join
+
+import numpy as np
+
+from dedup import WindowCounter
+from melody_corpus import MelodyCorpus, as_corpus
+from midi_cleaner import PARSER_VERSION, file_hash, read_melodies
+from prepare_data import create_sequences, map_values
+
+MANIFEST_FILENAME = 'manifest.json'
+SHARD_DIRNAME = 'shards'
+
+
+def identity_mappings(note_dfs):
+    """pitch / duration "mappings" that leave values as they are, so create_sequences makes unmapped windows"""
+    corpus = as_corpus(note_dfs)
+    pitches = set(corpus.vocabulary('pitch').astype('int64').tolist())
+    durations = set(corpus.vocabulary('duration').astype('float64').tolist())
+    pitch_mapping = {int(p): int(p) for p in pitches | {-1}}
+    duration_mapping = {float(d): float(d) for d in durations | {-1.0}}
+    return pitch_mapping, duration_mapping
+
+
+def build_shard(note_dfs, sequence_length):
+    """the statistics of one file (its melodies as dataframes or a MelodyCorpus) that merge_shards needs,
+    instead of all of its windows
+
+    Returns:
+        dict: the file's pitch / duration vocabularies, and for each unique (unmapped) window:
+              how many times it appears and the target of its first appearance
+    """
+    pitch_mapping, duration_mapping = identity_mappings(note_dfs)
+    X, y_p, y_d = create_sequences(note_dfs, sequence_length, pitch_mapping, duration_mapping)
+    X = np.asarray(X, dtype=np.float64).reshape(-1, sequence_length, 2)
+
+    if len(X):
+        windows, first_index, counts = np.unique(X, axis=0, return_index=True, return_counts=True)
+    else:
+        windows, first_index, counts = X, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    return {
+        'pitch_vocab': np.array(sorted(pitch_mapping), dtype=np.int64),
+        'duration_vocab': np.array(sorted(duration_mapping), dtype=np.float64),
+        'windows': windows,
+        'counts': counts,
+        'target_pitch': np.asarray(y_p, dtype=np.int64).reshape(-1)[first_index],
+        'target_duration': np.asarray(y_d, dtype=np.float64).reshape(-1)[first_index],
+    }
+
+
+def merge_shards(shards, threshold=25):
+    """combine file shards into the mapping dicts, X, y_pitch and y_duration that prepare_data.main makes
+
+    Gives the same result as create_mapping_dicts, create_sequences and remove_repeat_sequences on all
+    files, but only touches each file's unique windows.
+
+    Args:
+        shards (list): shards from build_shard, in the same order as the midi files
+        threshold (int): same as remove_repeat_sequences
+    """
+    # vocabularies are the union of every file's vocabulary
+    pitch_symb = sorted(set().union(*[shard['pitch_vocab'].tolist() for shard in shards]) - {-1})
+    duration_symb = sorted(set().union(*[shard['duration_vocab'].tolist() for shard in shards]) - {-1.0})
+    pitch_mapping = dict((int(c), i) for i, c in enumerate(pitch_symb))
+    pitch_reverse_mapping = dict((i, int(c)) for i, c in enumerate(pitch_symb))
+    duration_mapping = dict((float(c), i) for i, c in enumerate(duration_symb))
+    duration_reverse_mapping = dict((i, float(c)) for i, c in enumerate(duration_symb))
+    pitch_mapping[-1] = -1
+    pitch_reverse_mapping[-1] = -1
+    duration_mapping[-1.0] = -1
+    duration_reverse_mapping[-1] = -1.0
+    mapping_dicts = [pitch_mapping, pitch_reverse_mapping, duration_mapping, duration_reverse_mapping]
+
+    # map each shard's unique windows and count them one shard at a time: a window's count is the sum
+    # over shards, its target comes from the first shard it appears in
+    counter = WindowCounter()
+    for shard in shards:
+        windows = shard['windows']
+        X = np.stack([map_values(windows[..., 0].astype(np.int64), pitch_mapping),
+                      map_values(windows[..., 1], duration_mapping)], axis=-1)
+        counter.add(X, map_values(shard['target_pitch'], pitch_mapping),
+                    map_values(shard['target_duration'], duration_mapping), counts=shard['counts'])
+
+    return (mapping_dicts, *counter.result(threshold))
+
+
+def save_shard(shard_path, shard):
+    np.savez(shard_path, **shard)
+
+
+def load_shard(shard_path):
+    with np.load(shard_path) as shard:
+        return dict(shard)
+
+
+def update_shards(midi_path, manifest_dir, sequence_length, workers=None, cache_dir=None):
+    """bring the manifest up to date with the midi folder, only processing new or changed files
+
+    The manifest records each midi file's content hash and the shard it produced. A shard is reused
+    when the file's hash, the sequence length and PARSER_VERSION are all unchanged.
+
+    Returns:
+        list: the shard of every midi file, in the same order prepare_data.midi_to_dfs uses
+    """
+    shard_dir = join(manifest_dir, SHARD_DIRNAME)
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest_path = join(manifest_dir, MANIFEST_FILENAME)
+
+    old_files = {}
+    if isfile(manifest_path):
+        with open(manifest_path, 'r') as f:
+            old_files = {entry['filename']: entry for entry in json.load(f)['files']}
+
+    filenames = glob.glob(midi_path+'*')
+    entries = []
+    to_build = []
+    for filename in filenames:
+        file_id = file_hash(filename)
+        shard_name = f'{file_id}-L{sequence_length}-{PARSER_VERSION}.npz'
+        entries.append({'filename': basename(filename), 'hash': file_id, 'shard': shard_name})
+        old_entry = old_files.get(basename(filename))
+        if old_entry is None or old_entry['shard'] != shard_name or not isfile(join(shard_dir, shard_name)):
+            to_build.append((filename, shard_name))
+
+    # parse and shard the new / changed files
+    if to_build:
+        melodies = read_melodies([filename for filename, _ in to_build], workers, cache_dir)
+        for melody, (_, shard_name) in zip(melodies, to_build):
+            save_shard(join(shard_dir, shard_name), build_shard(MelodyCorpus.from_melodies([melody]).split_at_markers(), sequence_length))
+
+    # shards of files that are gone (or changed) aren't needed anymore
+    kept = {entry['shard'] for entry in entries}
+    for old_entry in old_files.values():
+        if old_entry['shard'] not in kept and isfile(join(shard_dir, old_entry['shard'])):
+            os.remove(join(shard_dir, old_entry['shard']))
+
+    with open(manifest_path, 'w') as f:
+        json.dump({'sequence_length': sequence_length, 'parser_version': PARSER_VERSION, 'files': entries}, f, indent=4)
+
+    n_removed = len(set(old_files) - {entry['filename'] for entry in entries})
+    print(f"{len(entries)} midis: {len(entries) - len(to_build)} unchanged, {len(to_build)} new or changed, {n_removed} removed")
+
+    return [load_shard(join(shard_dir, entry['shard'])) for entry in entries]
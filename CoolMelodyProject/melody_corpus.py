@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['pitch', 'duration', 'beat', 'measure']
+# same dtypes as the melody dataframes: int pitch / measure, float duration / beat
+DTYPES = {'pitch': np.int64, 'duration': np.float64, 'beat': np.float64, 'measure': np.int64}
+
+
+def lengths_to_offsets(lengths):
+    """[0, len_0, len_0 + len_1, ...] - where each melody starts, plus the total length at the end"""
+    return np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64)
+
+
+def ragged_arange(starts, lengths):
+    """concatenation of np.arange(start, start + length) for every start / length pair, without a loop"""
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = lengths_to_offsets(lengths)
+    return np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+
+
+class MelodyCorpus:
+    """every melody in one set of contiguous numpy columns, instead of a list of small dataframes
+
+    Melody i is rows offsets[i]:offsets[i + 1] of each column, so splitting, padding and finding the
+    vocabulary are a few array operations over the whole corpus.
+
+    Args:
+        columns (dict): pitch, duration, beat and measure arrays, all the same length
+        offsets (np.ndarray): where each melody starts, plus the total number of rows at the end
+    """
+
+    def __init__(self, columns, offsets):
+        self.columns = {name: np.asarray(columns[name]) for name in COLUMNS}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_melodies(cls, melodies):
+        """from [pitch, duration, beat, measure] arrays of shape (n, 4), one per melody"""
+        melodies = [np.asarray(melody, dtype=np.float64).reshape(-1, 4) for melody in melodies]
+        rows = np.concatenate(melodies) if melodies else np.zeros((0, 4))
+        columns = {name: rows[:, i].astype(DTYPES[name]) for i, name in enumerate(COLUMNS)}
+        return cls(columns, lengths_to_offsets([len(melody) for melody in melodies]))
+
+    @classmethod
+    def from_dfs(cls, dfs):
+        """from melody dataframes, like the ones midi_cleaner.split_melody_dfs makes"""
+        if not len(dfs):
+            return cls.from_melodies([])
+        columns = {name: np.concatenate([df[name].to_numpy() for df in dfs]) for name in COLUMNS}
+        return cls(columns, lengths_to_offsets([len(df) for df in dfs]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def to_dfs(self):
+        """one dataframe per melody, for code that still works on lists of dataframes"""
+        return [pd.DataFrame({name: self.columns[name][start:end] for name in COLUMNS})
+                for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def take_rows(self, starts, ends):
+        """a corpus whose melodies are rows starts[i]:ends[i] of this one"""
+        lengths = np.asarray(ends) - np.asarray(starts)
+        index = ragged_arange(starts, lengths)
+        return MelodyCorpus({name: column[index] for name, column in self.columns.items()}, lengths_to_offsets(lengths))
+
+    def select(self, melodies):
+        """a corpus of only the given melodies (indexes or a boolean mask)"""
+        melodies = np.arange(len(self))[melodies]
+        return self.take_rows(self.offsets[melodies], self.offsets[melodies + 1])
+
+    def split_at_markers(self, min_length=2):
+        """split_melody_dfs for the whole corpus: melodies are cut at their measure 0 rows (tuplets / unusual rhythms)
+
+        Like split_melody_dfs, only the stretches before a measure 0 row are kept, and only if they have at
+        least min_length notes.
+        """
+        markers = np.flatnonzero(self.columns['measure'] == 0)
+        melody = np.searchsorted(self.offsets, markers, side='right') - 1
+
+        # a stretch starts after the previous marker, or at the start of the melody for its first marker
+        starts = np.empty_like(markers)
+        starts[1:] = markers[:-1] + 1
+        first = np.ones(len(markers), dtype=bool)
+        first[1:] = melody[1:] != melody[:-1]
+        starts = np.where(first, self.offsets[melody], starts)
+
+        keep = markers - starts >= min_length
+        return self.take_rows(starts[keep], markers[keep])
+
+    def pad_start(self, pad_length, value=-1):
+        """mask_start_df for every melody: pad_length rows of value before each melody"""
+        lengths = self.lengths
+        offsets = lengths_to_offsets(lengths + pad_length)
+        rows = ragged_arange(offsets[:-1] + pad_length, lengths)
+
+        columns = {}
+        for name, column in self.columns.items():
+            columns[name] = np.full(offsets[-1], value, dtype=column.dtype)
+            columns[name][rows] = column
+        return MelodyCorpus(columns, offsets)
+
+    def vocabulary(self, name):
+        """sorted unique values of one column"""
+        return np.unique(self.columns[name])
+
+
+def as_corpus(melodies):
+    """a MelodyCorpus from either a MelodyCorpus or a list of melody dataframes"""
+    if isinstance(melodies, MelodyCorpus):
+        return melodies
+    return MelodyCorpus.from_dfs(melodies)
@@ -1,6 +1,20 @@
 import pandas as pd
+import numpy as np
 import music21 as m21
 import glob
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from os.path import isfile, join
+
+from melody_corpus import COLUMNS, DTYPES, MelodyCorpus
+from midi_reader import READER_VERSION, read_melody
+
+# bump EXTRACTOR_VERSION whenever extract_melody changes, so cached melodies are parsed again
+EXTRACTOR_VERSION = 1
+PARSER_VERSION = f'm21-{m21.__version__}-v{EXTRACTOR_VERSION}'
+# melodies from midi_reader are cached separately, in case the two ever disagree
+FAST_PARSER_VERSION = f'smf-v{READER_VERSION}'
 
 
 def import_midis(path):
@@ -37,6 +51,60 @@ key_converter_dict = {'g- major': 6, 'g major': 5, 'a- major': 4, 'a major': 3,
                       }
 
 
+def extract_melody(midi):
+    """get the melody (highest note of the first part) of one m21 parsed midi, before transposing
+
+    Returns:
+        notes (list): [pitch, duration, beat, measure] for each note, [0, 0, 0, 0] for tuplets / unusual rhythms
+        key_sig (str): key signature of the midi (eg 'b- major'), "" if there isn't one
+    """
+    notes = []
+    key_sig = ""
+    pick = midi.parts[0].recurse()
+    for element in pick:
+        if '/' in str(element.duration.quarterLength) or '/' in str(element.beat):
+            notes.append([0, 0, 0, 0])
+            continue
+        if isinstance(element, m21.note.Note):
+            notes.append([int(element.pitch.midi), float(element.duration.quarterLength), float(element.beat), int(element.measureNumber)])
+        if isinstance(element, m21.note.Rest):
+            notes.append([int(0), float(element.duration.quarterLength), float(element.beat), int(element.measureNumber)])
+        if isinstance(element, m21.chord.Chord):
+            notes.append([max([n.midi for n in element.pitches]), float(element.duration.quarterLength), float(element.beat), int(element.measureNumber)])
+        if isinstance(element, m21.key.Key):
+            key_sig = str(element).lower()
+
+    return notes, key_sig
+
+
+def ask_key_signature(midi):
+    """show the sheet music and ask for the key signature, for midis that don't include one"""
+    midi.show()
+    key_sig = input("enter the key signature of the sheet music (eg a minor, b- major, c# minor, etc): ").lower()
+    while key_sig[1] not in ['#', '-', ' '] and key_sig[0] not in ['a', 'b', 'c', 'd', 'e', 'f', 'g'] and key_sig[-5:] not in ['major', 'minor']:
+        key_sig = input("please enter a valid key signature: ")
+    return key_sig
+
+
+def melody_to_df(notes, key_sig):
+    """transpose melody notes to c major / a minor and make them a dataframe"""
+    columns = ['pitch', 'duration', 'beat', 'measure']
+    notes = [list(note) for note in notes]
+    for note in notes:
+        if note[0] == 0:
+            continue
+        note[0] += key_converter_dict[key_sig]
+
+    return pd.DataFrame(notes, columns=columns)
+
+
+def transpose_melody(notes, key_sig):
+    """melody_to_df's transposition for an (n, 4) array of notes, rests (pitch 0) stay at 0"""
+    notes = np.array(notes, dtype=np.float64).reshape(-1, 4)
+    notes[notes[:, 0] != 0, 0] += key_converter_dict[key_sig]
+    return notes
+
+
 def midi_to_melody_df(midi_list):
     """converts list of m21 parsed midis into list of melody dataframes, where each row is one note,
     with columns for pitch, duration, beat, and measure.
@@ -51,45 +119,95 @@ def midi_to_melody_df(midi_list):
     Args:
         midi_list(list): list of midis created with import_midis function
     """
-    columns = ['pitch', 'duration', 'beat', 'measure']
     note_dfs = []
 
     for midi in midi_list:
         # get notes from midis
-        notes = []
-        key_sig = ""
-        pick = midi.parts[0].recurse()
-        for element in pick:
-            if '/' in str(element.duration.quarterLength) or '/' in str(element.beat):
-                notes.append([0, 0, 0, 0])
-                continue
-            if isinstance(element, m21.note.Note):
-                notes.append([int(element.pitch.midi), float(element.duration.quarterLength), float(element.beat), int(element.measureNumber)])
-            if isinstance(element, m21.note.Rest):
-                notes.append([int(0), float(element.duration.quarterLength), float(element.beat), int(element.measureNumber)])
-            if isinstance(element, m21.chord.Chord):
-                notes.append([max([n.midi for n in element.pitches]), float(element.duration.quarterLength), float(element.beat), int(element.measureNumber)])
-            if isinstance(element, m21.key.Key):
-                key_sig = str(element).lower()
+        notes, key_sig = extract_melody(midi)
 
         # transpose to c major / a minor
         if key_sig == "":
-            midi.show()
-            key_sig = input("enter the key signature of the sheet music (eg a minor, b- major, c# minor, etc): ").lower()
-            while key_sig[1] not in ['#', '-', ' '] and key_sig[0] not in ['a', 'b', 'c', 'd', 'e', 'f', 'g'] and key_sig[-5:] not in ['major', 'minor']:
-                key_sig = input("please enter a valid key signature: ")
-
-        for note in notes:
-            if note[0] == 0:
-                continue
-            note[0] += key_converter_dict[key_sig]
+            key_sig = ask_key_signature(midi)
 
         # create df and add to list
-        note_dfs.append(pd.DataFrame(notes, columns=columns))
+        note_dfs.append(melody_to_df(notes, key_sig))
 
     return note_dfs
 
 
+def file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def parse_melody(filename):
+    """parse one midi file and extract its melody, run in the worker processes of import_melodies"""
+    notes, key_sig = extract_melody(m21.converter.parse(filename))
+    return np.array(notes, dtype=np.float64).reshape(-1, 4), key_sig
+
+
+def import_melodies(path, workers=None, cache_dir=None, fast=False):
+    """same as midi_to_melody_df(import_midis(path)), but the midis are parsed in a process pool
+    and each file's melody is cached, so later runs only parse new or changed files
+
+    Cached melodies are keyed by the file's content hash and PARSER_VERSION, so editing a midi file,
+    upgrading music21 or changing extract_melody all cause a re-parse.
+
+    Args:
+        path (str): path to folder that has midi files
+        workers (int): number of processes to parse with, None uses every cpu, 1 parses in this process
+        cache_dir (str): folder for the melody cache, None turns the cache off
+        fast (bool): read the midis with midi_reader.read_melody instead of music21
+    """
+    return import_melody_files(glob.glob(path+'*'), workers, cache_dir, fast)
+
+
+def import_melody_files(filenames, workers=None, cache_dir=None, fast=False):
+    """import_melodies for a list of midi files instead of a folder"""
+    # same dtypes as midi_to_melody_df: int pitch / measure, float duration / beat
+    return [pd.DataFrame(melody, columns=COLUMNS).astype(DTYPES) for melody in read_melodies(filenames, workers, cache_dir, fast)]
+
+
+def read_melodies(filenames, workers=None, cache_dir=None, fast=False):
+    """the transposed melody of every midi file as an (n, 4) [pitch, duration, beat, measure] array,
+    parsed in a process pool / loaded from the cache like import_melodies"""
+    parse = read_melody if fast else parse_melody
+    parser_version = FAST_PARSER_VERSION if fast else PARSER_VERSION
+    cache_paths = [None] * len(filenames)
+    melodies = [None] * len(filenames)
+
+    # load every melody that is already cached
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        for i, filename in enumerate(filenames):
+            cache_paths[i] = join(cache_dir, f'{file_hash(filename)}-{parser_version}.npz')
+            if isfile(cache_paths[i]):
+                with np.load(cache_paths[i]) as cached:
+                    melodies[i] = (cached['notes'], str(cached['key_sig']))
+
+    # parse everything else
+    to_parse = [i for i, melody in enumerate(melodies) if melody is None]
+    if workers == 1 or len(to_parse) <= 1:
+        parsed = [parse(filenames[i]) for i in to_parse]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(parse, [filenames[i] for i in to_parse]))
+
+    for i, (notes, key_sig) in zip(to_parse, parsed):
+        # midis without a key signature are asked about here, and the answer is cached with the melody
+        if key_sig == "":
+            key_sig = ask_key_signature(m21.converter.parse(filenames[i]))
+        melodies[i] = (notes, key_sig)
+        if cache_paths[i] is not None:
+            np.savez(cache_paths[i], notes=notes, key_sig=key_sig)
+
+    n_cached = len(filenames) - len(to_parse)
+    hit_rate = n_cached / len(filenames) if filenames else 0
+    print(f"{len(filenames)} midis: {n_cached} from cache, {len(to_parse)} parsed ({hit_rate:.0%} cache hit rate)")
+
+    return [transpose_melody(notes, key_sig) for notes, key_sig in melodies]
+
+
 def split_melody_dfs(df_list):
     """split melody dfs into separate dataframes based on where measure is 0
     (ie where there were tuplets / strange rhythms).
@@ -98,18 +216,7 @@ def split_melody_dfs(df_list):
     Args:
         df_list (list): a list of dataframes made with the midi_to_melody_df function
     """
-    split_dfs = []
-
-    for df in df_list:
-        prev_0 = -1
-        for i, val in df.iterrows():
-            if val.measure == 0:
-                new_df = df[prev_0+1: i].reset_index(drop=True)
-                if len(new_df) > 1:
-                    split_dfs.append(new_df)
-                prev_0 = i
-
-    return split_dfs
+    return MelodyCorpus.from_dfs(df_list).split_at_markers().to_dfs()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,463 @@
+import struct
+
+import numpy as np
+
+# bump READER_VERSION whenever read_melody changes, so cached melodies are parsed again
+READER_VERSION = 1
+
+# offsets and durations are whole numbers of 48ths of a quarter note, which fits 16ths, triplet 8ths and
+# every bar / beat length (down to 32nd note time signatures)
+UNITS_PER_QUARTER = 48
+# same grid music21 quantizes midi to: 16th notes and 8th note triplets
+QUANTIZE_DIVISORS = (4, 3)
+
+# music21's classSortOrder, which decides the order of elements that share an offset
+INSTRUMENT_ORDER = -25
+TEMPO_ORDER = 1
+KEY_ORDER = 2
+TIME_SIGNATURE_ORDER = 4
+VOICE_ORDER = 5
+NOTE_ORDER = 20
+
+# insertion order of elements with the same offset and sort order: notes, then tied-over notes, then rests
+NOTE, TIE, REST = 0, 1, 2
+
+# key signature meta events give the number of sharps (negative for flats), index with sharps + 7
+MAJOR_KEYS = ['c-', 'g-', 'd-', 'a-', 'e-', 'b-', 'f', 'c', 'g', 'd', 'a', 'e', 'b', 'f#', 'c#']
+MINOR_KEYS = ['a-', 'e-', 'b-', 'f', 'c', 'g', 'd', 'a', 'e', 'b', 'f#', 'c#', 'g#', 'd#', 'a#']
+
+
+def read_variable_length(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+def read_track(data):
+    """split one MTrk chunk into note on / off events and the meta events read_melody uses
+
+    Returns:
+        notes (list): (tick, is_note_on, pitch, channel) in file order
+        metas (list): (tick, kind, value) for tempo, time signature, key signature and instrument events
+    """
+    notes = []
+    metas = []
+    tick = 0
+    pos = 0
+    running_status = 0
+    while pos < len(data):
+        delta, pos = read_variable_length(data, pos)
+        tick += delta
+        status = running_status
+        if data[pos] & 0x80:
+            status = data[pos]
+            pos += 1
+        # only channel messages can be followed by running status
+        if status < 0xF0:
+            running_status = status
+
+        if status == 0xFF:
+            meta_type = data[pos]
+            length, pos = read_variable_length(data, pos + 1)
+            value = data[pos:pos + length]
+            pos += length
+            if meta_type == 0x51:
+                metas.append((tick, TEMPO_ORDER, None))
+            elif meta_type == 0x58:
+                metas.append((tick, TIME_SIGNATURE_ORDER, (value[0], 2 ** value[1])))
+            elif meta_type == 0x59:
+                sharps = struct.unpack('b', value[:1])[0]
+                metas.append((tick, KEY_ORDER, (MINOR_KEYS if value[1] == 1 else MAJOR_KEYS)[sharps + 7] + (' minor' if value[1] == 1 else ' major')))
+            elif meta_type in (0x03, 0x04):
+                metas.append((tick, INSTRUMENT_ORDER, None))
+        elif status in (0xF0, 0xF7):
+            length, pos = read_variable_length(data, pos)
+            pos += length
+        else:
+            kind = status & 0xF0
+            if kind in (0xC0, 0xD0):
+                if kind == 0xC0:
+                    metas.append((tick, INSTRUMENT_ORDER, None))
+                pos += 1
+                continue
+            pitch, velocity = data[pos], data[pos + 1]
+            pos += 2
+            if kind == 0x90 or kind == 0x80:
+                notes.append((tick, kind == 0x90 and velocity > 0, pitch, status & 0x0F))
+
+    return notes, metas
+
+
+def read_smf(data):
+    """ticks per quarter note and the (notes, metas) of every track of a standard midi file"""
+    if data[:4] != b'MThd':
+        raise ValueError("not a standard midi file")
+    header_length, _, n_tracks, division = struct.unpack('>IHHH', data[4:14])
+    if division & 0x8000:
+        raise ValueError("smpte time division is not supported")
+
+    tracks = []
+    pos = 8 + header_length
+    while len(tracks) < n_tracks and pos < len(data):
+        chunk_type = data[pos:pos + 4]
+        chunk_length = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        if chunk_type == b'MTrk':
+            tracks.append(read_track(data[pos + 8:pos + 8 + chunk_length]))
+        pos += 8 + chunk_length
+
+    return division, tracks
+
+
+def pair_notes(note_events):
+    """onset tick, offset tick and pitch of every note, in order of onset
+
+    A note on ends at the next note off (or velocity 0 note on) of the same pitch and channel, as in music21.
+    """
+    pending = {}
+    onsets = []
+    offsets = []
+    pitches = []
+    for tick, is_note_on, pitch, channel in note_events:
+        if is_note_on:
+            pending.setdefault((pitch, channel), []).append(len(onsets))
+            onsets.append(tick)
+            offsets.append(-1)
+            pitches.append(pitch)
+        else:
+            for i in pending.pop((pitch, channel), []):
+                offsets[i] = tick
+
+    onsets, offsets, pitches = np.array(onsets, dtype=np.int64), np.array(offsets, dtype=np.int64), np.array(pitches, dtype=np.int64)
+    ended = offsets >= 0
+    return onsets[ended], offsets[ended], pitches[ended]
+
+
+def group_chords(onsets, offsets, pitches, tolerance):
+    """gather notes that start (and end) within tolerance ticks of each other into chords, like music21 does
+
+    Returns:
+        onsets, durations (in ticks) and highest pitches of the notes / chords, and whether any notes
+        started together but ended apart (which music21 puts in separate voices)
+    """
+    onsets, offsets, pitches = onsets.tolist(), offsets.tolist(), pitches.tolist()
+    gathered = [False] * len(onsets)
+    voices_required = False
+    chord_onsets = []
+    chord_durations = []
+    chord_pitches = []
+    for i in range(len(onsets)):
+        if gathered[i]:
+            continue
+        top = pitches[i]
+        last = i
+        for j in range(i + 1, len(onsets)):
+            if onsets[j] - onsets[i] >= tolerance:
+                break
+            if abs(offsets[j] - offsets[i]) > tolerance:
+                voices_required = True
+                continue
+            top = max(top, pitches[j])
+            last = j
+            gathered[j] = True
+        # music21 times a chord by its last note
+        chord_onsets.append(onsets[i])
+        chord_durations.append(offsets[last] - onsets[last])
+        chord_pitches.append(top)
+
+    return (np.array(chord_onsets, dtype=np.int64), np.array(chord_durations, dtype=np.int64),
+            np.array(chord_pitches, dtype=np.int64), voices_required)
+
+
+def quantize(quarter_lengths, gaps=None, zero_allowed=True):
+    """music21's Stream.quantize grid choice for a whole array of quarterLengths at once
+
+    Each value goes to the nearest multiple of 1/4 or 1/3 (whichever is closer, 1/4 on ties). For durations,
+    gaps is the distance to the next note: a grid whose multiples can't reach it exactly is only picked
+    when it leaves less of the gap unfilled.
+
+    Returns:
+        np.ndarray: quantized values in UNITS_PER_QUARTER units
+    """
+    quarter_lengths = np.asarray(quarter_lengths, dtype=np.float64)
+    best = None
+    # smallest tick first, so it wins ties
+    for divisor in sorted(QUANTIZE_DIVISORS, reverse=True):
+        tick = 1 / divisor
+        mult = np.floor(quarter_lengths / tick)
+        match_low = tick * mult
+        use_low = (match_low <= quarter_lengths) & (quarter_lengths <= match_low + tick / 2.0)
+        match = np.where(use_low, match_low, tick * (mult + 1))
+        if not zero_allowed:
+            match = np.where(match == 0, tick, match)
+        error = np.abs(np.round(quarter_lengths - match, 7))
+
+        remaining_gap = np.zeros_like(quarter_lengths)
+        if gaps is not None:
+            has_gap = ~np.isnan(gaps)
+            filled = np.mod(np.where(has_gap, gaps, 0), tick) == 0
+            remaining_gap = np.where(has_gap & ~filled, np.maximum(gaps - match, 0.0), 0.0)
+
+        if best is None:
+            best = (remaining_gap, error, match)
+        else:
+            better = (remaining_gap < best[0]) | ((remaining_gap == best[0]) & (error < best[1]))
+            best = tuple(np.where(better, new, old) for new, old in zip((remaining_gap, error, match), best))
+
+    return np.rint(best[2] * UNITS_PER_QUARTER).astype(np.int64)
+
+
+def bar_and_beat_length(numerator, denominator):
+    """bar and beat length in units, beats are grouped in threes for compound meters (eg 6/8, 3/8, 6/4)"""
+    unit = 4 * UNITS_PER_QUARTER // denominator
+    if numerator % 3 == 0 and (numerator > 3 or denominator >= 8):
+        return numerator * unit, 3 * unit
+    return numerator * unit, unit
+
+
+def make_measures(ts_offsets, ts_values, end):
+    """start, bar length and beat length of every measure up to end, each using the time signature at its start"""
+    starts = []
+    bar_lengths = []
+    beat_lengths = []
+    start = 0
+    while True:
+        bar_length, beat_length = bar_and_beat_length(*ts_values[np.searchsorted(ts_offsets, start, side='right') - 1])
+        starts.append(start)
+        bar_lengths.append(bar_length)
+        beat_lengths.append(beat_length)
+        start += bar_length
+        if start >= end:
+            break
+    return np.array(starts), np.array(bar_lengths), np.array(beat_lengths)
+
+
+def assign_voices(starts, ends, measures, voices_required):
+    """music21's makeVoices: in measures where notes overlap, each note goes in the first voice that is free
+
+    Returns:
+        voices (np.ndarray): voice of each note, -1 for notes outside voices
+        voiced (np.ndarray): note indexes of measures that have voices
+    """
+    voices = np.full(len(starts), -1, dtype=np.int64)
+    if not voices_required or not len(starts):
+        return voices, np.zeros(0, dtype=np.int64)
+
+    # a note overlaps if it starts before an earlier note of its measure has ended
+    span = int(ends.max()) + 1
+    running_end = np.maximum.accumulate(measures * span + ends)
+    overlaps = np.zeros(len(starts), dtype=bool)
+    overlaps[1:] = (measures[1:] == measures[:-1]) & (measures[1:] * span + starts[1:] < running_end[:-1])
+    voiced = np.unique(measures[overlaps])
+
+    for measure in voiced.tolist():
+        voice_ends = []
+        for i in np.flatnonzero(measures == measure).tolist():
+            voice = next((v for v, voice_end in enumerate(voice_ends) if voice_end <= starts[i]), len(voice_ends))
+            if voice == len(voice_ends):
+                voice_ends.append(0)
+            voice_ends[voice] = max(voice_ends[voice], ends[i])
+            voices[i] = voice
+
+    return voices, voiced
+
+
+def read_melody(filename):
+    """the melody of a midi file, read straight from its note events instead of through music21 streams
+
+    Gives the same rows as midi_cleaner.parse_melody: music21's quantizing, chords (highest note), measures,
+    notes tied over barlines, rests, voices and beats are all worked out on arrays of tick times.
+
+    Returns:
+        notes (np.ndarray): shape (n, 4) [pitch, duration, beat, measure] rows, [0, 0, 0, 0] for tuplets / unusual rhythms
+        key_sig (str): key signature of the midi (eg 'b- major'), "" if there isn't one
+    """
+    with open(filename, 'rb') as f:
+        ticks_per_quarter, tracks = read_smf(f.read())
+
+    # the first track with notes is the melody part, tracks without notes before it are the conductor
+    melody_track = next((i for i, (notes, _) in enumerate(tracks) if any(event[1] for event in notes)), None)
+    if melody_track is None:
+        return np.zeros((0, 4)), ""
+    note_events, track_metas = tracks[melody_track]
+    conductor_metas = [meta for notes, metas in tracks[:melody_track] for meta in metas]
+
+    onsets, offsets, pitches = pair_notes(note_events)
+    onsets, durations, pitches, voices_required = group_chords(onsets, offsets, pitches, ticks_per_quarter / max(QUANTIZE_DIVISORS))
+
+    # quantize, with each note's duration pulled towards the next offset of its track
+    track_meta_ticks = np.array([meta[0] for meta in track_metas], dtype=np.int64)
+    starts = quantize(onsets / ticks_per_quarter)
+    track_offsets = np.unique(np.concatenate([starts, quantize(track_meta_ticks / ticks_per_quarter)]))
+    next_index = np.searchsorted(track_offsets, starts, side='right')
+    has_next = next_index < len(track_offsets)
+    gaps = np.where(has_next, track_offsets[np.minimum(next_index, len(track_offsets) - 1)] - starts, np.nan) / UNITS_PER_QUARTER
+    ends = starts + quantize(durations / ticks_per_quarter, gaps, zero_allowed=False)
+
+    # meta events of the track, then the conductor's
+    metas = track_metas + conductor_metas
+    meta_offsets = quantize(np.array([meta[0] for meta in metas], dtype=np.int64) / ticks_per_quarter)
+    meta_orders = np.array([meta[1] for meta in metas], dtype=np.int64)
+
+    # measures follow the conductor's time signatures (4/4 if it has none at the start), or else the track's
+    time_signatures = [(offset, meta[2]) for offset, meta in zip(meta_offsets.tolist(), metas) if meta[1] == TIME_SIGNATURE_ORDER]
+    conductor_signatures = time_signatures[len([m for m in track_metas if m[1] == TIME_SIGNATURE_ORDER]):]
+    time_signatures = conductor_signatures or time_signatures
+    if not any(offset == 0 for offset, _ in time_signatures):
+        time_signatures = [(0, (4, 4))] + time_signatures
+    time_signatures.sort(key=lambda ts: ts[0])
+    end = max(ends.max(initial=0), meta_offsets.max(initial=0))
+    measure_starts, bar_lengths, beat_lengths = make_measures(np.array([ts[0] for ts in time_signatures]), [ts[1] for ts in time_signatures], end)
+    measure_ends = measure_starts + bar_lengths
+    n_measures = len(measure_starts)
+
+    # notes in measures with overlapping notes get voices
+    measures = np.searchsorted(measure_starts, starts, side='right') - 1
+    voices, voiced_measures = assign_voices(starts, ends, measures, voices_required)
+    voiced = np.zeros(n_measures + 1, dtype=bool)
+    voiced[voiced_measures] = True
+
+    pieces = split_at_barlines(starts, ends, measures, voices, pitches, measure_ends, voiced)
+    rests = fill_rests(pieces, meta_offsets, measure_starts, measure_ends, voiced)
+
+    # meta events only make a row when they fall on a tuplet beat (key signatures are needed for key_sig)
+    meta_measures = np.searchsorted(measure_starts, meta_offsets, side='right') - 1
+    in_measure = meta_offsets < measure_ends[-1]
+    meta_rows = {
+        'start': meta_offsets[in_measure], 'end': meta_offsets[in_measure], 'measure': meta_measures[in_measure],
+        'container': np.full(in_measure.sum(), -1), 'order': meta_orders[in_measure], 'kind': np.full(in_measure.sum(), NOTE),
+        'parent_start': np.zeros(in_measure.sum(), dtype=np.int64), 'parent_kind': np.zeros(in_measure.sum(), dtype=np.int64),
+        'index': np.flatnonzero(in_measure), 'pitch': np.zeros(in_measure.sum(), dtype=np.int64),
+    }
+    rows = {name: np.concatenate([pieces[name], rests[name], meta_rows[name]]) for name in meta_rows}
+
+    # music21's recurse order: by measure, then offset / sort order in the measure, with each voice's
+    # notes together at the start of the measure
+    in_voice = rows['container'] >= 0
+    offset_in_measure = rows['start'] - measure_starts[rows['measure']]
+    order = np.lexsort((rows['index'], rows['parent_kind'], rows['parent_start'], rows['kind'], rows['order'], offset_in_measure,
+                        rows['container'], np.where(in_voice, VOICE_ORDER, rows['order']), np.where(in_voice, 0, offset_in_measure),
+                        rows['measure']))
+    rows = {name: values[order] for name, values in rows.items()}
+    offset_in_measure = offset_in_measure[order]
+
+    is_meta = rows['order'] != NOTE_ORDER
+    key_rows = np.flatnonzero(rows['order'] == KEY_ORDER)
+    key_sig = metas[rows['index'][key_rows[-1]]][2] if len(key_rows) else ""
+
+    # tuplets: durations that aren't a whole number of 16ths / 32nds..., or beats that aren't
+    duration = rows['end'] - rows['start']
+    beat_length = beat_lengths[rows['measure']]
+    beat_denominator = beat_length // np.gcd(offset_in_measure, beat_length)
+    tuplet = (duration % 3 != 0) | ((beat_denominator & (beat_denominator - 1)) != 0)
+
+    keep = ~is_meta | tuplet
+    notes = np.stack([
+        rows['pitch'],
+        duration / UNITS_PER_QUARTER,
+        1 + offset_in_measure / beat_length,
+        rows['measure'] + 1,
+    ], axis=-1).astype(np.float64)
+    notes[tuplet] = 0
+    return notes[keep], key_sig
+
+
+def split_at_barlines(starts, ends, measures, voices, pitches, measure_ends, voiced):
+    """music21's makeTies: notes that run past their barline are cut there, with the rest tied into the next measure
+
+    A tied-over note in a measure with voices goes in its first voice if the note came from a measure without
+    voices, otherwise it stays outside the voices (and isn't split again).
+    """
+    level = {
+        'start': starts, 'end': ends, 'measure': measures, 'container': voices, 'kind': np.full(len(starts), NOTE),
+        'parent_start': np.zeros(len(starts), dtype=np.int64), 'parent_kind': np.zeros(len(starts), dtype=np.int64),
+        'index': np.arange(len(starts)), 'pitch': pitches, 'order': np.full(len(starts), NOTE_ORDER),
+    }
+    pieces = []
+    while len(level['start']):
+        measure_end = measure_ends[level['measure']]
+        split = (level['end'] > measure_end) & ~(voiced[level['measure']] & (level['container'] < 0))
+        tails = {name: values[split] for name, values in level.items()}
+
+        piece = dict(level)
+        piece['end'] = np.where(split, measure_end, level['end'])
+        pieces.append(piece)
+
+        next_measure = tails['measure'] + 1
+        from_voices = voiced[tails['measure']]
+        level = dict(tails)
+        level.update({
+            'start': measure_end[split], 'measure': next_measure, 'kind': np.full(split.sum(), TIE),
+            'container': np.where(voiced[next_measure] & ~from_voices, 0, -1),
+            'parent_start': tails['start'], 'parent_kind': tails['kind'],
+        })
+
+    return {name: np.concatenate([piece[name] for piece in pieces]) for name in pieces[0]}
+
+
+def fill_rests(pieces, meta_offsets, measure_starts, measure_ends, voiced):
+    """music21's makeRests: a rest for every gap in a measure (or in each of its voices) where nothing sounds
+
+    Meta events (eg tempo changes) outside voices are zero length elements, so they split a gap in two.
+    """
+    n_measures = len(measure_starts)
+    meta_offsets = meta_offsets[meta_offsets < measure_ends[-1]]
+    meta_measures = np.searchsorted(measure_starts, meta_offsets, side='right') - 1
+
+    # a gap is found in every (measure, voice) container, except outside the voices of a measure with voices
+    containers = np.concatenate([pieces['container'], np.full(len(meta_offsets), -1)])
+    measures = np.concatenate([pieces['measure'], meta_measures])
+    starts = np.concatenate([pieces['start'], meta_offsets])
+    ends = np.concatenate([pieces['end'], meta_offsets])
+    checked = ~voiced[measures] | (containers >= 0)
+    containers, measures, starts, ends = containers[checked], measures[checked], starts[checked], ends[checked]
+
+    # every container starts and ends with an empty element at its barlines
+    voice_containers = np.unique(np.stack([measures, containers], axis=-1)[containers >= 0], axis=0).reshape(-1, 2)
+    bounds_measures = np.concatenate([np.flatnonzero(~voiced[:n_measures]), voice_containers[:, 0]])
+    bounds_containers = np.concatenate([np.full((~voiced[:n_measures]).sum(), -1), voice_containers[:, 1]])
+    measures = np.concatenate([measures, bounds_measures, bounds_measures])
+    containers = np.concatenate([containers, bounds_containers, bounds_containers])
+    starts = np.concatenate([starts, measure_starts[bounds_measures], measure_ends[bounds_measures]])
+    ends = np.concatenate([ends, measure_starts[bounds_measures], measure_ends[bounds_measures]])
+
+    order = np.lexsort((ends, starts, containers, measures))
+    measures, containers, starts, ends = measures[order], containers[order], starts[order], ends[order]
+
+    # absolute times only grow from one container to the next, once each container is shifted past the last
+    group = np.concatenate([[0], np.cumsum((measures[1:] != measures[:-1]) | (containers[1:] != containers[:-1]))])
+    span = int(measure_ends[-1]) + 1
+    running_end = np.maximum.accumulate(group * span + ends) - group * span
+    gap = np.zeros(len(starts), dtype=bool)
+    gap[1:] = (group[1:] == group[:-1]) & (starts[1:] > running_end[:-1])
+    gap_index = np.flatnonzero(gap)
+
+    n_rests = len(gap_index)
+    return {
+        'start': running_end[gap_index - 1], 'end': starts[gap_index], 'measure': measures[gap_index],
+        'container': containers[gap_index], 'kind': np.full(n_rests, REST),
+        'parent_start': np.zeros(n_rests, dtype=np.int64), 'parent_kind': np.zeros(n_rests, dtype=np.int64),
+        'index': np.arange(n_rests), 'pitch': np.zeros(n_rests, dtype=np.int64), 'order': np.full(n_rests, NOTE_ORDER),
+    }
+
+
+if __name__ == "__main__":
+    import glob
+    import time
+
+    from midi_cleaner import parse_melody
+
+    for filename in sorted(glob.glob('../raw_data/mozart_midis/*')):
+        start = time.perf_counter()
+        expected_notes, expected_key = parse_melody(filename)
+        music21_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        notes, key_sig = read_melody(filename)
+        reader_time = time.perf_counter() - start
+
+        same = key_sig == expected_key and np.array_equal(notes, expected_notes)
+        print(f"{filename}: {len(notes)} rows, music21 {music21_time:.2f}s, read_melody {reader_time * 1000:.1f}ms, same: {same}")
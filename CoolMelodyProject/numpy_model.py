@@ -0,0 +1,212 @@
+import time
+import numpy as np
+
+KERAS_MODEL_PATH = '../model.h5'
+WEIGHTS_PATH = '../model.npz'
+
+# layers of train_model.build_model that hold weights (dropout layers do nothing at inference)
+LSTM_LAYERS = ['first_LSTM', 'pitch_LSTM', 'duration_LSTM']
+DENSE_LAYERS = ['pitch_dense', 'pitch_output', 'duration_dense', 'duration_output']
+
+
+def model_weights(model):
+    """the weights of a keras model made with train_model.build_model, as float32 arrays keyed by layer/weight name"""
+    weights = {}
+    for name in LSTM_LAYERS:
+        kernel, recurrent_kernel, bias = model.get_layer(name).get_weights()
+        weights[f'{name}/kernel'] = kernel
+        weights[f'{name}/recurrent_kernel'] = recurrent_kernel
+        weights[f'{name}/bias'] = bias
+    for name in DENSE_LAYERS:
+        kernel, bias = model.get_layer(name).get_weights()
+        weights[f'{name}/kernel'] = kernel
+        weights[f'{name}/bias'] = bias
+    return {key: value.astype(np.float32) for key, value in weights.items()}
+
+
+def export_weights(model, weights_path):
+    """save the weights of a keras model made with train_model.build_model as a .npz file
+    (bundle.quantize_weights makes the float16 / int8 variants)
+
+    Args:
+        model (keras.Model): trained model from train_model.build_model
+        weights_path (str): where to save the .npz file
+    """
+    np.savez(weights_path, **model_weights(model))
+
+
+def matmul(x, kernel, scale=None):
+    """x @ kernel in float32 for a float32, float16 or int8 kernel (int8 ones have a scale per output unit)
+
+    The kernel is only turned into float32 for the product, so quantized weights stay small in memory.
+    Scaling the columns of x @ kernel is the same as scaling the columns of the kernel.
+    """
+    out = x @ kernel if kernel.dtype == np.float32 else x @ kernel.astype(np.float32)
+    return out if scale is None else out * scale
+
+
+def weights_quantization(weights):
+    """which of bundle.QUANTIZATIONS saved weights were stored with"""
+    if any(key.endswith('/scale') for key in weights):
+        return 'int8'
+    if any(np.asarray(value).dtype == np.float16 for value in weights.values()):
+        return 'float16'
+    return 'float32'
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def lstm_step(x_proj, h, c, recurrent_kernel, recurrent_scale=None):
+    """one keras LSTM timestep (gate order i, f, c, o), where x_proj = x @ kernel + bias"""
+    z = x_proj + matmul(h, recurrent_kernel, recurrent_scale)
+    i, f, g, o = np.split(z, 4, axis=-1)
+    c = sigmoid(f) * c + sigmoid(i) * np.tanh(g)
+    h = sigmoid(o) * np.tanh(c)
+    return h, c
+
+
+def lstm(x, kernel, recurrent_kernel, bias, return_sequences=False, kernel_scale=None, recurrent_scale=None):
+    """keras LSTM layer with tanh activation and sigmoid recurrent activation
+
+    Args:
+        x (np.ndarray): input of shape (batch, timesteps, features)
+        kernel_scale, recurrent_scale (np.ndarray): scales of int8 kernels, see matmul
+    """
+    units = recurrent_kernel.shape[0]
+    h = np.zeros((x.shape[0], units), dtype=x.dtype)
+    c = np.zeros((x.shape[0], units), dtype=x.dtype)
+
+    # the input projection doesn't depend on the state, so do it for every timestep at once
+    x_proj = matmul(x, kernel, kernel_scale) + bias
+
+    outputs = []
+    for t in range(x.shape[1]):
+        h, c = lstm_step(x_proj[:, t], h, c, recurrent_kernel, recurrent_scale)
+        outputs.append(h)
+
+    return np.stack(outputs, axis=1) if return_sequences else h
+
+
+class NumpyMelodyModel:
+    """forward pass of the train_model.build_model architecture written in numpy, so serving doesn't need tensorflow
+
+    Quantized weights are kept as they are stored and only turned into float32 for each product (see matmul),
+    so a float16 / int8 model also takes half / a quarter of the memory once loaded. The forward pass itself
+    is float32 for every variant.
+
+    Args:
+        weights (dict): layer weights as saved by export_weights, quantized or not
+    """
+
+    def __init__(self, weights):
+        self.quantization = weights_quantization(weights)
+        self.weights = {key: np.asarray(value) for key, value in weights.items()}
+
+    @classmethod
+    def load(cls, weights_path):
+        with np.load(weights_path) as weights:
+            return cls(dict(weights))
+
+    def _lstm(self, name, x, return_sequences=False):
+        w = self.weights
+        return lstm(x, w[f'{name}/kernel'], w[f'{name}/recurrent_kernel'], w[f'{name}/bias'], return_sequences,
+                    w.get(f'{name}/kernel/scale'), w.get(f'{name}/recurrent_kernel/scale'))
+
+    def _dense(self, name, x):
+        w = self.weights
+        return matmul(x, w[f'{name}/kernel'], w.get(f'{name}/kernel/scale')) + w[f'{name}/bias']
+
+    def _head(self, name, first_lstm_out):
+        return self._head_output(name, self._lstm(f'{name}_LSTM', first_lstm_out))
+
+    def _head_output(self, name, lstm_out):
+        x = np.tanh(self._dense(f'{name}_dense', lstm_out))
+        return softmax(self._dense(f'{name}_output', x))
+
+    def initial_state(self, batch_size=1):
+        """zero (h, c) state for each LSTM layer, to be passed to step"""
+        state = {}
+        for name in LSTM_LAYERS:
+            units = self.weights[f'{name}/recurrent_kernel'].shape[0]
+            state[name] = (np.zeros((batch_size, units), dtype=np.float32), np.zeros((batch_size, units), dtype=np.float32))
+        return state
+
+    def step(self, notes, state):
+        """run one timestep through every LSTM, carrying their hidden / cell states forward
+
+        The first LSTM feeds its output of this timestep to the pitch and duration LSTMs, so after
+        stepping through a whole window the outputs are the same as predict on that window.
+        Stepping past the window keeps the state instead of recomputing a sliding window,
+        so each new note costs one timestep.
+
+        Args:
+            notes (np.ndarray): mapped notes of shape (batch, 2)
+            state (dict): from initial_state or the previous step
+
+        Returns:
+            [pitch probabilities, duration probabilities], new state
+        """
+        x = np.asarray(notes, dtype=np.float32)
+        w = self.weights
+        new_state = {}
+        for name in LSTM_LAYERS:
+            h, c = state[name]
+            x_proj = matmul(x, w[f'{name}/kernel'], w.get(f'{name}/kernel/scale')) + w[f'{name}/bias']
+            new_state[name] = lstm_step(x_proj, h, c, w[f'{name}/recurrent_kernel'], w.get(f'{name}/recurrent_kernel/scale'))
+            if name == 'first_LSTM':
+                x = new_state[name][0]
+
+        outputs = [self._head_output(name, new_state[f'{name}_LSTM'][0]) for name in ['pitch', 'duration']]
+        return outputs, new_state
+
+    def prime(self, input_sequences):
+        """step through whole input sequences, returning the outputs for the last note and the state"""
+        x = np.asarray(input_sequences, dtype=np.float32)
+        state = self.initial_state(len(x))
+        for t in range(x.shape[1]):
+            outputs, state = self.step(x[:, t], state)
+        return outputs, state
+
+    def predict(self, input_sequences, verbose=0):
+        """same output as the keras model's predict: [pitch probabilities, duration probabilities]
+
+        Args:
+            input_sequences (np.ndarray): mapped notes of shape (batch, sequence length, 2)
+            verbose: ignored, only here so this can be swapped in for a keras model
+        """
+        x = np.asarray(input_sequences, dtype=np.float32)
+        first_lstm_out = self._lstm('first_LSTM', x, return_sequences=True)
+        return [self._head('pitch', first_lstm_out), self._head('duration', first_lstm_out)]
+
+
+def compare_latency(keras_model, numpy_model, batch_sizes=(1, 32), n_runs=100):
+    """print the average predict time of the keras model and the numpy model for each batch size"""
+
+    input_shape = keras_model.input_shape[1:]
+    for batch_size in batch_sizes:
+        x = np.random.randint(0, 20, size=(batch_size, *input_shape)).astype(np.float32)
+        for name, model in [('keras', keras_model), ('numpy', numpy_model)]:
+            model.predict(x, verbose=0)  # warm up
+            start = time.perf_counter()
+            for _ in range(n_runs):
+                model.predict(x, verbose=0)
+            ms = (time.perf_counter() - start) / n_runs * 1000
+            print(f"batch size {batch_size:>3} - {name}: {ms:.3f} ms per predict")
+
+
+if __name__ == "__main__":
+    from tensorflow import keras
+
+    keras_model = keras.models.load_model(KERAS_MODEL_PATH)
+    export_weights(keras_model, WEIGHTS_PATH)
+    print(f"weights saved to {WEIGHTS_PATH}")
+
+    numpy_model = NumpyMelodyModel.load(WEIGHTS_PATH)
+    compare_latency(keras_model, numpy_model)
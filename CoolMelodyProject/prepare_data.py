@@ -1,44 +1,41 @@
+import glob
+
 import pandas as pd
 import numpy as np
-import json
-from midi_cleaner import import_midis, midi_to_melody_df, split_melody_dfs
+from midi_cleaner import read_melodies
+from melody_corpus import MelodyCorpus, as_corpus, ragged_arange
+from dedup import remove_repeats
+from dataset import save_dataset, save_sharded_dataset, export_json
 
 MIDI_PATH = '../raw_data/mozart_midis/'
+MIDI_CACHE_PATH = 'data/midi_cache'
+MANIFEST_PATH = 'data/manifest'
+DATASET_PATH = 'data/dataset'
 JSON_PATH = 'data/data.json'
 SEQUENCE_LENGTH = 8
+# samples per shard of the saved dataset, None saves one file per array
+SHARD_SIZE = None
 
-def midi_to_dfs(midi_path):
-
-    # import midi files
-    midi_list = import_midis(midi_path)
+def midi_to_corpus(midi_path, workers=None, cache_dir=MIDI_CACHE_PATH, fast=False):
 
-    # extract melody and save as dataframes
-    midi_dfs = midi_to_melody_df(midi_list)
+    # import midi files in parallel and extract melodies (unchanged files come from the cache)
+    melodies = read_melodies(glob.glob(midi_path+'*'), workers=workers, cache_dir=cache_dir, fast=fast)
 
     # clean the melodies
-    note_dfs = split_melody_dfs(midi_dfs)
+    return MelodyCorpus.from_melodies(melodies).split_at_markers()
 
-    return note_dfs
 
+def midi_to_dfs(midi_path, workers=None, cache_dir=MIDI_CACHE_PATH, fast=False):
+    """midi_to_corpus as a list of dataframes, one per melody"""
+    return midi_to_corpus(midi_path, workers, cache_dir, fast).to_dfs()
 
-def create_mapping_dicts(note_dfs):
-
-    # create pitch / duration corpora
-    pitch_corpus = []
-    duration_corpus = []
 
-    for df in note_dfs:
-        pitch_corpus += list(df['pitch'])
-        duration_corpus += list(df['duration'])
+def create_mapping_dicts(note_dfs):
 
     # Storing all the unique pitches / durations present in the corpus to buid a mapping dict.
-    pitch_symb = sorted(list(set(pitch_corpus)))
-    duration_symb = sorted(list(set(duration_corpus)))
-
-    L_pitch_corpus = len(pitch_corpus)  # length of corpus
-    L_duration_corpus = len(duration_corpus)
-    L_pitch_symb = len(pitch_symb)  # length of total unique characters
-    L_duration_symb = len(duration_symb)
+    corpus = as_corpus(note_dfs)
+    pitch_symb = corpus.vocabulary('pitch')
+    duration_symb = corpus.vocabulary('duration')
 
     # Building dictionary to access the pitches / durations from indices and vice versa
     pitch_mapping = dict((int(c), i) for i, c in enumerate(pitch_symb))
@@ -63,12 +60,26 @@ def mask_start_df(df, pad_length):
     return pd.concat([mask_df, df])
 
 
+def map_values(values, mapping):
+    """vectorized version of pd.Series.map(mapping), values that aren't in mapping become nan"""
+    keys = np.array(sorted(mapping))
+    mapped = np.array([mapping[key] for key in keys])
+    positions = np.clip(np.searchsorted(keys, values), 0, len(keys) - 1)
+    found = keys[positions] == values
+    if found.all():
+        return mapped[positions]
+    return np.where(found, mapped[positions], np.nan)
+
+
 def create_sequences(df_list, length, pitch_mapping, duration_mapping, horizon = 1, selected_features = ['pitch', 'duration']):
     """
     Split the df's into sequences of equal length (X) and output target (y_p, y_d)
 
+    The whole corpus is padded, mapped with array lookups and turned into all of its windows at once
+    with a sliding window view, instead of slicing each df once per window.
+
     Args:
-    - df_list           (list)  : note_dfs (list of dfs made with midi_to_dfs function)
+    - df_list           (list)  : note_dfs (list of dfs made with midi_to_dfs function) or a MelodyCorpus
     - length            (int)   : length of each sequence
     - pitch_mapping     (dict)  : dictionary mapping pitch number to integers
     - duration_mapping  (dict)  : dictionary mapping duration values to integers
@@ -76,79 +87,52 @@ def create_sequences(df_list, length, pitch_mapping, duration_mapping, horizon =
                                   Default is 1, which is length of target
     - selected_features (list)  : which features from the dataframe that sequences will be created sequences for
     """
-    features_list = []
-    target_pitch = []
-    target_duration = []
-    for note_df in df_list:
-        df = note_df.copy()
-        df = mask_start_df(df, pad_length = (length // 2)) # add padding the to start of each data frame
-        L_df = len(df)
-        if L_df >= (length + horizon):
-            df = df.reset_index()
-            df['pitch'] = df['pitch'].astype('int') # to match dictionary keys
-            df['duration'] = df['duration'].astype('float') # to match dictionary keys
-            df['pitch'] = df['pitch'].map(pitch_mapping)
-            df['duration'] = df['duration'].map(duration_mapping)
-            latest_start_index = (L_df - length - horizon)
-            for i in range(latest_start_index):
-
-                features = df.loc[i:(i + length - 1), selected_features] # minus one to exclude target
-                features_list.append(features)
-
-                pitch = df.loc[(i + length), 'pitch']
-                target_pitch.append(pitch)
-
-                duration = df.loc[(i + length), 'duration']
-                target_duration.append(duration)
+    # pad the start of every melody, same as mask_start_df, and keep the melodies long enough for a window
+    corpus = as_corpus(df_list).pad_start(length // 2)
+    latest_start_index = corpus.lengths - length - horizon
+    corpus = corpus.select(latest_start_index > 0)
+    latest_start_index = latest_start_index[latest_start_index > 0]
+    if not len(corpus):
+        return np.array([]), np.array([]), np.array([])
+
+    columns = dict(corpus.columns)
+    columns['pitch'] = map_values(columns['pitch'].astype('int64'), pitch_mapping)
+    columns['duration'] = map_values(columns['duration'].astype('float64'), duration_mapping)
+
+    # window i of a melody is its rows i to i + length - 1, its target is row i + length
+    starts = ragged_arange(corpus.offsets[:-1], latest_start_index)
+    X = np.stack([np.lib.stride_tricks.sliding_window_view(columns[feature], length)[starts]
+                  for feature in selected_features], axis=-1)
 
     # L_datapoints = len(target_pitch)
     # print("Total number of sequences in the dataset:", L_datapoints)
 
-    return np.array(features_list), np.array(target_pitch), np.array(target_duration)
+    return X, columns['pitch'][starts + length], columns['duration'][starts + length]
 
 
 def remove_repeat_sequences(X, y_p, y_d, threshold = 25):
     """
     If the same sequence appears more times than the threshold, remove any excess sequences past the threshold.
-    """
-    _, unique_indexes, counts = np.unique(X, axis = 0, return_index = True, return_counts = True)
-    indexes = [idx for idx, count in zip(unique_indexes, counts) if count < threshold]
-    return X[indexes], y_p[indexes].reshape(-1, 1), y_d[indexes].reshape(-1, 1)
-
-
-def create_sample_weights(y_pitch, y_duration):
-
-    # get unique values for pitch / duration and their number of occurences
-    pitch_counts = np.unique(y_pitch, return_counts=True)
-    duration_counts = np.unique(y_duration, return_counts=True)
-
-    # make dict - pitch / duration value: counts
-    pitch_class_weights_simple = {key:val for key, val in zip(pitch_counts[0], pitch_counts[1])}
-    duration_class_weights_simple = {key:val for key, val in zip(duration_counts[0], duration_counts[1])}
 
-    # find average count for pitch and duration
-    pitch_mean = np.mean(list(pitch_class_weights_simple.values()))
-    duration_mean = np.mean(list(duration_class_weights_simple.values()))
+    Windows are hashed and counted a chunk at a time (see dedup.py) instead of sorting the whole of X.
+    """
+    return remove_repeats(X, y_p, y_d, threshold)
 
-    # create class weights - (1 / count) * avg count
-    pcw = {key:(1 / val) * pitch_mean for key, val in zip(pitch_counts[0], pitch_counts[1])}
-    dcw = {key:(1 / val) * duration_mean for key, val in zip(duration_counts[0], duration_counts[1])}
 
-    # create class weight of 0 for values that are in X but not in y
-    pcw_keys = list(pcw)
-    dcw_keys = list(dcw)
+def class_weights(y):
+    """(1 / count) * average count for every class in y, 0 for classes in between that never appear"""
+    counts = np.bincount(np.asarray(y, dtype=np.int64).reshape(-1))
+    present = counts > 0
+    weights = np.zeros(len(counts))
+    weights[present] = (1 / counts[present]) * np.mean(counts[present])
+    return weights
 
-    for i in range(int(max(pcw_keys))):
-        if i not in pcw_keys:
-            pcw[i] = 0
 
-    for i in range(int(max(dcw_keys))):
-        if i not in dcw_keys:
-            dcw[i] = 0
+def create_sample_weights(y_pitch, y_duration):
 
-    # create arrays that replace y values with class weight values for y
-    y_pitch_cw = np.array([pcw[pitch] for pitch in y_pitch[:, 0]])
-    y_dur_cw = np.array([dcw[dur] for dur in y_duration[:, 0]])
+    # class weights for pitch / duration, looked up for every sample
+    y_pitch_cw = class_weights(y_pitch)[np.asarray(y_pitch, dtype=np.int64).reshape(-1)]
+    y_dur_cw = class_weights(y_duration)[np.asarray(y_duration, dtype=np.int64).reshape(-1)]
 
     # take average value of class weights for y_p and y_d for each sample
     sample_weights = ((y_pitch_cw + y_dur_cw) / 2).reshape(-1, 1)
@@ -156,43 +140,77 @@ def create_sample_weights(y_pitch, y_duration):
     return sample_weights
 
 
-def main(midi_path, sequence_length, json_path):
+def build_sequences(midi_path, sequence_length):
+    """mapping dicts and deduplicated X, y_pitch, y_duration, built from scratch"""
 
-    # load midi files and store as list of dataframes
+    # load midi files and store their melodies as one corpus
     print("loading midis ...")
-    note_dfs = midi_to_dfs(midi_path)
+    corpus = midi_to_corpus(midi_path)
 
-    # create duration and pitch mapping dictionaries from dfs
-    pitch_mapping, pitch_reverse_mapping, duration_mapping, duration_reverse_mapping = create_mapping_dicts(note_dfs)
+    # create duration and pitch mapping dictionaries from the corpus
+    mapping_dicts = create_mapping_dicts(corpus)
+    pitch_mapping, pitch_reverse_mapping, duration_mapping, duration_reverse_mapping = mapping_dicts
 
     # create sequences of notes and target pitch and duration for model
     print("creating sequences ...")
-    X, y_p, y_d = create_sequences(note_dfs, sequence_length, pitch_mapping, duration_mapping)
+    X, y_p, y_d = create_sequences(corpus, sequence_length, pitch_mapping, duration_mapping)
 
     # remove sequences that appear above threshold
     X, y_pitch, y_duration = remove_repeat_sequences(X, y_p, y_d)
 
+    return mapping_dicts, X, y_pitch, y_duration
+
+
+def build_sequences_incremental(midi_path, sequence_length, manifest_path):
+    """same result as build_sequences, but only new or changed midis are processed,
+    everything else comes from the per-file shards recorded in the manifest"""
+    from manifest import update_shards, merge_shards
+
+    print("updating shards ...")
+    shards = update_shards(midi_path, manifest_path, sequence_length, cache_dir=MIDI_CACHE_PATH)
+
+    print("merging shards ...")
+    return merge_shards(shards)
+
+
+def main(midi_path, sequence_length, json_path=None, *, dataset_path=DATASET_PATH, manifest_path=None, shard_size=SHARD_SIZE):
+    """
+    Args:
+        json_path (str): also save the dataset in the old data.json format (same position as before, so
+                         main(midi_path, sequence_length, 'data/data.json') still writes the json)
+        dataset_path (str): folder for the .npy dataset train_model loads
+        manifest_path (str): folder of per-midi shards, to only reprocess new or changed midis
+        shard_size (int): save the dataset in shards of this many windows, None saves it whole
+    """
+
+    # with a manifest, only new or changed midis are processed
+    if manifest_path is None:
+        mapping_dicts, X, y_pitch, y_duration = build_sequences(midi_path, sequence_length)
+    else:
+        mapping_dicts, X, y_pitch, y_duration = build_sequences_incremental(midi_path, sequence_length, manifest_path)
+
     # create sample weights
     print("creating sample weights ...")
     sample_weights = create_sample_weights(y_pitch, y_duration)
 
-    # save data as json file
-    data_dict = {
-        'X': X.tolist(),
-        'y_pitch': y_pitch.tolist(),
-        'y_duration': y_duration.tolist(),
-        'sample_weights': sample_weights.tolist(),
-        'pitch_mapping': pitch_mapping,
-        'pitch_reverse_mapping': pitch_reverse_mapping,
-        'duration_mapping': duration_mapping,
-        'duration_reverse_mapping': duration_reverse_mapping
+    # save data as .npy files that train_model can memory-map, or as shards it can stream
+    arrays = {
+        'X': X,
+        'y_pitch': y_pitch,
+        'y_duration': y_duration,
+        'sample_weights': sample_weights,
     }
+    if shard_size is None:
+        save_dataset(dataset_path, arrays, mapping_dicts)
+    else:
+        save_sharded_dataset(dataset_path, arrays, mapping_dicts, shard_size)
+    print(f"data saved to {dataset_path}")
 
-    with open(json_path, 'w') as f:
-        json.dump(data_dict, f, indent=4)
-
-    print("data saved as .json")
+    # the old json format is only written when asked for
+    if json_path is not None:
+        export_json(json_path, arrays, mapping_dicts)
+        print("data saved as .json")
 
 
 if __name__ == "__main__":
-    main(MIDI_PATH, SEQUENCE_LENGTH, JSON_PATH)
+    main(MIDI_PATH, SEQUENCE_LENGTH, dataset_path=DATASET_PATH, manifest_path=MANIFEST_PATH)
@@ -0,0 +1,96 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from bundle import QUANTIZATIONS, quantize_weights, weights_filename
+from numpy_model import KERAS_MODEL_PATH, NumpyMelodyModel, model_weights
+
+DATASET_PATH = 'data/dataset'
+REPORT_PATH = 'data/quantization_report.csv'
+# variants are saved next to the float32 weights as model-float16.npz, model-int8.npz
+WEIGHTS_DIR = '..'
+
+
+def weights_size(weights):
+    """bytes taken by the weights arrays, what a NumpyMelodyModel holds in memory (and about the .npz size)"""
+    return sum(np.asarray(value).nbytes for value in weights.values())
+
+
+def top3_accuracy(model, validation_data):
+    """top-3 pitch and duration accuracy of a model on a validation pipeline, with the metric the model is trained with
+
+    Args:
+        model: keras model or NumpyMelodyModel
+        validation_data (tf.data.Dataset): (X, {'pitch_output', 'duration_output'}, sample weights) batches
+    """
+    from tensorflow.keras.metrics import SparseTopKCategoricalAccuracy
+
+    metrics = {name: SparseTopKCategoricalAccuracy(k=3) for name in ['pitch_output', 'duration_output']}
+    for x, y, _ in validation_data:
+        pitch_pred, duration_pred = model.predict(x.numpy(), verbose=0)
+        metrics['pitch_output'].update_state(y['pitch_output'], pitch_pred)
+        metrics['duration_output'].update_state(y['duration_output'], duration_pred)
+    return float(metrics['pitch_output'].result()), float(metrics['duration_output'].result())
+
+
+def predict_latency(model, input_shape, batch_size, n_runs=100):
+    """average ms per predict of a batch of random mapped sequences"""
+    x = np.random.default_rng(0).integers(0, 20, size=(batch_size, *input_shape)).astype(np.float32)
+    model.predict(x, verbose=0)  # warm up
+    start = time.perf_counter()
+    for _ in range(n_runs):
+        model.predict(x, verbose=0)
+    return (time.perf_counter() - start) / n_runs * 1000
+
+
+def quantization_report(weights, validation_data, input_shape, keras_model=None, batch_sizes=(1, 32), n_runs=100):
+    """compare every quantization of a model's weights: top-3 accuracy, size and predict latency
+
+    Args:
+        weights (dict): float32 weights from numpy_model.model_weights
+        validation_data (tf.data.Dataset): validation pipeline, eg from train_model.load_pipelines
+        input_shape (tuple): (sequence length, 2)
+        keras_model (keras.Model): the trained model the weights come from, added as a first row to compare against
+
+    Returns:
+        pd.DataFrame: one row per variant
+    """
+    variants = [('keras', keras_model, None)] if keras_model is not None else []
+    for quantization in QUANTIZATIONS:
+        quantized = quantize_weights(weights, quantization)
+        variants.append((quantization, NumpyMelodyModel(quantized), weights_size(quantized)))
+
+    rows = []
+    for name, model, size in variants:
+        pitch_top3, duration_top3 = top3_accuracy(model, validation_data)
+        row = {'variant': name, 'pitch_top3': pitch_top3, 'duration_top3': duration_top3,
+               'size_kb': None if size is None else size / 1024}
+        for batch_size in batch_sizes:
+            row[f'ms_batch_{batch_size}'] = predict_latency(model, input_shape, batch_size, n_runs)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def export_variants(weights, weights_dir=WEIGHTS_DIR):
+    """save every quantization of the weights as model.npz, model-float16.npz, model-int8.npz in weights_dir"""
+    for quantization in QUANTIZATIONS:
+        path = os.path.join(weights_dir, weights_filename(quantization))
+        np.savez(path, **quantize_weights(weights, quantization))
+        print(f"{quantization} weights saved to {path} ({os.path.getsize(path) / 1024:.1f} kB)")
+
+
+if __name__ == "__main__":
+    from tensorflow import keras
+
+    from train_model import load_pipelines
+
+    keras_model = keras.models.load_model(KERAS_MODEL_PATH)
+    weights = model_weights(keras_model)
+    export_variants(weights)
+
+    _, validation_data, input_shape, _ = load_pipelines(DATASET_PATH)
+    report = quantization_report(weights, validation_data, input_shape, keras_model)
+    report.to_csv(REPORT_PATH, index=False)
+    print(report.to_string(index=False, float_format='%.4f'))
@@ -0,0 +1,219 @@
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import isfile, join
+
+import numpy as np
+import pandas as pd
+
+from dataset import METADATA_FILENAME
+
+MIDI_PATH = '../raw_data/mozart_midis/'
+SWEEP_PATH = 'data/sweep'
+RESULTS_FILENAME = 'results.csv'
+
+# learning_rate is for input_pipeline.BASE_BATCH_SIZE and is scaled for batch_size, same as train_model.main
+SEARCH_SPACE = {
+    'lstm_units': [16, 32, 64],
+    'branch_units': [8, 16, 32],
+    'dropout': [0.1, 0.2, 0.3],
+    'dense_dropout': [0.2, 0.4],
+    'learning_rate': [0.0005, 0.001, 0.002],
+    'sequence_length': [8, 12, 16],
+    'batch_size': [64, 256],
+}
+MODEL_PARAMS = ['lstm_units', 'branch_units', 'dense_units', 'dropout', 'dense_dropout']
+N_TRIALS = 20
+MAX_EPOCHS = 100
+PATIENCE = 10
+# a trial is pruned when its best validation loss is worse than the median of the other trials at the
+# same epoch, but not before PRUNE_WARMUP_EPOCHS or before PRUNE_MIN_TRIALS other trials got that far
+PRUNE_WARMUP_EPOCHS = 5
+PRUNE_MIN_TRIALS = 3
+
+# set in each worker process by init_worker
+_reports = None
+_settings = None
+
+
+def sample_trials(search_space, n_trials=None, seed=0):
+    """n_trials different combinations of the search space values, picked at random
+    (every combination when n_trials is None or bigger than the grid)
+
+    Returns:
+        list: one dict of parameter values per trial
+    """
+    names = list(search_space)
+    grid_shape = [len(search_space[name]) for name in names]
+    grid_size = int(np.prod(grid_shape))
+
+    if n_trials is None or n_trials >= grid_size:
+        combinations = itertools.product(*[search_space[name] for name in names])
+        return [dict(zip(names, values)) for values in combinations]
+
+    picks = np.random.default_rng(seed).choice(grid_size, n_trials, replace=False)
+    positions = np.unravel_index(picks, grid_shape)
+    return [{name: search_space[name][position[i]] for name, position in zip(names, positions)} for i in range(n_trials)]
+
+
+def should_prune(losses, other_losses, warmup_epochs=PRUNE_WARMUP_EPOCHS, min_trials=PRUNE_MIN_TRIALS):
+    """median pruning: is a trial's best validation loss so far worse than the median of the best
+    losses other trials had after the same number of epochs?
+
+    Args:
+        losses (list): the trial's validation loss for every epoch so far
+        other_losses (list): the same for every other trial (running or finished)
+    """
+    epoch = len(losses)
+    if epoch < warmup_epochs:
+        return False
+    others = [min(other[:epoch]) for other in other_losses if len(other) >= epoch]
+    if len(others) < min_trials:
+        return False
+    return min(losses) > np.median(others)
+
+
+def dataset_path(sweep_dir, sequence_length):
+    return join(sweep_dir, f'dataset-L{sequence_length}')
+
+
+def prepare_datasets(sequence_lengths, sweep_dir=SWEEP_PATH, midi_path=MIDI_PATH):
+    """save one memory-mappable dataset per sequence length, that every trial with that length opens
+
+    Datasets that were already saved by an earlier sweep are reused.
+    """
+    from prepare_data import main as prepare_data
+
+    for sequence_length in sorted(set(sequence_lengths)):
+        path = dataset_path(sweep_dir, sequence_length)
+        if not isfile(join(path, METADATA_FILENAME)):
+            prepare_data(midi_path, sequence_length, dataset_path=path)
+
+
+def init_worker(threads, reports, settings):
+    """limit tensorflow's threads, so workers * threads doesn't go over the number of cores"""
+    global _reports, _settings
+    from input_pipeline import configure_threads
+
+    configure_threads(threads, 1)
+    _reports = reports
+    _settings = settings
+
+
+def run_trial(trial_id, params):
+    """train one configuration (in a worker process), stopping early when it stops improving or is pruned
+
+    Returns:
+        dict: the trial's parameters and results, for one row of the results table
+    """
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import Callback, EarlyStopping
+
+    from input_pipeline import scale_learning_rate
+    from train_model import build_model, load_pipelines
+
+    class MedianPruning(Callback):
+        """reports every epoch's validation loss to the other trials and stops the trial if should_prune says so"""
+
+        def __init__(self):
+            super().__init__()
+            self.pruned = False
+
+        def on_epoch_end(self, epoch, logs=None):
+            losses = _reports[trial_id] + [float(logs['val_loss'])]
+            _reports[trial_id] = losses
+            other_losses = [other for other_id, other in _reports.items() if other_id != trial_id]
+            if should_prune(losses, other_losses, _settings['warmup_epochs'], _settings['min_trials']):
+                self.pruned = True
+                self.model.stop_training = True
+
+    start = time.perf_counter()
+    tf.keras.utils.set_random_seed(_settings['seed'] + trial_id)
+    _reports[trial_id] = []
+
+    # every trial with the same sequence length memory-maps the same dataset files, and its pipelines read
+    # batches straight from them, so the workers share one copy of the data in the page cache
+    path = dataset_path(_settings['sweep_dir'], params['sequence_length'])
+    train_data, validation_data, input_shape, mapping_dicts = load_pipelines(path, params['batch_size'], seed=_settings['seed'])
+
+    learning_rate = scale_learning_rate(params['learning_rate'], params['batch_size'])
+    model_params = {name: params[name] for name in MODEL_PARAMS if name in params}
+    model = build_model(input_shape, learning_rate, len(mapping_dicts[0]), len(mapping_dicts[2]), **model_params)
+
+    pruning = MedianPruning()
+    history = model.fit(train_data, validation_data=validation_data, epochs=_settings['max_epochs'], verbose=0,
+                        callbacks=[EarlyStopping(patience=_settings['patience']), pruning]).history
+
+    with open(join(_settings['sweep_dir'], 'histories', f'trial-{trial_id:03d}.json'), 'w') as f:
+        json.dump({'params': params, 'history': history}, f, indent=4)
+
+    best_epoch = int(np.argmin(history['val_loss']))
+    return {
+        'trial': trial_id,
+        **params,
+        'best_val_loss': history['val_loss'][best_epoch],
+        'val_pitch_top3': history['val_pitch_output_sparse_top_k_categorical_accuracy'][best_epoch],
+        'val_duration_top3': history['val_duration_output_sparse_top_k_categorical_accuracy'][best_epoch],
+        'best_epoch': best_epoch + 1,
+        'epochs': len(history['val_loss']),
+        'pruned': pruning.pruned,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def run_sweep(search_space=SEARCH_SPACE, n_trials=N_TRIALS, sweep_dir=SWEEP_PATH, midi_path=MIDI_PATH, workers=None,
+              max_epochs=MAX_EPOCHS, patience=PATIENCE, warmup_epochs=PRUNE_WARMUP_EPOCHS, min_trials=PRUNE_MIN_TRIALS, seed=0):
+    """train n_trials configurations from search_space in a process pool, and save a results table
+
+    Args:
+        search_space (dict): list of values for any of build_model's MODEL_PARAMS, learning_rate,
+                             sequence_length and batch_size
+        workers (int): trials trained at once, default one per core. Each worker gets
+                       cores // workers tensorflow threads
+        max_epochs, patience (int): epochs per trial, and epochs without improvement before it stops
+
+    Returns:
+        pd.DataFrame: the results table (also saved to sweep_dir/results.csv), best trial first
+    """
+    if n_trials is not None and n_trials < 1:
+        raise ValueError(f"n_trials must be at least 1, not {n_trials}")
+    trials = sample_trials(search_space, n_trials, seed)
+    if not trials:
+        raise ValueError("the search space has no combinations, every parameter needs at least one value")
+    os.makedirs(join(sweep_dir, 'histories'), exist_ok=True)
+    prepare_datasets([params['sequence_length'] for params in trials], sweep_dir, midi_path)
+
+    cores = os.cpu_count() or 1
+    workers = min(workers or cores, len(trials))
+    threads = max(1, cores // workers)
+    settings = {'sweep_dir': sweep_dir, 'max_epochs': max_epochs, 'patience': patience,
+                'warmup_epochs': warmup_epochs, 'min_trials': min_trials, 'seed': seed}
+    print(f"{len(trials)} trials, {workers} workers with {threads} tensorflow threads each")
+
+    # spawned workers, tensorflow doesn't survive being forked
+    results = []
+    with mp.Manager() as manager:
+        reports = manager.dict()
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'), initializer=init_worker,
+                                 initargs=(threads, reports, settings)) as pool:
+            futures = [pool.submit(run_trial, trial_id, params) for trial_id, params in enumerate(trials)]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                status = 'pruned' if result['pruned'] else 'done'
+                print(f"trial {result['trial']} {status} after {result['epochs']} epochs ({result['seconds']:.0f}s): "
+                      f"val loss {result['best_val_loss']:.4f}")
+
+                # the table is rewritten after every trial, so a long sweep can be looked at while it runs
+                table = pd.DataFrame(results).sort_values('best_val_loss').reset_index(drop=True)
+                table.to_csv(join(sweep_dir, RESULTS_FILENAME), index=False)
+
+    return table
+
+
+if __name__ == "__main__":
+    table = run_sweep()
+    print(table.head(10).to_string())
@@ -1,20 +1,44 @@
 import json
+from os.path import join
+
 import numpy as np
 import matplotlib.pyplot as plt
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.layers import Input, LSTM, Dropout, Dense
-from tensorflow.keras.models import Model
+from tensorflow.keras.models import Model, load_model
 from tensorflow.keras.metrics import SparseTopKCategoricalAccuracy
-from tensorflow.keras.callbacks import EarlyStopping
-
-JSON_PATH = "data/data.json"
+from bundle import save_bundle
+from checkpoints import (BEST_WEIGHTS_FILENAME, CHECKPOINT_FILENAME, Checkpointer, ResumableEarlyStopping, load_state,
+                         model_params, new_state, warm_start)
+from dataset import MAPPING_NAMES, is_sharded, load_dataset, load_metadata
+from input_pipeline import (BATCH_SIZE, LR_SCALING, VALIDATION_SPLIT, TrainingSpeed, configure_threads,
+                            make_dataset, make_sharded_dataset, scale_learning_rate, train_validation_split)
+from numpy_model import model_weights
+
+DATASET_PATH = "data/dataset"
 PLOT_PATH = "data/learning_curves.png"
+CHECKPOINT_PATH = "data/checkpoints"
+MODEL_PATH = "data/model.keras"
+# serving bundles the api loads (see bundle.py), relative to this folder
+BUNDLES_PATH = "../bundles"
+# epochs between checkpoints
+CHECKPOINT_EVERY = 1
 LEARNING_RATE = 0.001
 PATIENCE = 10
+# 0 leaves tensorflow's default of one thread per core
+INTRA_OP_THREADS = 0
+INTER_OP_THREADS = 0
+
+def load_data(dataset_path):
+    """load X, y, sample weights and mapping dicts from a dataset folder made with prepare_data
+    (memory-mapped, nothing is copied), or from an old data.json file"""
 
-def load_data(json_path):
+    if not dataset_path.endswith('.json'):
+        arrays, mapping_dicts = load_dataset(dataset_path)
+        y = {"pitch_output": arrays["y_pitch"], "duration_output": arrays["y_duration"]}
+        return arrays["X"], y, arrays["sample_weights"], mapping_dicts
 
-    with open(json_path, 'r') as f:
+    with open(dataset_path, 'r') as f:
         data = json.load(f)
 
     # extract X, y, and sample weights
@@ -35,28 +59,62 @@ def load_data(json_path):
     return X, y, sample_weights, mapping_dicts
 
 
-def build_model(input_shape, learning_rate, num_pitches, num_durations):
+def load_pipelines(dataset_path, batch_size=BATCH_SIZE, validation_split=VALIDATION_SPLIT, seed=0):
+    """training and validation tf.data pipelines for a dataset made with prepare_data
+
+    Sharded datasets are streamed from disk a few shards at a time, anything else is loaded with load_data.
+
+    Returns:
+        train_data, validation_data, input_shape (tuple), mapping_dicts (list)
+    """
+    if not dataset_path.endswith('.json') and is_sharded(dataset_path):
+        metadata = load_metadata(dataset_path)
+        train_data = make_sharded_dataset(dataset_path, False, validation_split, batch_size, shuffle=True, seed=seed)
+        validation_data = make_sharded_dataset(dataset_path, True, validation_split, batch_size, shuffle=False, seed=seed)
+        input_shape = tuple(metadata['arrays']['X']['shape'][1:])
+        return train_data, validation_data, input_shape, [metadata[name] for name in MAPPING_NAMES]
+
+    X, y, sample_weights, mapping_dicts = load_data(dataset_path)
 
-    # set optimizer and metric
+    # shuffled train / validation split
+    train_indexes, validation_indexes = train_validation_split(len(X), validation_split, seed)
+    train_data = make_dataset(X, y, sample_weights, train_indexes, batch_size, shuffle=True, seed=seed)
+    validation_data = make_dataset(X, y, sample_weights, validation_indexes, batch_size, shuffle=False)
+    return train_data, validation_data, X.shape[1:], mapping_dicts
+
+
+def build_model(input_shape, learning_rate, num_pitches, num_durations, lstm_units=32, branch_units=16,
+                dense_units=16, dropout=0.2, dense_dropout=0.4):
+    """
+    Args:
+        lstm_units (int): width of the shared first LSTM
+        branch_units (int): width of the pitch / duration LSTMs
+        dense_units (int): width of the pitch / duration dense layers
+        dropout (float): dropout after the pitch / duration LSTMs
+        dense_dropout (float): dropout after the pitch / duration dense layers
+    """
+
+    # set optimizer and metrics (one per output, keras 3 doesn't share a bare metric between outputs)
     opt = Adam(learning_rate=learning_rate)
-    metric = SparseTopKCategoricalAccuracy(k=3, name='sparse_top_k_categorical_accuracy')
+    metrics = {name: [SparseTopKCategoricalAccuracy(k=3, name='sparse_top_k_categorical_accuracy')]
+               for name in ['pitch_output', 'duration_output']}
 
     # build model
     input_layer = Input(shape=input_shape, name='input_layer')
-    first_LSTM = LSTM(32, name='first_LSTM', activation='tanh', return_sequences=True)(input_layer)
+    first_LSTM = LSTM(lstm_units, name='first_LSTM', activation='tanh', return_sequences=True)(input_layer)
 #     first_dropout = Dropout(0.1, name='first_dropout')(first_LSTM)
 
-    pitch_LSTM = LSTM(16, name='pitch_LSTM', activation='tanh')(first_LSTM)
-    pitch_dropout = Dropout(0.2, name='pitch_dropout')(pitch_LSTM)
-    pitch_dense = Dense(16, name='pitch_dense', activation='tanh')(pitch_dropout)
-    pitch_dropout_2 = Dropout(0.4, name='pitch_dropout_2')(pitch_dense)
+    pitch_LSTM = LSTM(branch_units, name='pitch_LSTM', activation='tanh')(first_LSTM)
+    pitch_dropout = Dropout(dropout, name='pitch_dropout')(pitch_LSTM)
+    pitch_dense = Dense(dense_units, name='pitch_dense', activation='tanh')(pitch_dropout)
+    pitch_dropout_2 = Dropout(dense_dropout, name='pitch_dropout_2')(pitch_dense)
     pitch_output = Dense(num_pitches, name='pitch_output', activation='softmax')(pitch_dropout_2)
 
 
-    duration_LSTM = LSTM(16, name='duration_LSTM', activation='tanh')(first_LSTM)
-    duration_dropout = Dropout(0.2, name='duration_dropout')(duration_LSTM)
-    duration_dense = Dense(16, name='duration_dense', activation='tanh')(duration_dropout)
-    duration_dropout_2 = Dropout(0.4, name='duration_dropout_2')(duration_dense)
+    duration_LSTM = LSTM(branch_units, name='duration_LSTM', activation='tanh')(first_LSTM)
+    duration_dropout = Dropout(dropout, name='duration_dropout')(duration_LSTM)
+    duration_dense = Dense(dense_units, name='duration_dense', activation='tanh')(duration_dropout)
+    duration_dropout_2 = Dropout(dense_dropout, name='duration_dropout_2')(duration_dense)
     duration_output = Dense(num_durations, name='duration_output', activation='softmax')(duration_dropout_2)
 
     model = Model(inputs=input_layer, outputs=[pitch_output, duration_output])
@@ -71,7 +129,7 @@ def build_model(input_shape, learning_rate, num_pitches, num_durations):
         "duration_output": 1.0
     }
 
-    model.compile(optimizer=opt, loss=losses, loss_weights=loss_weights, metrics=metric)
+    model.compile(optimizer=opt, loss=losses, loss_weights=loss_weights, metrics=metrics)
 
     return model
 
@@ -115,38 +173,99 @@ def plot_curves(history, plot_path):
     plt.savefig(plot_path)
 
 
-def main(json_path, learning_rate, patience, plot_path):
-
-    # load data
+def main(dataset_path, learning_rate, patience, plot_path, batch_size=BATCH_SIZE, lr_scaling=LR_SCALING,
+         validation_split=VALIDATION_SPLIT, intra_op_threads=INTRA_OP_THREADS, inter_op_threads=INTER_OP_THREADS, seed=0,
+         checkpoint_dir=CHECKPOINT_PATH, checkpoint_every=CHECKPOINT_EVERY, resume=True, warm_start_dir=None,
+         model_path=MODEL_PATH, bundles_dir=BUNDLES_PATH):
+    """
+    Args:
+        learning_rate (float): learning rate for a batch size of input_pipeline.BASE_BATCH_SIZE
+        batch_size (int): samples per training step, 16 as before by default (256 trains much faster on cpu)
+        lr_scaling (str): how learning_rate is scaled for batch_size, 'sqrt', 'linear' or 'none'
+        validation_split (float): fraction of the samples (picked at random) held out for validation
+                                  (of every shard, for sharded datasets)
+        intra_op_threads, inter_op_threads (int): tensorflow cpu threads, 0 for the default
+        seed (int): seed for the train / validation split and the shuffling
+        checkpoint_dir (str): where the model, optimizer and training state are saved while training
+        checkpoint_every (int): epochs between checkpoints
+        resume (bool): carry on from an unfinished run in checkpoint_dir instead of starting again
+        warm_start_dir (str): checkpoint_dir of a finished run, to fine-tune its model on this dataset
+                              (its output layers are extended if the vocabulary grew) instead of starting from scratch
+        model_path (str): where the trained model is saved
+        bundles_dir (str): where the serving bundle (weights, mapping dicts, sequence length) is published,
+                           None to skip it
+    """
+    configure_threads(intra_op_threads, inter_op_threads)
+
+    # load data, fed to the model through tf.data pipelines
     print("loading data ... ")
-    X, y, sample_weights, mapping_dicts = load_data(json_path)
+    train_data, validation_data, input_shape, mapping_dicts = load_pipelines(dataset_path, batch_size, validation_split, seed)
 
-    # build model
-    print("building model ... ")
-    input_shape = X.shape[1:]
     num_pitchs = len(mapping_dicts[0])
     num_durations = len(mapping_dicts[2])
-    model = build_model(input_shape, learning_rate, num_pitchs, num_durations)
+    learning_rate = scale_learning_rate(learning_rate, batch_size, lr_scaling)
+
+    state = load_state(checkpoint_dir) if resume else None
+    if state is not None and not state['complete']:
+        # carry on from the last checkpoint, with its optimizer state
+        if state['mapping_dicts'] != mapping_dicts:
+            raise ValueError(f"the dataset changed since the checkpoint in {checkpoint_dir} was saved, "
+                             "use warm_start_dir to fine-tune on the new dataset")
+        print(f"resuming from epoch {state['epoch']} ({state['seconds']:.0f}s already trained) ... ")
+        model = load_model(join(checkpoint_dir, CHECKPOINT_FILENAME))
+
+    elif warm_start_dir is not None:
+        # fine-tune a trained model, same architecture but a fresh optimizer
+        print(f"warm-starting from {warm_start_dir} ... ")
+        old_state = load_state(warm_start_dir)
+        old_model = load_model(join(warm_start_dir, CHECKPOINT_FILENAME))
+        model = build_model(input_shape, learning_rate, num_pitchs, num_durations, **model_params(old_model))
+        warm_start(old_model, model, old_state['mapping_dicts'], mapping_dicts)
+        state = new_state(mapping_dicts, old_state)
+
+    else:
+        print("building model ... ")
+        model = build_model(input_shape, learning_rate, num_pitchs, num_durations)
+        state = new_state(mapping_dicts)
 
     # train model
-    es = EarlyStopping(patience=patience, restore_best_weights=True)
+    es = ResumableEarlyStopping(state, patience)
+    checkpointer = Checkpointer(checkpoint_dir, state, checkpoint_every)
+    speed = TrainingSpeed()
 
     print("training model ... ")
-    history = model.fit(X,
-                    y,
-                    validation_split=0.2,
-                    shuffle=True,
-                    batch_size=16,
-                    epochs=500,
-                    verbose=0,
-                    callbacks=[es],
-                    sample_weight=sample_weights).history
-
+    model.fit(train_data,
+              validation_data=validation_data,
+              epochs=500,
+              initial_epoch=state['epoch'],
+              verbose=0,
+              callbacks=[es, checkpointer, speed])
+    print(speed.summary())
+
+    # keep the best epoch, and mark the run as finished so it can be warm-started from
+    model.load_weights(join(checkpoint_dir, BEST_WEIGHTS_FILENAME))
+    state['complete'] = True
+    if state['cold_seconds'] is None:
+        state['cold_seconds'] = state['seconds']
+    checkpointer.save()
+    model.save(model_path)
+    print(f"model saved to {model_path}")
+    if bundles_dir is not None:
+        bundle_path = save_bundle(bundles_dir, model_weights(model), mapping_dicts, input_shape[0])
+        print(f"serving bundle saved to {bundle_path}")
+
+    print(f"trained for {state['epoch']} epochs in {state['seconds']:.0f}s")
+    if warm_start_dir is not None:
+        saved = state['cold_seconds'] - state['seconds']
+        print(f"the model it was warm-started from took {state['cold_seconds']:.0f}s from scratch, "
+              f"about {saved:.0f}s saved compared with a cold retrain")
+
+    history = state['history']
     print("plotting curves ... ")
     plot_curves(history, plot_path)
 
     # show validation set scores for pitch and accuracy
-    best_epoch = len(history['val_pitch_output_sparse_top_k_categorical_accuracy']) - 1 - patience
+    best_epoch = state['best_epoch']
     best_pitch = history['val_pitch_output_sparse_top_k_categorical_accuracy'][best_epoch]
     best_duration = history['val_duration_output_sparse_top_k_categorical_accuracy'][best_epoch]
 
@@ -157,4 +276,4 @@ def main(json_path, learning_rate, patience, plot_path):
     print("complete")
 
 if __name__ == "__main__":
-    main(JSON_PATH, LEARNING_RATE, PATIENCE, PLOT_PATH)
+    main(DATASET_PATH, LEARNING_RATE, PATIENCE, PLOT_PATH)
@@ -1,13 +1,56 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import iterate_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import ast
-import random
-import tensorflow as tf
-from tensorflow import keras
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+import json
+import os
+import secrets
 import numpy as np
-import pandas as pd
 
-app = FastAPI()
+from api.registry import ModelRegistry, resolve_bundle
+from api.batching import MicroBatcher
+from api.cache import PredictionCache
+from api.sampling import Sampler, as_int
+from api.seed_bank import SeedBank, clean_csv_paths
+from api.settings import (SEED_CSV_PATH, SEED_CSVS, MAX_GENERATE_NOTES, MAX_REQUEST_SEQUENCES, BUNDLE_POLL_SECONDS,
+                          ADMIN_TOKEN)
+from CoolMelodyProject.bundle import QUANTIZATIONS
+
+registry = ModelRegistry()
+batcher = MicroBatcher(registry.predict)
+cache = PredictionCache()
+seed_bank = None
+
+
+def load_seed_bank():
+    """seeds as long as the served model's sequences, (re)built at startup and when a model with another length is swapped in"""
+    global seed_bank
+    sequence_length = registry.current.sequence_length
+    if seed_bank is None or seed_bank.sequence_length != sequence_length:
+        csv_numbers = None if SEED_CSVS == 'all' else [int(n) for n in SEED_CSVS.split(',')]
+        seed_bank = SeedBank.from_csvs(clean_csv_paths(SEED_CSV_PATH, csv_numbers), sequence_length)
+
+
+registry.load_listeners.append(cache.clear)
+registry.load_listeners.append(load_seed_bank)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # load the model and the seed sequences once at startup, every request then shares them
+    registry.load()
+    batcher.start()
+    if BUNDLE_POLL_SECONDS > 0:
+        registry.watch(BUNDLE_POLL_SECONDS)
+    yield
+    registry.stop()
+    batcher.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=['*'],
@@ -17,102 +60,295 @@ app.add_middleware(
 )
 
 
-pitch_symb = [ 0, 29, 30, 31, 32, 33, 34, 35, 36, 37, 38, 39, 40, 41, 42, 43, 44,
-       45, 46, 47, 48, 49, 50, 51, 52, 53, 54, 55, 56, 57, 58, 59, 60, 61,
-       62, 63, 64, 65, 66, 67, 68, 69, 70, 71, 72, 73, 74, 75, 76, 77, 78,
-       79, 80, 81, 82, 83, 84, 85, 86, 87, 88, 89, 90, 91, 92, 93, 94, 96]
-
-duration_symb = [0.    , 0.0625, 0.125 , 0.25  , 0.375 , 0.5   , 0.75  , 1.    ,
-       1.25  , 1.5   , 1.75  , 2.    , 2.25  , 2.5   , 2.75  , 3.    ,
-       3.25  , 3.5   , 3.75  , 4.    , 4.5   , 5.    , 6.    , 7.5   ,
-       8.75  , 9.5   ]
+# the vocabulary, sequence length and sampling defaults all come with the served model (see api/registry.py).
+# every request takes registry.current once and sticks with it, so a model swap never splits a request
 
-L_pitch_symb = len(pitch_symb)
-L_duration_symb = len(duration_symb)
+SAMPLING_SETTINGS = ['temperature', 'k', 'top_p', 'duration_k', 'seed']
 
-len_in_64th_notes = {'64': 1, '32': 2, '32d': 3, '16': 4, '16d': 6, '8': 8, '8d': 12,
-                     '8dd': 14, '4': 16, '4d': 24, '2': 32, '2d': 48, '1': 64}
 
+class PredictRequest(BaseModel):
+    """body of POST /predict, a batch of sequences given either as [pitch, duration] notes
+    or as packed integers (pitch * 256 + duration in 64th notes, eg 72 * 256 + 8 for an eighth note c5),
+    plus the same sampling settings as the query parameters of GET /predict"""
+    sequences: Optional[List[List[Tuple[int, float]]]] = None
+    packed: Optional[List[List[int]]] = None
+    temperature: Optional[float] = None
+    k: Optional[int] = None
+    top_p: Optional[float] = None
+    duration_k: Optional[int] = None
+    seed: Optional[int] = None
 
-reverse_len_in_64th_notes = {v: k for k, v in len_in_64th_notes.items()}
-
-
-pitch_mapping = dict((int(c), i) for i, c in enumerate(pitch_symb))
-pitch_reverse_mapping = dict((i, int(c)) for i, c in enumerate(pitch_symb))
-duration_mapping = dict((float(c), i) for i, c in enumerate(duration_symb))
-duration_reverse_mapping = dict((i, float(c)) for i, c in enumerate(duration_symb))
 
 @app.get('/')
 def greeting():
     return {'greeting':'you ding a big man ting bruv.'}
 
 @app.get('/initialize')
-def first_sequence():
-    #-----generate data to randomly grab data from-----
-    good_csvs = [1, 7, 9, 13, 15, 22, 23, 30]
+def first_sequence(random_offset: bool = False):
+    #-----randomly grab a sequence from the preloaded seeds-----
+    # random_offset=true starts anywhere in the piece instead of at the first note
+    first_input_sequence = seed_bank.sample(random_offset=random_offset)
 
-    random_value = random.choice(good_csvs)
-    # random_value = random.randint(0,31)
+    return {'first_sequence': first_input_sequence} #before normalizing format
 
-    df = pd.read_csv(f'raw_data/clean_csvs/csv_{random_value}.csv')
-    first_sequence = df['pitch_dur0'][:8]
+def parse_sequence(sequence):
+    """parse a query string sequence like [[72, 0.5], [74, 0.25], ...] as json"""
+    try:
+        return json.loads(sequence)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="sequence must be a json list of [pitch, duration] notes")
 
 
-    #-----convert the first sequence to list of notes----
-    lis_first_sequence = list(first_sequence)
-    first_input_sequence = []
-    for note in lis_first_sequence:
-        note = note.split('-')
-        note[0] = int(note[0])
-        first_input_sequence.append(note)
+def is_note(note, packed=False):
+    """a [pitch, duration] pair of numbers, or a packed integer note if packed is True"""
+    if packed:
+        return isinstance(note, int) and not isinstance(note, bool)
+    return (isinstance(note, (list, tuple)) and len(note) == 2
+            and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in note))
 
-    return {'first_sequence': first_input_sequence} #before normalizing format
 
-@app.get('/predict')
-def predict(sequence):
-    #-----grabbing the model-----
-    model = keras.models.load_model("model.h5")
+def encode_sequences(served, sequences, packed=False, any_length=False):
+    """validate and map a batch of sequences to the served model's indexes in one go, bad input is a 422 instead of a KeyError
+
+    Args:
+        served (ServedModel): model the sequences are for
+        sequences (list): [pitch, duration] sequences, or packed integer sequences if packed is True
+        any_length (bool): allow any number of notes instead of the model's sequence length
+    """
+    sequence_length = None if any_length else served.sequence_length
+    if not isinstance(sequences, list) or not sequences or len(sequences) > MAX_REQUEST_SEQUENCES:
+        raise HTTPException(status_code=422, detail=f"send between 1 and {MAX_REQUEST_SEQUENCES} sequences")
+    # anything parseable can get here (eg sequence=5 or sequence=null), so check the shape before taking lengths
+    if not all(isinstance(sequence, (list, tuple)) and all(is_note(note, packed) for note in sequence)
+               for sequence in sequences):
+        notes = 'packed integer notes' if packed else '[pitch, duration] notes'
+        raise HTTPException(status_code=422, detail=f"sequences must be lists of {notes}")
+    lengths = {len(sequence) for sequence in sequences}
+    if len(lengths) != 1 or 0 in lengths or (sequence_length is not None and lengths != {sequence_length}):
+        raise HTTPException(status_code=422, detail=f"every sequence must have {sequence_length or 'the same number of'} notes")
+    try:
+        return served.encoder.encode_packed(sequences) if packed else served.encoder.encode(sequences)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def predict_mapped(served, input_sequences):
+    """model output for a batch of mapped sequences, using cached outputs for windows seen before"""
+
+    # the model output for a window never changes, so repeated windows come from the cache
+    cache_keys = [cache.key(input_sequence, served.generation) for input_sequence in input_sequences]
+    predictions = [cache.get(cache_key) for cache_key in cache_keys]
+
+    # everything that wasn't cached goes through the model together
+    misses = [i for i, prediction in enumerate(predictions) if prediction is None]
+    if misses:
+        # only batched with requests for the same model
+        pitch_pred, duration_pred = batcher.predict(input_sequences[misses], served.predict)
+        for row, i in enumerate(misses):
+            predictions[i] = [pitch_pred[row:row + 1], duration_pred[row:row + 1]]
+            cache.put(cache_keys[i], predictions[i])
+
+    pitch_pred = np.concatenate([prediction[0] for prediction in predictions])
+    duration_pred = np.concatenate([prediction[1] for prediction in predictions])
+    return pitch_pred, duration_pred
+
+
+def make_sampler(served, settings):
+    """sampling settings for one request, the served model's defaults for anything not given; out of range settings are a 422
+
+    Args:
+        settings (dict): any of SAMPLING_SETTINGS, None values fall back to the defaults
+    """
+    given = {name: value for name, value in settings.items() if name in SAMPLING_SETTINGS and value is not None}
+    try:
+        return Sampler(**{**served.sampling, **given})
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 
+def sampling_query(temperature: Optional[float] = None, k: Optional[int] = None, top_p: Optional[float] = None,
+                   duration_k: Optional[int] = None, seed: Optional[int] = None):
+    """sampling settings from query parameters, seed makes the response reproducible"""
+    return {'temperature': temperature, 'k': k, 'top_p': top_p, 'duration_k': duration_k, 'seed': seed}
+
+
+def predict_notes(served, input_sequences, sampler):
+    """three suggested [actual pitch, actual duration] notes for each mapped sequence"""
+    pitch_pred, duration_pred = predict_mapped(served, input_sequences)
+
+    # sampling runs on every request (cache hit or not) so the notes stay random
+    return served.encoder.decode(sampler.sample_notes(pitch_pred, duration_pred, 3))
+
+
+@app.get('/predict')
+def predict(sequence, sampling: dict = Depends(sampling_query)):
     #-----transform the sequence to the format model can take in-----
     #sequence example : [actual pitch, actual duration]
-    list_sequence = ast.literal_eval(sequence)
-    input_sequence = []
-
-    for note in list_sequence:
-        # dur_len_in_64th_notes = len_in_64th_notes[note[1]]
-        # dur_mapped = duration_mapping[dur_len_in_64th_notes]
-        dur_mapped = duration_mapping[float(note[1])]
-        pitch_mapped = pitch_mapping[note[0]]
-        mapped_note = [pitch_mapped, dur_mapped]
-        input_sequence.append(mapped_note)
+    served = registry.current
+    input_sequences = encode_sequences(served, [parse_sequence(sequence)])
 
     #-----take in the sequence and predict-----
-    input_sequence = np.array(input_sequence).reshape(1,8,2)
-    prediction = model.predict(input_sequence)
+    # return three notes as [pitch, duration] pairs the front-end can take in
+    three_notes_mapped = predict_notes(served, input_sequences, make_sampler(served, sampling))[0]
 
-    #-----transform the prediction into the notes the front-end can take in-----
-    # return predictions from sample
-    pitch_pred, duration_pred = prediction
+    return {'predictions': three_notes_mapped}
 
-    # apply randomness level to pitch
-    temperature = 0.05  # randomness
-    pitch_pred[0] /= temperature
+@app.post('/predict')
+def predict_batch(request: PredictRequest):
+    #-----validate and map every sequence in one go-----
+    served = registry.current
+    if (request.sequences is None) == (request.packed is None):
+        raise HTTPException(status_code=422, detail="send exactly one of sequences or packed")
+    if request.packed is not None:
+        input_sequences = encode_sequences(served, request.packed, packed=True)
+    else:
+        input_sequences = encode_sequences(served, request.sequences)
 
-    # get 3 random (weighted) indexes from top 12 pitch logits
-    pitch_index_top_12 = np.argpartition(pitch_pred[0], -12)[-12:]
-    pitch_logits_top_12 = np.array([pitch_pred[0][i] for i in pitch_index_top_12]).reshape(-1, 12)
-    pitch_3_logit_ind = np.array(tf.random.categorical(pitch_logits_top_12, 3)).reshape(-1)
-    pitch_index_top_3 = [pitch_index_top_12[i] for i in pitch_3_logit_ind]
+    #-----three suggested notes for each sequence-----
+    sampler = make_sampler(served, dict(request))
+    return {'predictions': predict_notes(served, input_sequences, sampler)}
 
-    dur_index_top_2 = np.argpartition(duration_pred[0], -2)[-2:]
+def generation_model(n_notes):
+    """check n_notes and return the served model, which has to be able to step one note at a time"""
+    try:
+        n_notes = as_int(n_notes, 'n_notes')
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not 1 <= n_notes <= MAX_GENERATE_NOTES:
+        raise HTTPException(status_code=422, detail=f"n_notes must be between 1 and {MAX_GENERATE_NOTES}")
+    served = registry.current
+    if not hasattr(served.model, 'step'):
+        raise HTTPException(status_code=501, detail="generate needs the numpy model (a bundle or a .npz MODEL_PATH)")
+    return served
 
-    # return three notes as [pitch, duration] pairs
-    three_notes = [[pitch, np.random.choice(dur_index_top_2)] for pitch in pitch_index_top_3]
-    three_notes_mapped = [[pitch_reverse_mapping[pitch], duration_reverse_mapping[duration]] for pitch, duration in three_notes]
 
+def melody_steps(model, input_sequence, n_notes, sampler):
+    """run the seed through the model once, then feed back one sampled note at a time
 
+    The LSTM states are carried forward, so each new note is one timestep instead of a whole window.
+    Yields (note indexes, pitch_pred row, duration_pred row) for each note as soon as it is sampled.
+    """
+    (pitch_pred, duration_pred), state = model.prime(input_sequence)
+    for i in range(n_notes):
+        if i > 0:
+            (pitch_pred, duration_pred), state = model.step(np.array([note]), state)
+        note = sampler.sample_notes(pitch_pred, duration_pred, 1)[0, 0]
+        yield note, pitch_pred[0], duration_pred[0]
 
 
-    return {'predictions': three_notes_mapped}
+def note_event(served, i, note, pitch_pred, duration_pred, sampler, candidates=False):
+    """one streamed note, optionally with the top k pitches / durations it was sampled from"""
+    encoder = served.encoder
+    event = {'index': i, 'note': encoder.decode(note)}
+    if candidates:
+        pitch_top = np.argsort(pitch_pred)[::-1][:sampler.k]
+        duration_top = np.argsort(duration_pred)[::-1][:sampler.duration_k]
+        event['candidates'] = {
+            'pitches': [[int(encoder.pitch_symb[p]), float(pitch_pred[p])] for p in pitch_top],
+            'durations': [[float(encoder.duration_symb[d]), float(duration_pred[d])] for d in duration_top],
+        }
+    return event
+
+
+@app.get('/generate')
+def generate(sequence, n_notes: int = 16, sampling: dict = Depends(sampling_query)):
+    #-----transform the seed sequence to the format model can take in-----
+    served = generation_model(n_notes)
+    input_sequence = encode_sequences(served, [parse_sequence(sequence)], any_length=True)
+    sampler = make_sampler(served, sampling)
+
+    #-----generate the whole melody server side-----
+    melody = [note for note, _, _ in melody_steps(served.model, input_sequence, n_notes, sampler)]
+
+    return {'melody': served.encoder.decode(melody)}
+
+@app.get('/generate/stream')
+async def generate_stream(request: Request, sequence, n_notes: int = 16, candidates: bool = False,
+                          sampling: dict = Depends(sampling_query)):
+    #-----same as /generate, but each note is sent as a server-sent event as soon as it is sampled-----
+    served = generation_model(n_notes)
+    input_sequence = encode_sequences(served, [parse_sequence(sequence)], any_length=True)
+    sampler = make_sampler(served, sampling)
+
+    async def events():
+        # each step runs on the threadpool so other requests keep being served meanwhile. Notes are made
+        # as fast as the server takes them: a slow client only holds generation up once the socket's
+        # write buffer is full (and n_notes is capped), and it stops as soon as the client goes away
+        steps = iterate_in_threadpool(enumerate(melody_steps(served.model, input_sequence, n_notes, sampler)))
+        async for i, (note, pitch_pred, duration_pred) in steps:
+            if await request.is_disconnected():
+                return
+            yield f"data: {json.dumps(note_event(served, i, note, pitch_pred, duration_pred, sampler, candidates))}\n\n"
+        yield "event: end\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type='text/event-stream')
+
+@app.websocket('/generate/ws')
+async def generate_ws(websocket: WebSocket):
+    #-----the client sends {"sequence": [[pitch, duration], ...], "n_notes": 16, "candidates": false}-----
+    # (plus optional temperature, k, top_p, duration_k and seed) and gets one message per note, then {"end": true}
+    await websocket.accept()
+    try:
+        message = await websocket.receive_json()
+        n_notes = message.get('n_notes', 16)
+        served = generation_model(n_notes)
+        input_sequence = encode_sequences(served, [message.get('sequence')], any_length=True)
+        sampler = make_sampler(served, message)
+    except HTTPException as e:
+        await websocket.send_json({'error': e.detail})
+        await websocket.close(code=1008)
+        return
+    except (ValueError, TypeError, AttributeError):
+        await websocket.send_json({'error': 'send {"sequence": [[pitch, duration], ...], "n_notes": int}'})
+        await websocket.close(code=1008)
+        return
+
+    try:
+        # steps run on the threadpool like /generate/stream, and the same goes for a slow client:
+        # send_json only waits once the socket's write buffer is full
+        steps = iterate_in_threadpool(enumerate(melody_steps(served.model, input_sequence, n_notes, sampler)))
+        async for i, (note, pitch_pred, duration_pred) in steps:
+            await websocket.send_json(note_event(served, i, note, pitch_pred, duration_pred, sampler, message.get('candidates', False)))
+        await websocket.send_json({'end': True})
+        await websocket.close()
+    except WebSocketDisconnect:
+        return
+
+@app.get('/model')
+def model_info():
+    #-----the model being served: its bundle version, vocabulary sizes and sampling defaults-----
+    return registry.current.info()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """only let requests with the ADMIN_TOKEN through (the api is open to any origin)"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="admin endpoints are turned off, set ADMIN_TOKEN to use them")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="missing or wrong X-Admin-Token")
+
+
+def admin_bundle(bundle):
+    """check a bundle asked for on /admin/reload is a bundle inside the registry's bundle_path"""
+    root = os.path.realpath(registry.bundle_path)
+    path = os.path.realpath(bundle)
+    if os.path.commonpath([root, path]) != root or resolve_bundle(path) is None:
+        raise HTTPException(status_code=422, detail=f"bundle must be a serving bundle in {registry.bundle_path}")
+    return bundle
+
+@app.post('/admin/reload', status_code=202, dependencies=[Depends(require_admin)])
+def reload(bundle: Optional[str] = Body(None), quantization: Optional[str] = Body(None)):
+    #-----load a bundle (default the newest one in BUNDLE_PATH) in the background and swap it in once it's warm-----
+    # requests keep being answered by the current model meanwhile. quantization switches the weights variant
+    if quantization is not None and quantization not in QUANTIZATIONS:
+        raise HTTPException(status_code=422, detail=f"quantization must be one of {QUANTIZATIONS}")
+    if bundle is not None:
+        bundle = admin_bundle(bundle)
+    registry.load_in_background(bundle, quantization)
+    return {'loading': bundle or registry.bundle_path, 'quantization': quantization or registry.quantization,
+            'serving': registry.current.version}
+
+@app.get('/stats')
+def stats():
+    return {'batching': batcher.stats(), 'cache': cache.stats(), 'model': registry.current.info()}
 
 #API DONE
@@ -0,0 +1,164 @@
+import collections
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from api.settings import BATCH_WINDOW_MS, BATCH_MAX_SIZE
+
+logger = logging.getLogger('uvicorn.error')
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """collects prediction requests that arrive close together and runs them as one forward pass
+
+    The first request starts a window of window_ms milliseconds. Every request that arrives
+    before the window closes (up to max_batch_size rows) is stacked into one (N, 8, 2) array,
+    and each caller gets back only its own pitch / duration rows.
+
+    Requests can bring their own predict_fn (eg the model they were encoded for), only requests with
+    the same predict_fn are batched together.
+
+    Args:
+        predict_fn (callable): takes an (N, sequence length, 2) array and returns [pitch_pred, duration_pred]
+        window_ms (float): how long to wait for more requests before running the batch
+        max_batch_size (int): largest number of rows to put in one batch
+    """
+
+    def __init__(self, predict_fn, window_ms=BATCH_WINDOW_MS, max_batch_size=BATCH_MAX_SIZE):
+        self.predict_fn = predict_fn
+        self.window_ms = window_ms
+        self.max_batch_size = max_batch_size
+        self.batch_sizes = collections.Counter()
+        self._queue = queue.Queue()
+        self._pending = None
+        self._thread = None
+        self._running = False
+        self._stats_lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+
+    def start(self):
+        with self._submit_lock:
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """stop after the batch being run, requests still waiting (or submitted from now on) fail instead of hanging"""
+        with self._submit_lock:
+            thread, self._thread = self._thread, None
+            self._running = False
+            leftovers = []
+            while True:
+                try:
+                    leftovers.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if thread is not None:
+                self._queue.put(_STOP)
+        if thread is not None:
+            thread.join()
+
+        # the request that didn't fit in the last batch, and the stop marker if the thread never took it
+        leftovers.append(self._pending)
+        self._pending = None
+        while not self._queue.empty():
+            leftovers.append(self._queue.get_nowait())
+        for item in leftovers:
+            if item is not None and item is not _STOP:
+                item[1].set_exception(RuntimeError("the batcher was stopped"))
+
+    def submit(self, input_sequences, predict_fn=None):
+        """queue an (n, sequence length, 2) array and return a future for its [pitch_pred, duration_pred]
+
+        Args:
+            predict_fn (callable): what to run the rows through, default the batcher's predict_fn
+        """
+        future = Future()
+        with self._submit_lock:
+            if not self._running:
+                future.set_exception(RuntimeError("the batcher isn't running, call start() first"))
+            else:
+                self._queue.put((np.asarray(input_sequences), future, predict_fn or self.predict_fn))
+        return future
+
+    def predict(self, input_sequences, predict_fn=None):
+        """same interface as model.predict, but shares the forward pass with other callers"""
+        return self.submit(input_sequences, predict_fn).result()
+
+    def stats(self):
+        """batch size distribution (in rows) of every batch run so far"""
+        with self._stats_lock:
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+        n_batches = sum(batch_sizes.values())
+        n_rows = sum(size * count for size, count in batch_sizes.items())
+        return {
+            'window_ms': self.window_ms,
+            'max_batch_size': self.max_batch_size,
+            'batches': n_batches,
+            'rows': n_rows,
+            'mean_batch_size': n_rows / n_batches if n_batches else 0.0,
+            'batch_size_distribution': batch_sizes,
+        }
+
+    def _next_item(self, timeout=None):
+        # an item that didn't fit in the previous batch goes first in the next one
+        if self._pending is not None:
+            item, self._pending = self._pending, None
+            return item
+        return self._queue.get(timeout=timeout)
+
+    def _collect(self):
+        """block until one request arrives, then gather more until the window closes or the batch is full"""
+        item = self._next_item()
+        if item is _STOP:
+            return None
+
+        batch = [item]
+        n_rows = len(item[0])
+        deadline = time.perf_counter() + self.window_ms / 1000
+        while n_rows < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._next_item(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP or n_rows + len(item[0]) > self.max_batch_size or item[2] != batch[0][2]:
+                self._pending = item
+                break
+            batch.append(item)
+            n_rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            inputs = np.concatenate([input_sequences for input_sequences, _, _ in batch])
+            try:
+                pitch_pred, duration_pred = batch[0][2](inputs)
+            except Exception as e:
+                logger.exception("batched prediction failed")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._stats_lock:
+                self.batch_sizes[len(inputs)] += 1
+
+            # hand each caller back only its own rows
+            start = 0
+            for input_sequences, future, _ in batch:
+                end = start + len(input_sequences)
+                future.set_result([pitch_pred[start:end], duration_pred[start:end]])
+                start = end
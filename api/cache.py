@@ -0,0 +1,79 @@
+import collections
+import threading
+
+import numpy as np
+
+from api.settings import CACHE_MAX_BYTES
+
+
+class PredictionCache:
+    """bounded LRU cache of raw model outputs (pitch / duration probabilities) keyed on the mapped input sequence
+
+    Only the model output is cached, sampling still runs on every request so repeated windows
+    get different notes. Entries are evicted least recently used first once the cached arrays
+    take up more than max_bytes.
+
+    Args:
+        max_bytes (int): memory cap for the cached arrays, 0 turns the cache off
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(input_sequence, generation=0):
+        """cache key for one mapped sequence, generation should change whenever the model is reloaded"""
+        return generation, np.asarray(input_sequence, dtype=np.int16).tobytes()
+
+    def get(self, key):
+        with self._lock:
+            prediction = self._entries.get(key)
+            if prediction is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return prediction
+
+    def put(self, key, prediction):
+        # store read-only copies so a caller can't change what the next hit gets back
+        prediction = [np.array(output) for output in prediction]
+        for output in prediction:
+            output.flags.writeable = False
+        entry_bytes = sum(output.nbytes for output in prediction) + len(key[1])
+        if entry_bytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = prediction
+            self.nbytes += entry_bytes
+            while self.nbytes > self.max_bytes:
+                old_key, old_prediction = self._entries.popitem(last=False)
+                self.nbytes -= sum(output.nbytes for output in old_prediction) + len(old_key[1])
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,87 @@
+import numpy as np
+
+# durations are quarterLengths that are multiples of a 64th note (1/16 of a quarter note)
+DURATION_RESOLUTION = 16
+# a packed note is pitch * PACK_BASE + duration in 64th notes
+PACK_BASE = 256
+
+
+class NoteEncoder:
+    """maps actual pitches / durations to the indexes the model takes in (and back) with dense lookup tables
+
+    Instead of a dict lookup per note, pitch_table[pitch] and duration_table[duration * 16] give the
+    indexes of a whole batch at once, with -1 marking values that aren't in the vocabulary.
+
+    Args:
+        pitch_symb (list): every pitch (midi number) the model knows, in index order
+        duration_symb (list): every duration (quarterLength) the model knows, in index order
+    """
+
+    def __init__(self, pitch_symb, duration_symb):
+        self.pitch_symb = np.asarray(pitch_symb, dtype=np.int64)
+        self.duration_symb = np.asarray(duration_symb, dtype=np.float64)
+
+        self.pitch_table = np.full(self.pitch_symb.max() + 1, -1, dtype=np.int64)
+        self.pitch_table[self.pitch_symb] = np.arange(len(self.pitch_symb))
+
+        duration_steps = np.rint(self.duration_symb * DURATION_RESOLUTION).astype(np.int64)
+        self.duration_table = np.full(duration_steps.max() + 1, -1, dtype=np.int64)
+        self.duration_table[duration_steps] = np.arange(len(self.duration_symb))
+
+    def encode(self, notes):
+        """map an array of [pitch, duration] notes of shape (..., 2) to model indexes
+
+        Raises:
+            ValueError: listing every pitch / duration that isn't in the vocabulary
+        """
+        try:
+            notes = np.asarray(notes, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("notes must be [pitch, duration] pairs of numbers") from None
+        if notes.ndim < 1 or notes.shape[-1] != 2:
+            raise ValueError(f"notes must be [pitch, duration] pairs, got shape {notes.shape}")
+        pitches = notes[..., 0]
+        duration_steps = notes[..., 1] * DURATION_RESOLUTION
+
+        pitch_ok = (pitches == np.rint(pitches)) & (pitches >= 0) & (pitches < len(self.pitch_table))
+        duration_ok = ((duration_steps == np.rint(duration_steps)) & (duration_steps >= 0)
+                       & (duration_steps < len(self.duration_table)))
+        pitch_idx = np.where(pitch_ok, self.pitch_table[np.where(pitch_ok, pitches, 0).astype(np.int64)], -1)
+        duration_idx = np.where(duration_ok, self.duration_table[np.where(duration_ok, duration_steps, 0).astype(np.int64)], -1)
+
+        if (pitch_idx < 0).any() or (duration_idx < 0).any():
+            bad_pitches = np.unique(pitches[pitch_idx < 0]).tolist()
+            bad_durations = np.unique(notes[..., 1][duration_idx < 0]).tolist()
+            problems = [f"unknown {name} {values}" for name, values in [('pitches', bad_pitches), ('durations', bad_durations)] if values]
+            raise ValueError(', '.join(problems))
+
+        return np.stack([pitch_idx, duration_idx], axis=-1)
+
+    def encode_packed(self, packed):
+        """map packed notes (pitch * 256 + duration in 64th notes) to model indexes
+
+        Raises:
+            ValueError: for entries that aren't integers, and listing every packed note out of range
+        """
+        try:
+            packed = np.asarray(packed, dtype=np.int64)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError("packed notes must be integers that fit in int64") from None
+        out_of_range = (packed < 0) | (packed >= len(self.pitch_table) * PACK_BASE)
+        if out_of_range.any():
+            raise ValueError(f"packed notes out of range {np.unique(packed[out_of_range]).tolist()}")
+        notes = np.stack([packed // PACK_BASE, (packed % PACK_BASE) / DURATION_RESOLUTION], axis=-1)
+        return self.encode(notes)
+
+    def decode(self, indexes):
+        """map model indexes of shape (..., 2) back to a nested list of [pitch, duration] notes"""
+        indexes = np.asarray(indexes, dtype=np.int64)
+        pitches = self.pitch_symb[indexes[..., 0]].tolist()
+        durations = self.duration_symb[indexes[..., 1]].tolist()
+        return _zip_nested(pitches, durations)
+
+
+def _zip_nested(pitches, durations):
+    if not isinstance(pitches, list):
+        return [pitches, durations]
+    return [_zip_nested(p, d) for p, d in zip(pitches, durations)]
@@ -0,0 +1,225 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import isdir, isfile, join
+
+import numpy as np
+
+from api.encoding import NoteEncoder
+from api.settings import BUNDLE_PATH, MODEL_PATH, MODEL_QUANTIZATION
+from CoolMelodyProject.bundle import (METADATA_FILENAME, QUANTIZATIONS, SAMPLING_DEFAULTS, bundle_versions,
+                                      latest_bundle, load_bundle_metadata, output_units, weights_filename)
+from CoolMelodyProject.numpy_model import NumpyMelodyModel
+
+logger = logging.getLogger('uvicorn.error')
+
+SEQUENCE_LENGTH = 8
+
+# vocabulary of the model.npz / model.h5 that were trained before serving bundles existed
+LEGACY_PITCH_SYMB = [0] + list(range(29, 95)) + [96]
+LEGACY_DURATION_SYMB = [0., 0.0625, 0.125, 0.25, 0.375, 0.5, 0.75, 1., 1.25, 1.5, 1.75, 2., 2.25, 2.5, 2.75, 3.,
+                        3.25, 3.5, 3.75, 4., 4.5, 5., 6., 7.5, 8.75, 9.5]
+
+
+class ServedModel:
+    """a loaded model with everything that has to change together with it: the vocabulary it was
+    trained on, its sequence length and sampling defaults
+
+    A request takes the registry's current ServedModel once and uses it from start to end, so a model
+    swapped in halfway through a request never sees sequences encoded for the old vocabulary.
+    """
+
+    def __init__(self, model, encoder, sequence_length=SEQUENCE_LENGTH, sampling=None, version='legacy', source=None):
+        self.model = model
+        self.encoder = encoder
+        self.sequence_length = sequence_length
+        self.sampling = {**SAMPLING_DEFAULTS, **(sampling or {})}
+        self.version = version
+        self.source = source
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bundle(cls, bundle_dir, quantization='float32'):
+        """a model and its settings from a serving bundle made with CoolMelodyProject.bundle.save_bundle
+
+        Args:
+            quantization (str): which of the bundle's weights variants to serve
+        """
+        metadata = load_bundle_metadata(bundle_dir)
+        if quantization not in metadata.get('quantizations', ['float32']):
+            raise ValueError(f"{bundle_dir} has no {quantization} weights")
+        model = NumpyMelodyModel.load(join(bundle_dir, weights_filename(quantization)))
+        # every output unit has to decode to a note, or sampling can pick an index past the vocabulary
+        vocabulary_sizes = [len(metadata['pitch_symb']), len(metadata['duration_symb'])]
+        if output_units(model.weights) != vocabulary_sizes:
+            raise ValueError(f"{bundle_dir} has {output_units(model.weights)} output units "
+                             f"for vocabularies of {vocabulary_sizes}")
+        encoder = NoteEncoder(metadata['pitch_symb'], metadata['duration_symb'])
+        return cls(model, encoder, metadata['sequence_length'], metadata['sampling'], metadata['version'], bundle_dir)
+
+    @classmethod
+    def from_model_path(cls, model_path):
+        """a bare model file (.npz weights, or a saved keras model which needs tensorflow) with the legacy vocabulary"""
+        if model_path.endswith('.npz'):
+            model = NumpyMelodyModel.load(model_path)
+        else:
+            from tensorflow import keras
+            model = keras.models.load_model(model_path)
+        return cls(model, NoteEncoder(LEGACY_PITCH_SYMB, LEGACY_DURATION_SYMB), source=model_path)
+
+    def predict(self, input_sequence):
+        """run the model on an array of shape (n, sequence length, 2)
+
+        keras models aren't guaranteed to be thread safe, so calls are serialized with a lock
+        """
+        with self._lock:
+            return self.model.predict(input_sequence, verbose=0)
+
+    def info(self):
+        return {'version': self.version, 'source': self.source, 'generation': self.generation,
+                'quantization': getattr(self.model, 'quantization', None),
+                'sequence_length': self.sequence_length, 'sampling': self.sampling,
+                'pitches': len(self.encoder.pitch_symb), 'durations': len(self.encoder.duration_symb)}
+
+
+def resolve_bundle(path):
+    """the bundle to load for path: path itself if it is a bundle, else the newest bundle in it (None if there's none)"""
+    if isfile(join(path, METADATA_FILENAME)):
+        return path
+    if isdir(path):
+        return latest_bundle(path)
+    return None
+
+
+class ModelRegistry:
+    """keeps the served model in memory so every request shares it instead of reloading it
+
+    A new model is loaded and warmed up while the old one keeps serving, then swapped in with one
+    assignment. Requests that already hold the old model finish on it, so nothing is dropped.
+
+    Args:
+        bundle_path (str): a serving bundle, or a folder of versioned bundles (the newest is served)
+        model_path (str): model file to fall back to when there is no bundle, see ServedModel.from_model_path
+        quantization (str): weights variant to serve from bundles, see ServedModel.from_bundle
+    """
+
+    def __init__(self, bundle_path=BUNDLE_PATH, model_path=MODEL_PATH, quantization=MODEL_QUANTIZATION):
+        self.bundle_path = bundle_path
+        self.model_path = model_path
+        self.quantization = quantization
+        self.generation = 0
+        self.load_listeners = []
+        self._current = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loader = ThreadPoolExecutor(1, thread_name_prefix='model-loader')
+        self._watcher = None
+        self._stop_watching = threading.Event()
+
+    @property
+    def is_loaded(self):
+        return self._current is not None
+
+    @property
+    def current(self):
+        """the ServedModel every new request should use"""
+        served = self._current
+        if served is None:
+            raise RuntimeError("model has not been loaded, call load() first")
+        return served
+
+    @property
+    def model(self):
+        """the shared model, for callers that need more than predict (eg stepping through notes)"""
+        return self.current.model
+
+    def load(self, path=None, quantization=None):
+        """load a bundle (or the default bundle_path / model_path), warm it up, then make it the served model
+
+        Args:
+            quantization (str): weights variant to serve from now on, default the one served so far
+
+        Returns:
+            ServedModel: the model now being served
+        """
+        # one load at a time, the served model keeps answering requests meanwhile
+        with self._load_lock:
+            start = time.perf_counter()
+            quantization = quantization or self.quantization
+            if quantization not in QUANTIZATIONS:
+                raise ValueError(f"quantization must be one of {QUANTIZATIONS}, not {quantization!r}")
+            bundle_dir = resolve_bundle(path or self.bundle_path)
+            if bundle_dir is not None:
+                served = ServedModel.from_bundle(bundle_dir, quantization)
+            elif path is None:
+                served = ServedModel.from_model_path(self.model_path)
+            else:
+                raise ValueError(f"no serving bundle at {path}")
+            load_time = time.perf_counter() - start
+
+            # warm up so the first real request doesn't pay for building the predict function
+            start = time.perf_counter()
+            served.predict(np.zeros((1, served.sequence_length, 2)))
+            warmup_time = time.perf_counter() - start
+
+            with self._lock:
+                # only a bundle actually served with it makes it the variant to serve from now on
+                if bundle_dir is not None:
+                    self.quantization = quantization
+                self.generation += 1
+                served.generation = self.generation
+                self._current = served
+
+        # anything holding onto results from the old model (eg the prediction cache) gets told here
+        for listener in self.load_listeners:
+            listener()
+
+        logger.info(f"serving {served.version} from {served.source}, loaded in {load_time:.3f}s, warm-up took {warmup_time:.3f}s")
+        return served
+
+    def load_in_background(self, path=None, quantization=None):
+        """load() on the loader thread, returns a future of the new ServedModel"""
+        def log_failure(future):
+            if future.exception() is not None:
+                logger.error(f"could not load {path or self.bundle_path}: {future.exception()!r}")
+
+        future = self._loader.submit(self.load, path, quantization)
+        future.add_done_callback(log_failure)
+        return future
+
+    def watch(self, interval):
+        """check bundle_path for a newer bundle every interval seconds, and swap to it when there is one
+
+        Only a version newer than any seen before is loaded, so rolling back to an older bundle
+        (POST /admin/reload with its path) sticks until the next bundle is published.
+        """
+        def run(seen):
+            while not self._stop_watching.wait(interval):
+                versions = bundle_versions(self.bundle_path)
+                newest = max(versions, default=0)
+                if newest <= seen or self._current is None:
+                    continue
+                # a broken bundle is only tried once too, the old model keeps serving
+                seen = newest
+                try:
+                    self.load(versions[newest])
+                except Exception:
+                    logger.exception(f"could not load {versions[newest]}, still serving {self._current.version}")
+
+        if self._watcher is None:
+            self._stop_watching.clear()
+            seen = max(bundle_versions(self.bundle_path), default=0)
+            self._watcher = threading.Thread(target=run, args=(seen,), name='bundle-watcher', daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def predict(self, input_sequence):
+        """run the served model on an array of shape (n, sequence length, 2)"""
+        return self.current.predict(input_sequence)
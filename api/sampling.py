@@ -0,0 +1,106 @@
+import operator
+
+import numpy as np
+
+DEFAULT_TEMPERATURE = 1.0
+DEFAULT_K = 12
+DEFAULT_DURATION_K = 2
+
+
+def as_int(value, name):
+    """value as an int, for settings that can come from raw json where 2.5 or true would otherwise get through
+
+    Raises:
+        ValueError: if value isn't an integer (bools aren't counted as integers)
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        return operator.index(value)
+    except TypeError:
+        raise ValueError(f"{name} must be an integer") from None
+
+
+def sample(probs, n_samples=1, k=None, temperature=1.0, top_p=None, rng=None):
+    """sample indexes from every row of a batch of probabilities in a few numpy operations
+
+    Probabilities are turned into logits and divided by temperature, then only the top k
+    (and / or the smallest set of indexes whose probability adds up to top_p) can be sampled.
+
+    Args:
+        probs (np.ndarray): model output of shape (batch, vocabulary size)
+        n_samples (int): how many indexes to draw (with replacement) from each row
+        k (int): only sample from the k most likely indexes, None for no limit
+        temperature (float): below 1 makes likely indexes more likely, above 1 flattens the distribution
+        top_p (float): only sample from the most likely indexes that make up top_p of the probability
+        rng (np.random.Generator): random generator to draw with, eg np.random.default_rng(seed)
+
+    Returns:
+        np.ndarray: sampled indexes of shape (batch, n_samples)
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    probs = np.atleast_2d(np.asarray(probs, dtype=np.float64))
+    logits = np.log(np.maximum(probs, np.finfo(np.float64).tiny)) / temperature
+
+    # sort each row once, most likely first, and do top k / top p on the sorted rows
+    order = np.argsort(-logits, axis=-1)
+    sorted_logits = np.take_along_axis(logits, order, axis=-1)
+    if k is not None:
+        sorted_logits = sorted_logits[:, :k]
+        order = order[:, :k]
+
+    sorted_probs = np.exp(sorted_logits - sorted_logits[:, :1])
+    sorted_probs /= sorted_probs.sum(axis=-1, keepdims=True)
+    if top_p is not None:
+        # keep an index if the indexes before it don't already make up top_p (so the first is always kept)
+        before = np.cumsum(sorted_probs, axis=-1) - sorted_probs
+        sorted_probs = np.where(before < top_p, sorted_probs, 0)
+        sorted_probs /= sorted_probs.sum(axis=-1, keepdims=True)
+
+    # inverse cdf sampling for every row and sample at once
+    cdf = np.cumsum(sorted_probs, axis=-1)
+    u = rng.random((len(cdf), n_samples)) * cdf[:, -1:]
+    picks = (u[:, :, None] >= cdf[:, None, :]).sum(axis=-1)
+    picks = np.minimum(picks, cdf.shape[-1] - 1)
+    return np.take_along_axis(order, picks, axis=-1)
+
+
+class Sampler:
+    """sampling settings for one request, with its own random generator so a seed makes the request reproducible
+
+    Args:
+        temperature (float): temperature for pitches and durations
+        k (int): number of most likely pitches to sample from
+        top_p (float): nucleus sampling threshold for pitches, None to turn it off
+        duration_k (int): number of most likely durations to sample from
+        seed (int): seed for the random generator, None for a random seed
+
+    Raises:
+        ValueError: if a setting is out of range, or k / duration_k / seed aren't integers
+    """
+
+    def __init__(self, temperature=DEFAULT_TEMPERATURE, k=DEFAULT_K, top_p=None, duration_k=DEFAULT_DURATION_K, seed=None):
+        k, duration_k = as_int(k, 'k'), as_int(duration_k, 'duration_k')
+        seed = None if seed is None else as_int(seed, 'seed')
+        if not temperature > 0:
+            raise ValueError("temperature must be greater than 0")
+        if k < 1 or duration_k < 1:
+            raise ValueError("k and duration_k must be at least 1")
+        if top_p is not None and not 0 < top_p <= 1:
+            raise ValueError("top_p must be greater than 0 and at most 1")
+
+        self.temperature = temperature
+        self.k = k
+        self.top_p = top_p
+        self.duration_k = duration_k
+        self.rng = np.random.default_rng(seed)
+
+    def sample_notes(self, pitch_pred, duration_pred, n_notes):
+        """sample n_notes [pitch index, duration index] pairs for every row of model output
+
+        Returns:
+            np.ndarray: shape (batch, n_notes, 2)
+        """
+        pitches = sample(pitch_pred, n_notes, self.k, self.temperature, self.top_p, self.rng)
+        durations = sample(duration_pred, n_notes, self.duration_k, self.temperature, rng=self.rng)
+        return np.stack([pitches, durations], axis=-1)
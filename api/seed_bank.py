@@ -0,0 +1,73 @@
+import glob
+import random
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+len_in_64th_notes = {'64': 1, '32': 2, '32d': 3, '16': 4, '16d': 6, '8': 8, '8d': 12,
+                     '8dd': 14, '4': 16, '4d': 24, '2': 32, '2d': 48, '1': 64}
+
+reverse_len_in_64th_notes = {v: k for k, v in len_in_64th_notes.items()}
+
+
+def clean_csv_paths(csv_dir, csv_numbers=None):
+    """paths of the clean csvs to use as seeds, csv_numbers=None uses every csv in csv_dir"""
+    if csv_numbers is None:
+        return sorted(glob.glob(join(csv_dir, 'csv_*.csv')))
+    return [join(csv_dir, f'csv_{n}.csv') for n in csv_numbers]
+
+
+def parse_pitch_durs(pitch_durs):
+    """turn a column of 'pitch-duration' strings (eg '72-4d') into pitch and 64th note length arrays"""
+    split = pitch_durs.str.split('-', n=1, expand=True)
+    pitches = split[0].astype(np.int16).to_numpy()
+    durations = split[1].map(len_in_64th_notes).astype(np.int16).to_numpy()
+    return pitches, durations
+
+
+class SeedBank:
+    """opening sequences for /initialize, parsed once at startup so requests never read a csv
+
+    All pieces are kept in two contiguous integer arrays (pitch, and duration in 64th notes),
+    with piece_starts / piece_lengths marking where each piece is.
+
+    Args:
+        pieces (list): (pitches, durations) array pairs, one per piece
+        sequence_length (int): number of notes in each seed
+    """
+
+    def __init__(self, pieces, sequence_length=8):
+        pieces = [(p, d) for p, d in pieces if len(p) >= sequence_length]
+        if not pieces:
+            raise ValueError(f"no piece has at least {sequence_length} notes")
+
+        self.sequence_length = sequence_length
+        self.pitches = np.concatenate([p for p, _ in pieces])
+        self.durations = np.concatenate([d for _, d in pieces])
+        self.piece_lengths = np.array([len(p) for p, _ in pieces])
+        self.piece_starts = np.concatenate([[0], np.cumsum(self.piece_lengths)[:-1]])
+
+    @classmethod
+    def from_csvs(cls, csv_paths, sequence_length=8):
+        pieces = [parse_pitch_durs(pd.read_csv(path, usecols=['pitch_dur0'])['pitch_dur0']) for path in csv_paths]
+        return cls(pieces, sequence_length)
+
+    def __len__(self):
+        return len(self.piece_lengths)
+
+    def sample(self, random_offset=False, rng=random):
+        """pick a piece at random and return a seed as [[pitch, duration code], ...]
+
+        Args:
+            random_offset (bool): start anywhere in the piece instead of at its first note
+            rng: anything with randrange, eg the random module or random.Random(seed)
+        """
+        piece = rng.randrange(len(self))
+        start = self.piece_starts[piece]
+        if random_offset:
+            start += rng.randrange(self.piece_lengths[piece] - self.sequence_length + 1)
+        end = start + self.sequence_length
+
+        return [[int(pitch), reverse_len_in_64th_notes[int(duration)]]
+                for pitch, duration in zip(self.pitches[start:end], self.durations[start:end])]
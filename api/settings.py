@@ -0,0 +1,34 @@
+import os
+
+# every setting can be overridden with an environment variable of the same name
+
+# serving bundle made by train_model, or a folder of versioned bundles (the newest one is served)
+BUNDLE_PATH = os.environ.get('BUNDLE_PATH', 'bundles')
+# seconds between checks of BUNDLE_PATH for a newer bundle to swap to, 0 turns it off
+BUNDLE_POLL_SECONDS = float(os.environ.get('BUNDLE_POLL_SECONDS', 0))
+
+# token POST /admin/reload has to be sent with (X-Admin-Token header), the admin endpoints are off when it's empty
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# weights variant of the bundle to serve: float32, float16 or int8 (see CoolMelodyProject/quantize.py for how they compare)
+MODEL_QUANTIZATION = os.environ.get('MODEL_QUANTIZATION', 'float32')
+
+# model served when there is no bundle: .npz weights are served with the numpy model, anything else is loaded with keras
+MODEL_PATH = os.environ.get('MODEL_PATH', 'model.npz')
+
+# micro-batching: how long to wait for more requests before running a batch, and the largest batch to run
+BATCH_WINDOW_MS = float(os.environ.get('BATCH_WINDOW_MS', 5))
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 32))
+
+# /initialize seeds: folder of clean csvs, and which csv numbers to use ('all' uses every csv in the folder)
+SEED_CSV_PATH = os.environ.get('SEED_CSV_PATH', 'raw_data/clean_csvs')
+SEED_CSVS = os.environ.get('SEED_CSVS', '1,7,9,13,15,22,23,30')
+
+# longest melody /generate will create in one request
+MAX_GENERATE_NOTES = int(os.environ.get('MAX_GENERATE_NOTES', 256))
+
+# memory cap in bytes for cached model outputs of repeated /predict windows, 0 turns the cache off
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+# most sequences one POST /predict request can send
+MAX_REQUEST_SEQUENCES = int(os.environ.get('MAX_REQUEST_SEQUENCES', 256))
@@ -0,0 +1,5 @@
+import sys
+from os.path import abspath, dirname, join
+
+# the CoolMelodyProject scripts import each other as top level modules (they're run from that folder)
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'CoolMelodyProject'))
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import api.api
+from api.api import app, encode_sequences, parse_sequence
+from api.encoding import NoteEncoder
+from api.registry import ModelRegistry
+from tests.test_registry import publish
+
+served = SimpleNamespace(encoder=NoteEncoder([0, 60, 62, 64, 72], [0.25, 0.5, 1.0, 1.5]), sequence_length=2)
+
+
+def test_encode_sequences_maps_good_sequences():
+    assert encode_sequences(served, [parse_sequence('[[60, 0.5], [72, 0.25]]')]).tolist() == [[[1, 1], [4, 0]]]
+    assert encode_sequences(served, [[60 * 256 + 8, 72 * 256 + 4]], packed=True).tolist() == [[[1, 1], [4, 0]]]
+
+
+@pytest.mark.parametrize('sequence', ['5', 'null', '"notes"', '{}', '[]', '[5, 6]', '[[60, 0.5], 5]',
+                                      '[[60, 0.5], [62]]', '[[60, 0.5], [62, null]]', '[[60, 0.5], [true, 0.5]]',
+                                      '[[60, 0.5]]', '[[60, 0.5'])
+def test_malformed_sequences_are_422(sequence):
+    with pytest.raises(HTTPException) as e:
+        encode_sequences(served, [parse_sequence(sequence)])
+    assert e.value.status_code == 422
+
+
+@pytest.mark.parametrize('sequences', [None, 5, [], [5, 6], [[60 * 256 + 8, 2 ** 70]], [[60 * 256 + 8, -1]],
+                                       [[60 * 256 + 8], [60 * 256 + 8, 60 * 256 + 8]]])
+def test_malformed_packed_sequences_are_422(sequences):
+    with pytest.raises(HTTPException) as e:
+        encode_sequences(served, sequences, packed=True)
+    assert e.value.status_code == 422
+
+
+@pytest.fixture
+def admin_client(tmp_path, monkeypatch):
+    bundles_dir = tmp_path / 'bundles'
+    first = publish(bundles_dir)
+    publish(bundles_dir)
+    registry = ModelRegistry(bundle_path=str(bundles_dir))
+    registry.load()
+    monkeypatch.setattr(api.api, 'registry', registry)
+    monkeypatch.setattr(api.api, 'ADMIN_TOKEN', 'secret')
+    yield TestClient(app), registry, first
+    registry.stop()
+
+
+def test_reload_needs_the_admin_token(admin_client, monkeypatch):
+    client, registry, first = admin_client
+    assert client.post('/admin/reload', json={'bundle': first}).status_code == 401
+    assert client.post('/admin/reload', json={'bundle': first}, headers={'X-Admin-Token': 'guess'}).status_code == 401
+
+    monkeypatch.setattr(api.api, 'ADMIN_TOKEN', '')
+    assert client.post('/admin/reload', json={'bundle': first}, headers={'X-Admin-Token': ''}).status_code == 403
+    assert registry.current.version == 'v0002'
+
+
+def test_reload_only_loads_bundles_inside_the_bundle_path(admin_client, tmp_path):
+    client, registry, first = admin_client
+    headers = {'X-Admin-Token': 'secret'}
+    outside = publish(tmp_path / 'elsewhere')
+    for bundle in [outside, str(tmp_path / 'bundles' / '..' / 'elsewhere' / 'v0001'), str(tmp_path / 'bundles' / 'v0009')]:
+        assert client.post('/admin/reload', json={'bundle': bundle}, headers=headers).status_code == 422
+
+    assert client.post('/admin/reload', json={'quantization': 'bogus'}, headers=headers).status_code == 422
+
+    response = client.post('/admin/reload', json={'bundle': first}, headers=headers)
+    assert response.status_code == 202
+    # the loader thread runs one job at a time, so this waits for the reload
+    registry._loader.submit(lambda: None).result()
+    assert registry.current.version == 'v0001'
+
+
+@pytest.mark.parametrize('message', [{'n_notes': 2.5}, {'n_notes': True}, {'n_notes': '4'},
+                                     {'k': 2.5}, {'k': True}, {'duration_k': 1.5}, {'seed': 0.5}])
+def test_generate_ws_sends_an_error_for_settings_that_arent_integers(admin_client, message):
+    client, registry, _ = admin_client
+    sequence = [[registry.current.encoder.pitch_symb[1].item(), 0.5]] * 8
+    with client.websocket_connect('/generate/ws') as websocket:
+        websocket.send_json({'sequence': sequence, 'n_notes': 4, **message})
+        assert 'error' in websocket.receive_json()
+        assert websocket.receive()['code'] == 1008
+
+
+def test_generate_ws_streams_a_melody(admin_client):
+    client, registry, _ = admin_client
+    sequence = [[registry.current.encoder.pitch_symb[1].item(), 0.5]] * 8
+    with client.websocket_connect('/generate/ws') as websocket:
+        websocket.send_json({'sequence': sequence, 'n_notes': 3, 'k': 3, 'seed': 1})
+        assert [websocket.receive_json()['index'] for _ in range(3)] == [0, 1, 2]
+        assert websocket.receive_json() == {'end': True}
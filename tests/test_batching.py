@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from api.batching import MicroBatcher
+
+
+def fake_predict(inputs):
+    # pitch row = sum of the sequence, duration row = first pitch, so rows can be traced back to callers
+    return [inputs.sum(axis=(1, 2)).reshape(-1, 1), inputs[:, :1, 0]]
+
+
+def test_batched_rows_go_back_to_their_callers():
+    batcher = MicroBatcher(fake_predict, window_ms=50, max_batch_size=8)
+    batcher.start()
+    inputs = [np.full((1, 8, 2), i) for i in range(20)]
+    with ThreadPoolExecutor(20) as pool:
+        results = list(pool.map(batcher.predict, inputs))
+    batcher.stop()
+
+    for i, (pitch_pred, duration_pred) in enumerate(results):
+        assert pitch_pred.tolist() == [[16 * i]]
+        assert duration_pred.tolist() == [[i]]
+
+    stats = batcher.stats()
+    assert stats['rows'] == 20
+    assert max(stats['batch_size_distribution']) <= 8
+    assert stats['batches'] < 20
+
+
+def test_requests_for_different_models_are_never_batched_together():
+    batcher = MicroBatcher(fake_predict, window_ms=50, max_batch_size=64)
+    batcher.start()
+
+    def other_model(inputs):
+        return [-inputs.sum(axis=(1, 2)).reshape(-1, 1), inputs[:, :1, 0]]
+
+    inputs = [np.full((1, 8, 2), i) for i in range(20)]
+    with ThreadPoolExecutor(20) as pool:
+        futures = [pool.submit(batcher.predict, x, other_model if i % 2 else None) for i, x in enumerate(inputs)]
+        results = [future.result() for future in futures]
+    batcher.stop()
+
+    for i, (pitch_pred, _) in enumerate(results):
+        assert pitch_pred.tolist() == [[-16 * i if i % 2 else 16 * i]]
+    assert batcher.stats()['rows'] == 20
+
+
+def test_stop_leaves_no_request_hanging():
+    started, release = threading.Event(), threading.Event()
+
+    def slow_predict(inputs):
+        started.set()
+        release.wait()
+        return fake_predict(inputs)
+
+    batcher = MicroBatcher(slow_predict, window_ms=0, max_batch_size=1)
+    batcher.start()
+    futures = [batcher.submit(np.full((1, 8, 2), i)) for i in range(5)]
+    started.wait()
+    stopping = threading.Thread(target=batcher.stop)
+    stopping.start()
+    release.set()
+    stopping.join(timeout=5)
+    assert not stopping.is_alive()
+
+    # the batch that was running finishes, the requests still queued fail instead of waiting forever
+    assert futures[0].result(timeout=1)[0].tolist() == [[0]]
+    for future in futures[1:]:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=1)
+    with pytest.raises(RuntimeError):
+        batcher.submit(np.zeros((1, 8, 2))).result(timeout=1)
+    with pytest.raises(RuntimeError):
+        batcher.predict(np.zeros((1, 8, 2)))
@@ -0,0 +1,32 @@
+import numpy as np
+
+from api.cache import PredictionCache
+
+
+def prediction(value):
+    return [np.full((1, 68), value, dtype=np.float32), np.full((1, 25), value, dtype=np.float32)]
+
+
+def test_cache_counts_hits_misses_and_evicts_least_recently_used():
+    entry_bytes = (68 + 25) * 4 + 16 * 2
+    cache = PredictionCache(max_bytes=2 * entry_bytes)
+    keys = [cache.key(np.full((1, 8, 2), i)) for i in range(3)]
+
+    assert cache.get(keys[0]) is None
+    cache.put(keys[0], prediction(0))
+    cache.put(keys[1], prediction(1))
+    assert cache.get(keys[0])[0][0, 0] == 0   # keys[1] is now least recently used
+    cache.put(keys[2], prediction(2))
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2])[1][0, 0] == 2
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['entries']) == (2, 2, 1, 2)
+    assert stats['bytes'] <= 2 * entry_bytes
+
+
+def test_reloaded_model_does_not_hit_old_entries():
+    cache = PredictionCache()
+    sequence = np.zeros((1, 8, 2))
+    cache.put(cache.key(sequence, generation=1), prediction(0))
+    assert cache.get(cache.key(sequence, generation=2)) is None
@@ -0,0 +1,95 @@
+from os.path import join
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from checkpoints import (BEST_WEIGHTS_FILENAME, CHECKPOINT_FILENAME, Checkpointer, ResumableEarlyStopping, load_state,
+                         new_state, vocabulary_positions, warm_start)
+from train_model import build_model
+
+
+def random_data(n=64, num_pitches=6, num_durations=4, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.integers(0, 4, (n, 8, 2)).astype(np.float32)
+    y = {'pitch_output': rng.integers(0, num_pitches, (n, 1)), 'duration_output': rng.integers(0, num_durations, (n, 1))}
+    return X, y
+
+
+def y_slice(y, n):
+    return {name: value[:n] for name, value in y.items()}
+
+
+def test_resumed_run_carries_on_from_the_checkpoint(tmp_path):
+    from tensorflow.keras.models import load_model
+
+    X, y = random_data()
+    model = build_model((8, 2), 0.01, 6, 4)
+    state = new_state([{}, {}, {}, {}])
+    model.fit(X, y, validation_data=(X, y), epochs=2, batch_size=16, verbose=0, callbacks=[Checkpointer(tmp_path, state)])
+
+    # what a new process would do after a crash
+    saved_state = load_state(tmp_path)
+    assert saved_state['epoch'] == 2 and len(saved_state['history']['val_loss']) == 2
+    resumed = load_model(join(tmp_path, CHECKPOINT_FILENAME))
+    assert int(resumed.optimizer.iterations.numpy()) == 2 * 4
+    for saved, trained in zip(resumed.get_weights(), model.get_weights()):
+        np.testing.assert_allclose(saved, trained)
+
+    resumed.fit(X, y, validation_data=(X, y), epochs=4, initial_epoch=saved_state['epoch'], batch_size=16, verbose=0,
+                callbacks=[Checkpointer(tmp_path, saved_state)])
+    assert int(resumed.optimizer.iterations.numpy()) == 4 * 4
+    assert load_state(tmp_path)['epoch'] == 4
+    assert len(load_state(tmp_path)['history']['val_loss']) == 4
+
+
+def test_best_weights_are_the_ones_of_the_best_epoch(tmp_path):
+    from tensorflow.keras.callbacks import LambdaCallback
+
+    X, y = random_data()
+    model = build_model((8, 2), 0.01, 6, 4)
+    state = new_state([{}, {}, {}, {}])
+    epoch_weights = []
+    keep_weights = LambdaCallback(on_epoch_end=lambda epoch, logs: epoch_weights.append(model.get_weights()))
+    model.fit(X, y, validation_data=(X[:16], y_slice(y, 16)), epochs=4, batch_size=16, verbose=0,
+              callbacks=[Checkpointer(tmp_path, state), keep_weights])
+
+    # what train_model.main does once training stops
+    model.load_weights(join(tmp_path, BEST_WEIGHTS_FILENAME))
+    for loaded, best in zip(model.get_weights(), epoch_weights[state['best_epoch']]):
+        np.testing.assert_allclose(loaded, best)
+
+
+def test_resumed_early_stopping_counts_from_the_best_epoch():
+    state = {**new_state([{}, {}, {}, {}]), 'epoch': 5, 'best': 0.5, 'best_epoch': 2}
+    es = ResumableEarlyStopping(state, patience=3)
+    es.on_train_begin()
+    assert es.best == 0.5 and es.wait == 2
+
+
+def test_vocabulary_positions_match_values_across_json_round_trips():
+    old = {'60': 0, '62': 1, '64': 2, '-1': -1}
+    new = {58: 0, 60: 1, 62: 2, 64: 3, 65: 4, -1: -1}
+    assert vocabulary_positions(old, new).tolist() == [[0, 1], [1, 2], [2, 3]]
+
+
+def test_warm_start_moves_output_units_to_the_new_vocabulary():
+    old_mappings = [{60: 0, 62: 1, 64: 2, -1: -1}, {}, {0.5: 0, 1.0: 1, -1.0: -1}, {}]
+    new_mappings = [{58: 0, 60: 1, 62: 2, 64: 3, -1: -1}, {}, {0.5: 0, 0.75: 1, 1.0: 2, 1.5: 3, -1.0: -1}, {}]
+    old_model = build_model((8, 2), 0.01, 4, 3)
+    rng = np.random.default_rng(0)
+    old_model.set_weights([rng.normal(size=w.shape) for w in old_model.get_weights()])
+    new_model = warm_start(old_model, build_model((8, 2), 0.01, 5, 5), old_mappings, new_mappings)
+
+    for layer in ['first_LSTM', 'pitch_LSTM', 'duration_dense']:
+        for old, new in zip(old_model.get_layer(layer).get_weights(), new_model.get_layer(layer).get_weights()):
+            np.testing.assert_array_equal(old, new)
+
+    for layer, old_units, new_units, added in [('pitch_output', [0, 1, 2], [1, 2, 3], [0]),
+                                               ('duration_output', [0, 1], [0, 2], [1, 3])]:
+        kernel, bias = old_model.get_layer(layer).get_weights()
+        new_kernel, new_bias = new_model.get_layer(layer).get_weights()
+        np.testing.assert_array_equal(new_kernel[:, new_units], kernel[:, old_units])
+        np.testing.assert_array_equal(new_bias[new_units], bias[old_units])
+        np.testing.assert_array_equal(new_bias[added], bias.min())
@@ -0,0 +1,65 @@
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from CoolMelodyProject import csvcombiner
+from CoolMelodyProject.corpus_store import load_corpus, load_corpus_metadata, save_corpus, select_movements
+
+SONATA_PATH = join(dirname(dirname(abspath(__file__))), 'raw_data', 'mozart_sonatas')
+FILENAMES = ['mps - K279-I.csv', 'mps - K283-III.csv', 'mps - K310-I.csv', 'mps - K545-I.csv']
+
+
+@pytest.fixture(scope='module')
+def corpus_dir(tmp_path_factory):
+    corpus_dir = tmp_path_factory.mktemp('corpus')
+    save_corpus(corpus_dir, SONATA_PATH, FILENAMES, workers=1)
+    return corpus_dir
+
+
+def test_corpus_holds_the_csvs(corpus_dir):
+    corpus = load_corpus(corpus_dir)
+    assert list(corpus['movement'].cat.categories) == ['K279-I', 'K283-III', 'K310-I', 'K545-I']
+    assert isinstance(corpus['note_name'].dtype, pd.CategoricalDtype)
+    assert corpus['measure'].dtype == np.int8
+
+    for filename, (_, movement) in zip(FILENAMES, corpus.groupby('movement', sort=False, observed=True)):
+        csv = pd.read_csv(join(SONATA_PATH, filename))
+        movement = movement.drop(columns='movement').reset_index(drop=True)
+        for column in csv.columns:
+            assert movement[column].astype(str).tolist() == csv[column].astype(str).tolist()
+
+
+def test_reading_some_columns_of_some_movements(corpus_dir):
+    metadata = load_corpus_metadata(corpus_dir)
+    assert select_movements(metadata, key='c major') == ['K279-I', 'K545-I']
+    assert select_movements(metadata, key=['g major', 'a minor'], time_sig='common') == ['K310-I']
+
+    corpus = load_corpus(corpus_dir, ['note_name', 'duration'], key='c major')
+    assert list(corpus.columns) == ['movement', 'note_name', 'duration']
+    csvs = [pd.read_csv(join(SONATA_PATH, filename)) for filename in [FILENAMES[0], FILENAMES[3]]]
+    assert corpus['note_name'].tolist() == pd.concat(csvs)['note_name'].tolist()
+
+    assert len(load_corpus(corpus_dir, ['harm'], movements=['K283-III'], key='c major')) == 0
+    with pytest.raises(KeyError):
+        load_corpus(corpus_dir, ['pitch'])
+    with pytest.raises(ValueError):
+        load_corpus(corpus_dir, composer='mozart')
+
+
+def test_refuses_to_store_no_movements(tmp_path):
+    with pytest.raises(ValueError):
+        save_corpus(tmp_path / 'corpus', SONATA_PATH, [])
+    assert not (tmp_path / 'corpus').exists()
+
+
+def test_csvcombiner_lists_the_folder_once(monkeypatch):
+    monkeypatch.chdir(join(SONATA_PATH, '..', '..', 'CoolMelodyProject'))
+    calls = []
+    listdir = csvcombiner.listdir
+    monkeypatch.setattr(csvcombiner, 'listdir', lambda path: calls.append(path) or listdir(path))
+
+    movement_dfs = csvcombiner.get_movement_df_list()
+    assert len(calls) == 1
+    assert len(movement_dfs) == len(listdir(SONATA_PATH)) - 2
@@ -0,0 +1,125 @@
+import collections
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pandas as pd
+import pretty_midi
+import pytest
+
+from CoolMelodyProject.csvcleaner import (beat_dict, bpm_converter_dict, load_pieces, maj_key_converter_dict,
+                                          midi_to_notes, min_key_converter_dict, note_times, notes_to_midi, process_df,
+                                          process_movements)
+from CoolMelodyProject.csvcombiner import get_movement_filenames
+
+SONATA_PATH = join(dirname(dirname(abspath(__file__))), 'raw_data', 'mozart_sonatas')
+
+
+def process_df_rowwise(filename):
+    """the original process_df, converting one row at a time, kept to check the lookup tables against"""
+    pieces_df = pd.read_csv(join(SONATA_PATH, 'mps - pieces.csv'))
+    k_num = filename.split(' - ')[1].split('.csv')[0].strip(' ')
+    df = pd.read_csv(join(SONATA_PATH, filename))
+
+    def normalize_pitches(note, piece_key_type, piece_key):
+        if note > 0:
+            if piece_key_type == 'major':
+                note += maj_key_converter_dict[piece_key]
+            else:
+                note += min_key_converter_dict[piece_key]
+        return note
+
+    def duration_to_seconds(note, piece_spb):
+        note = str(note)
+        if note[-2:] == 'dd':
+            return piece_spb * beat_dict[note[:-2]] * 1.75
+        elif note[-1] == 'd':
+            return piece_spb * beat_dict[note[:-1]] * 1.5
+        return piece_spb * beat_dict[note]
+
+    df['pitch'] = df.note_name.apply(lambda x: pretty_midi.note_name_to_number(x) if x != 'r' else 0)
+    piece_key = pieces_df[pieces_df['name'] == k_num]['key'].values[0].strip(' ')
+    piece_key_type = piece_key.split(' ')[1].strip(' ')
+    df['pitch_norm'] = df.pitch.apply(normalize_pitches, args=(piece_key_type, piece_key))
+
+    piece_bpm = pieces_df[pieces_df['name'] == k_num]['bpm'].values[0].split('=')
+    piece_bpm_norm = int(bpm_converter_dict[piece_bpm[0]] * int(piece_bpm[1]))
+    df['dur(s)'] = df.duration.apply(duration_to_seconds, args=(60 / piece_bpm_norm,))
+    return df
+
+
+def midi_to_notes_roundtrip(notes):
+    """the original midi_to_notes: write the processed notes to a PrettyMIDI one row at a time and read them back"""
+    instrument = pretty_midi.Instrument(program=pretty_midi.instrument_name_to_program('Acoustic Guitar (nylon)'))
+    prev_start = 0
+    for i, note in notes.iterrows():
+        start = float(prev_start)
+        end = float(prev_start + note['dur(s)'])
+        if note['note_name'] == 'r':
+            start += float(note['dur(s)'])
+            prev_start = start
+        else:
+            instrument.notes.append(pretty_midi.Note(velocity=100, pitch=note['pitch_norm'], start=start, end=end))
+            prev_start = end
+
+    columns = collections.defaultdict(list)
+    sorted_notes = sorted(instrument.notes, key=lambda note: note.start)
+    prev_start = sorted_notes[0].start
+    for note in sorted_notes:
+        columns['pitch'].append(note.pitch)
+        columns['start'].append(note.start)
+        columns['end'].append(note.end)
+        columns['step'].append(note.start - prev_start)
+        columns['duration'].append(note.end - note.start)
+        prev_start = note.start
+    return pd.DataFrame({name: np.array(value) for name, value in columns.items()})
+
+
+def test_lookup_tables_match_the_rowwise_conversion():
+    pieces = load_pieces(SONATA_PATH)
+    for filename in get_movement_filenames(SONATA_PATH):
+        pd.testing.assert_frame_equal(process_df(filename, pieces, SONATA_PATH), process_df_rowwise(filename))
+
+
+def test_all_movements_are_processed_into_one_df_in_order():
+    filenames = sorted(get_movement_filenames(SONATA_PATH))
+    serial = process_movements(filenames, SONATA_PATH, workers=1)
+    parallel = process_movements(filenames, SONATA_PATH, workers=2)
+    pd.testing.assert_frame_equal(serial, parallel)
+
+    assert list(serial['movement'].unique()) == [f.split(' - ')[1][:-4] for f in filenames]
+    for filename, (_, movement) in zip(filenames, serial.groupby('movement', sort=False)):
+        # durations are strings or ints depending on the csv, so the stacked column is object
+        pd.testing.assert_frame_equal(movement.drop(columns='movement').reset_index(drop=True),
+                                      process_df_rowwise(filename), check_dtype=False)
+
+
+def test_unknown_duration_codes_are_an_error(tmp_path):
+    pieces = load_pieces(SONATA_PATH)
+    pd.DataFrame({'note_name': ['c4', 'd4'], 'duration': ['4', '3x']}).to_csv(tmp_path / 'mps - K279-I.csv', index=False)
+    with pytest.raises(ValueError, match='3x'):
+        process_df('mps - K279-I.csv', pieces, tmp_path)
+
+
+def test_note_times_are_identical_to_the_midi_roundtrip():
+    pieces = load_pieces(SONATA_PATH)
+    filenames = sorted(get_movement_filenames(SONATA_PATH))
+    for filename in filenames:
+        # exactly the same floats, not just close ones
+        pd.testing.assert_frame_equal(note_times(process_df(filename, pieces, SONATA_PATH)),
+                                      midi_to_notes_roundtrip(process_df_rowwise(filename)), check_exact=True)
+
+    # all movements at once, times start again at 0 for each movement
+    stacked = note_times(process_movements(filenames, SONATA_PATH, workers=1))
+    for filename, (_, movement) in zip(filenames, stacked.groupby('movement', sort=False)):
+        pd.testing.assert_frame_equal(movement.drop(columns='movement').reset_index(drop=True),
+                                      midi_to_notes_roundtrip(process_df_rowwise(filename)), check_exact=True)
+
+
+def test_notes_to_midi_holds_the_note_times(monkeypatch):
+    monkeypatch.chdir(join(SONATA_PATH, '..', '..', 'CoolMelodyProject'))
+    filename = sorted(get_movement_filenames(SONATA_PATH))[0]
+    notes = midi_to_notes(filename)
+    midi_notes = notes_to_midi(filename).instruments[0].notes
+    assert [note.pitch for note in midi_notes] == notes['pitch'].tolist()
+    assert [note.start for note in midi_notes] == notes['start'].tolist()
+    assert [note.end for note in midi_notes] == notes['end'].tolist()
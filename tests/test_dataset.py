@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+
+from dataset import (export_json, is_sharded, load_dataset, load_dataset_shard, load_metadata, save_dataset,
+                     save_sharded_dataset)
+
+
+def test_saved_dataset_loads_memory_mapped_and_matches_json(tmp_path):
+    rng = np.random.default_rng(0)
+    arrays = {
+        'X': rng.integers(-1, 30, size=(50, 8, 2)),
+        'y_pitch': rng.integers(0, 30, size=(50, 1)),
+        'y_duration': rng.integers(0, 10, size=(50, 1)),
+        'sample_weights': rng.random((50, 1)),
+    }
+    mapping_dicts = [{60: 0, -1: -1}, {0: 60, -1: -1}, {0.5: 0, -1.0: -1}, {0: 0.5, -1: -1.0}]
+
+    save_dataset(tmp_path / 'dataset', arrays, mapping_dicts)
+    loaded, loaded_mappings = load_dataset(tmp_path / 'dataset')
+    export_json(tmp_path / 'data.json', arrays, mapping_dicts)
+    with open(tmp_path / 'data.json') as f:
+        data = json.load(f)
+
+    for name, array in arrays.items():
+        assert isinstance(loaded[name], np.memmap)
+        np.testing.assert_array_equal(loaded[name], array)
+        np.testing.assert_array_equal(np.array(data[name]), array)
+    assert loaded_mappings == [data[name] for name in ['pitch_mapping', 'pitch_reverse_mapping',
+                                                        'duration_mapping', 'duration_reverse_mapping']]
+
+
+def test_sharded_dataset_splits_every_sample_into_one_shard(tmp_path):
+    rng = np.random.default_rng(0)
+    arrays = {
+        'X': rng.integers(-1, 30, size=(50, 8, 2)),
+        'y_pitch': np.arange(50).reshape(-1, 1),
+        'y_duration': rng.integers(0, 10, size=(50, 1)),
+        'sample_weights': rng.random((50, 1)),
+    }
+    save_sharded_dataset(tmp_path / 'dataset', arrays, [{}, {}, {}, {}], shard_size=16)
+
+    metadata = load_metadata(tmp_path / 'dataset')
+    assert is_sharded(tmp_path / 'dataset')
+    assert [shard['samples'] for shard in metadata['shards']] == [16, 16, 16, 2]
+    assert metadata['arrays']['X'] == {'dtype': 'int64', 'shape': [50, 8, 2]}
+
+    shards = [load_dataset_shard(tmp_path / 'dataset', shard) for shard in range(4)]
+    rows = np.concatenate([shard['y_pitch'] for shard in shards]).reshape(-1)
+    np.testing.assert_array_equal(np.sort(rows), np.arange(50))
+    # shuffled across shards
+    assert not np.array_equal(rows, np.arange(50))
+    for shard in shards:
+        for name, array in arrays.items():
+            np.testing.assert_array_equal(shard[name], array[shard['y_pitch'].reshape(-1)])
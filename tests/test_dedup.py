@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from dedup import remove_repeats, window_hashes
+from prepare_data import create_sample_weights
+
+
+def remove_repeat_sequences_unique(X, y_p, y_d, threshold=25):
+    """the original np.unique(axis=0) remove_repeat_sequences, kept to check the hashed version against"""
+    _, unique_indexes, counts = np.unique(X, axis=0, return_index=True, return_counts=True)
+    indexes = [idx for idx, count in zip(unique_indexes, counts) if count < threshold]
+    return X[indexes], y_p[indexes].reshape(-1, 1), y_d[indexes].reshape(-1, 1)
+
+
+def create_sample_weights_dicts(y_pitch, y_duration):
+    """the original dict based create_sample_weights"""
+    pitch_counts = np.unique(y_pitch, return_counts=True)
+    duration_counts = np.unique(y_duration, return_counts=True)
+    pitch_mean = np.mean(pitch_counts[1])
+    duration_mean = np.mean(duration_counts[1])
+    pcw = {key: (1 / val) * pitch_mean for key, val in zip(*pitch_counts)}
+    dcw = {key: (1 / val) * duration_mean for key, val in zip(*duration_counts)}
+    y_pitch_cw = np.array([pcw[pitch] for pitch in y_pitch[:, 0]])
+    y_dur_cw = np.array([dcw[dur] for dur in y_duration[:, 0]])
+    return ((y_pitch_cw + y_dur_cw) / 2).reshape(-1, 1)
+
+
+def random_windows(n, seed=0, high=30):
+    """windows drawn from a small pool so many of them repeat, some more than the threshold"""
+    rng = np.random.default_rng(seed)
+    pool = np.stack([rng.integers(-1, high, (40, 8)), rng.integers(-1, 6, (40, 8))], axis=-1)
+    X = pool[rng.zipf(1.5, n) % len(pool)]
+    return X, rng.integers(0, high, n), rng.integers(0, 6, n)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 10_000])
+@pytest.mark.parametrize('threshold', [3, 25])
+def test_remove_repeats_matches_np_unique(chunk_size, threshold):
+    X, y_p, y_d = random_windows(2000)
+    expected = remove_repeat_sequences_unique(X, y_p, y_d, threshold)
+    for e, r in zip(expected, remove_repeats(X, y_p, y_d, threshold, chunk_size=chunk_size)):
+        assert e.dtype == r.dtype
+        np.testing.assert_array_equal(e, r)
+
+
+def test_remove_repeats_with_values_that_dont_fit_in_a_byte():
+    # some windows are packed into bytes and some aren't, equal windows still have to be counted together
+    X, y_p, y_d = random_windows(500, high=400)
+    expected = remove_repeat_sequences_unique(X, y_p, y_d, 3)
+    for e, r in zip(expected, remove_repeats(X, y_p, y_d, 3, chunk_size=13)):
+        np.testing.assert_array_equal(e, r)
+
+    floats = X.astype(np.float64) / 4
+    np.testing.assert_array_equal(remove_repeat_sequences_unique(floats, y_p, y_d, 3)[0], remove_repeats(floats, y_p, y_d, 3)[0])
+
+
+def test_window_hashes():
+    X, _, _ = random_windows(300)
+    hashes = window_hashes(X)
+    _, first, inverse = np.unique(X.reshape(len(X), -1), axis=0, return_index=True, return_inverse=True)
+    np.testing.assert_array_equal(hashes, hashes[first][inverse.reshape(-1)])
+    assert len(np.unique(hashes)) == len(first)
+
+
+def test_sample_weights_match_the_dict_version():
+    rng = np.random.default_rng(0)
+    # classes 0, 3 and 7 never appear as targets
+    y_pitch = rng.choice([1, 2, 4, 5, 6, 8, 9], (500, 1))
+    y_duration = rng.choice([1, 2, 4, 5, 6], (500, 1))
+    np.testing.assert_array_equal(create_sample_weights_dicts(y_pitch, y_duration), create_sample_weights(y_pitch, y_duration))
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from api.encoding import NoteEncoder
+
+pitch_symb = [0, 60, 62, 64, 72]
+duration_symb = [0.25, 0.5, 1.0, 1.5]
+
+
+def test_encode_matches_dict_mapping_and_decodes_back():
+    encoder = NoteEncoder(pitch_symb, duration_symb)
+    pitch_mapping = {p: i for i, p in enumerate(pitch_symb)}
+    duration_mapping = {d: i for i, d in enumerate(duration_symb)}
+    notes = [[[60, 0.5], [0, 1.5], [72, 0.25]], [[64, 1.0], [62, 0.5], [60, 0.25]]]
+
+    expected = [[[pitch_mapping[p], duration_mapping[d]] for p, d in sequence] for sequence in notes]
+    assert encoder.encode(notes).tolist() == expected
+    assert encoder.decode(encoder.encode(notes)) == notes
+
+    packed = [[p * 256 + int(d * 16) for p, d in sequence] for sequence in notes]
+    assert encoder.encode_packed(packed).tolist() == expected
+
+
+@pytest.mark.parametrize('note', [[61, 0.5], [60, 0.75], [60, 0.3], [-1, 0.5], [500, 0.5], [60.5, 0.5]])
+def test_encode_rejects_values_outside_the_vocabulary(note):
+    encoder = NoteEncoder(pitch_symb, duration_symb)
+    with pytest.raises(ValueError):
+        encoder.encode(np.array([[[60, 0.5], note]]))
+
+
+@pytest.mark.parametrize('packed', [[[2 ** 70]], [[-8]], [[73 * 256 + 8]], [['a']], [[None]], [[[1, 2], 3]]])
+def test_encode_packed_rejects_bad_packed_notes(packed):
+    encoder = NoteEncoder(pitch_symb, duration_symb)
+    with pytest.raises(ValueError):
+        encoder.encode_packed(packed)
+
+
+@pytest.mark.parametrize('notes', [[[[60, None]]], [[[60, {}]]], [[[60, 0.5], [62]]]])
+def test_encode_rejects_notes_that_arent_number_pairs(notes):
+    encoder = NoteEncoder(pitch_symb, duration_symb)
+    with pytest.raises(ValueError):
+        encoder.encode(notes)
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from dataset import save_sharded_dataset
+from input_pipeline import make_dataset, make_sharded_dataset, scale_learning_rate, train_validation_split
+
+
+def test_train_validation_split_is_shuffled_and_reproducible():
+    train, validation = train_validation_split(1000, 0.2, seed=1)
+    assert len(validation) == 200
+    np.testing.assert_array_equal(np.sort(np.concatenate([train, validation])), np.arange(1000))
+    # not just the last 20% like keras's validation_split
+    assert validation.min() < 800
+
+    again = train_validation_split(1000, 0.2, seed=1)
+    np.testing.assert_array_equal(train, again[0])
+    np.testing.assert_array_equal(validation, again[1])
+
+
+def test_make_dataset_batches_every_sample_of_the_split_once():
+    n = 300
+    X = np.arange(n * 8 * 2).reshape(n, 8, 2)
+    y = {'pitch_output': np.arange(n).reshape(-1, 1), 'duration_output': -np.arange(n).reshape(-1, 1)}
+    sample_weights = np.arange(n, dtype=np.float64).reshape(-1, 1) / n
+    train, _ = train_validation_split(n, 0.2)
+
+    def epoch(dataset):
+        return [(x.numpy(), targets['pitch_output'].numpy(), targets['duration_output'].numpy(), weights.numpy())
+                for x, targets, weights in dataset]
+
+    dataset = make_dataset(X, y, sample_weights, train, batch_size=32, seed=3)
+    batches = epoch(dataset)
+    assert [len(b[0]) for b in batches] == [32] * 7 + [16]
+
+    # rows stay together and every training sample appears exactly once
+    samples = np.concatenate([b[1] for b in batches]).reshape(-1)
+    np.testing.assert_array_equal(np.sort(samples), train)
+    for x, pitch, duration, weights in batches:
+        np.testing.assert_array_equal(x, X[pitch.reshape(-1)])
+        np.testing.assert_array_equal(duration, -pitch)
+        np.testing.assert_array_equal(weights, sample_weights[pitch.reshape(-1)])
+
+    # reshuffled every epoch, but the same seed gives the same order
+    second_epoch = np.concatenate([b[1] for b in epoch(dataset)]).reshape(-1)
+    assert not np.array_equal(samples, second_epoch)
+    same_seed = np.concatenate([b[1] for b in epoch(make_dataset(X, y, sample_weights, train, batch_size=32, seed=3))])
+    np.testing.assert_array_equal(samples, same_seed.reshape(-1))
+
+    validation = np.concatenate([b[1] for b in epoch(make_dataset(X, y, sample_weights, train, 32, shuffle=False))])
+    np.testing.assert_array_equal(validation.reshape(-1), train)
+
+
+def test_make_dataset_reads_batches_from_the_memory_mapped_arrays(tmp_path):
+    n = 100
+    np.save(tmp_path / 'X.npy', np.zeros((n, 8, 2), dtype=np.int16))
+    X = np.load(tmp_path / 'X.npy', mmap_mode='r')
+    y = {'pitch_output': np.arange(n).reshape(-1, 1), 'duration_output': np.arange(n).reshape(-1, 1)}
+    dataset = make_dataset(X, y, np.ones((n, 1)), np.arange(n), batch_size=32, shuffle=False)
+    assert all(not x.numpy().any() for x, _, _ in dataset)
+
+    # nothing was copied when the pipeline was made, so the next epoch sees what's in the file now
+    on_disk = np.load(tmp_path / 'X.npy', mmap_mode='r+')
+    on_disk[:] = 1
+    on_disk.flush()
+    x = np.concatenate([x.numpy() for x, _, _ in dataset])
+    assert x.dtype == np.int16 and x.shape == (n, 8, 2) and (x == 1).all()
+
+
+def test_sharded_dataset_streams_every_sample_once_in_a_reproducible_order(tmp_path):
+    n = 500
+    arrays = {
+        'X': np.arange(n * 8 * 2).reshape(n, 8, 2),
+        'y_pitch': np.arange(n).reshape(-1, 1),
+        'y_duration': -np.arange(n).reshape(-1, 1),
+        'sample_weights': np.ones((n, 1)),
+    }
+    save_sharded_dataset(tmp_path, arrays, [{}, {}, {}, {}], shard_size=64)
+
+    def epoch(dataset):
+        samples = []
+        for x, targets, _ in dataset:
+            pitch = targets['pitch_output'].numpy().reshape(-1)
+            np.testing.assert_array_equal(x.numpy(), arrays['X'][pitch])
+            samples.append(pitch)
+        return np.concatenate(samples)
+
+    train = make_sharded_dataset(tmp_path, batch_size=32, shuffle_buffer=50, seed=1)
+    validation = epoch(make_sharded_dataset(tmp_path, validation=True, batch_size=32, shuffle=False, seed=1))
+    first_epoch, second_epoch = epoch(train), epoch(train)
+
+    # training and validation samples don't overlap and cover the dataset
+    np.testing.assert_array_equal(np.sort(np.concatenate([first_epoch, validation])), np.arange(n))
+    np.testing.assert_array_equal(np.sort(first_epoch), np.sort(second_epoch))
+    assert not np.array_equal(first_epoch, second_epoch)
+
+    # a new pipeline with the same seed goes through the same epochs
+    again = make_sharded_dataset(tmp_path, batch_size=32, shuffle_buffer=50, seed=1)
+    np.testing.assert_array_equal(first_epoch, epoch(again))
+    np.testing.assert_array_equal(second_epoch, epoch(again))
+
+
+def test_scale_learning_rate():
+    assert scale_learning_rate(0.001, 256, 'linear') == pytest.approx(0.016)
+    assert scale_learning_rate(0.001, 256, 'sqrt') == pytest.approx(0.004)
+    assert scale_learning_rate(0.001, 256, 'none') == 0.001
+    with pytest.raises(ValueError):
+        scale_learning_rate(0.001, 256, 'cubic')
@@ -0,0 +1,22 @@
+import numpy as np
+
+from manifest import build_shard, merge_shards
+from prepare_data import create_mapping_dicts, create_sequences, remove_repeat_sequences
+from tests.test_prepare_data import random_note_dfs
+
+
+def test_merged_shards_match_a_full_rebuild():
+    # repeat some dfs across files so windows are duplicated within and across shards
+    dfs = random_note_dfs(12)
+    files = [dfs[:5] + dfs[:2], dfs[5:9], dfs[9:] + dfs[3:6], dfs[:1]]
+    all_dfs = [df for file_dfs in files for df in file_dfs]
+
+    mapping_dicts = create_mapping_dicts(all_dfs)
+    X, y_p, y_d = create_sequences(all_dfs, 8, mapping_dicts[0], mapping_dicts[2])
+    expected = remove_repeat_sequences(X, y_p, y_d, threshold=3)
+
+    merged_mappings, *result = merge_shards([build_shard(file_dfs, 8) for file_dfs in files], threshold=3)
+    assert merged_mappings == list(mapping_dicts)
+    for e, r in zip(expected, result):
+        assert e.dtype == r.dtype
+        np.testing.assert_array_equal(e, r)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from melody_corpus import MelodyCorpus
+from prepare_data import create_mapping_dicts, create_sequences, mask_start_df
+from tests.test_prepare_data import random_note_dfs
+
+
+def split_melody_dfs_loop(df_list):
+    """the original iterrows split_melody_dfs, kept to check MelodyCorpus.split_at_markers against"""
+    split_dfs = []
+    for df in df_list:
+        prev_0 = -1
+        for i, val in df.iterrows():
+            if val.measure == 0:
+                new_df = df[prev_0+1: i].reset_index(drop=True)
+                if len(new_df) > 1:
+                    split_dfs.append(new_df)
+                prev_0 = i
+    return split_dfs
+
+
+def random_melody_dfs(n_dfs, seed=0):
+    """unsplit melodies, with measure 0 marker rows (sometimes several in a row) like midi_cleaner makes"""
+    rng = np.random.default_rng(seed)
+    dfs = []
+    for df in random_note_dfs(n_dfs, seed):
+        markers = rng.random(len(df)) < 0.2
+        df.loc[markers, ['pitch', 'duration', 'beat', 'measure']] = 0
+        dfs.append(df)
+    return dfs
+
+
+def assert_same_dfs(expected, result):
+    assert len(expected) == len(result)
+    for e, r in zip(expected, result):
+        pd.testing.assert_frame_equal(e, r)
+
+
+def test_split_at_markers_matches_split_melody_dfs():
+    dfs = random_melody_dfs(40)
+    assert_same_dfs(split_melody_dfs_loop(dfs), MelodyCorpus.from_dfs(dfs).split_at_markers().to_dfs())
+
+
+def test_pad_start_matches_mask_start_df():
+    dfs = random_note_dfs(10)
+    expected = [mask_start_df(df, 4).reset_index(drop=True).astype(df.dtypes) for df in dfs]
+    assert_same_dfs(expected, MelodyCorpus.from_dfs(dfs).pad_start(4).to_dfs())
+
+
+def test_corpus_and_dfs_give_the_same_sequences():
+    dfs = random_note_dfs(30)
+    corpus = MelodyCorpus.from_dfs(dfs)
+    mapping_dicts = create_mapping_dicts(dfs)
+    assert create_mapping_dicts(corpus) == mapping_dicts
+
+    for e, r in zip(create_sequences(dfs, 8, mapping_dicts[0], mapping_dicts[2]),
+                    create_sequences(corpus, 8, mapping_dicts[0], mapping_dicts[2])):
+        assert e.dtype == r.dtype
+        np.testing.assert_array_equal(e, r)
@@ -0,0 +1,61 @@
+import glob
+from os.path import dirname, join
+
+import music21 as m21
+import numpy as np
+import pytest
+
+from midi_cleaner import parse_melody
+from midi_reader import MAJOR_KEYS, MINOR_KEYS, read_melody
+
+MIDI_PATH = join(dirname(dirname(__file__)), 'raw_data', 'mozart_midis')
+
+
+def write_test_midi(path):
+    """a two part midi with chords, rests, ties over barlines, triplets, tempo and time signature changes"""
+    melody = m21.stream.Part()
+    melody.append(m21.key.Key('B-'))
+    melody.append(m21.meter.TimeSignature('3/4'))
+    melody.append(m21.tempo.MetronomeMark(number=90))
+    for pitch, ql in [('B-4', 1), ('D5', 0.5), (None, 0.5), ('F5', 2.5), ('E-5', 0.5), ('C5', 1 / 3), ('D5', 1 / 3),
+                      ('E-5', 1 / 3), ('F5', 2), (['B-4', 'D5', 'F5'], 1.5), ('G5', 0.75), ('A4', 1.75)]:
+        if pitch is None:
+            melody.append(m21.note.Rest(quarterLength=ql))
+        elif isinstance(pitch, list):
+            melody.append(m21.chord.Chord(pitch, quarterLength=ql))
+        else:
+            melody.append(m21.note.Note(pitch, quarterLength=ql))
+    melody.append(m21.meter.TimeSignature('6/8'))
+    melody.insert(melody.highestTime + 1 / 3, m21.tempo.MetronomeMark(number=80))
+    for pitch, ql in [('B-4', 0.5), ('C5', 0.5), ('D5', 0.5), ('E-5', 1.5), ('F5', 3), (None, 1.5), ('B-5', 1.5)]:
+        melody.append(m21.note.Note(pitch, quarterLength=ql) if pitch else m21.note.Rest(quarterLength=ql))
+
+    bass = m21.stream.Part()
+    for pitch in ['B-2', 'F2', 'G2', 'D2', 'E-2', 'F2', 'B-2', 'F2']:
+        bass.append(m21.note.Note(pitch, quarterLength=3))
+
+    m21.stream.Score([melody, bass]).write('midi', fp=path)
+
+
+def test_read_melody_matches_music21(tmp_path):
+    path = str(tmp_path / 'test.mid')
+    write_test_midi(path)
+
+    expected_notes, expected_key = parse_melody(path)
+    notes, key_sig = read_melody(path)
+    assert key_sig == expected_key
+    np.testing.assert_array_equal(notes, expected_notes)
+
+
+@pytest.mark.parametrize('filename', sorted(glob.glob(join(MIDI_PATH, '*'))))
+def test_read_melody_matches_music21_on_the_corpus(filename):
+    expected_notes, expected_key = parse_melody(filename)
+    notes, key_sig = read_melody(filename)
+    assert key_sig == expected_key
+    np.testing.assert_array_equal(notes, expected_notes)
+
+
+def test_key_names_match_music21():
+    for sharps in range(-7, 8):
+        assert MAJOR_KEYS[sharps + 7] + ' major' == str(m21.key.KeySignature(sharps).asKey('major')).lower()
+        assert MINOR_KEYS[sharps + 7] + ' minor' == str(m21.key.KeySignature(sharps).asKey('minor')).lower()
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from CoolMelodyProject.bundle import quantize_weights
+from CoolMelodyProject.numpy_model import NumpyMelodyModel, export_weights
+
+
+def test_numpy_model_matches_keras(tmp_path):
+    pytest.importorskip('tensorflow')
+    from CoolMelodyProject.train_model import build_model
+
+    model = build_model((8, 2), 0.001, 68, 25)
+    # biases start at zero, randomize every weight so the whole forward pass is checked
+    rng = np.random.default_rng(0)
+    model.set_weights([rng.normal(scale=0.5, size=w.shape) for w in model.get_weights()])
+
+    weights_path = tmp_path / 'model.npz'
+    export_weights(model, weights_path)
+    numpy_model = NumpyMelodyModel.load(weights_path)
+
+    x = rng.integers(0, 25, size=(64, 8, 2))
+    for keras_out, numpy_out in zip(model.predict(x, verbose=0), numpy_model.predict(x)):
+        np.testing.assert_allclose(numpy_out, keras_out, atol=1e-5)
+
+
+def test_stepping_through_a_window_matches_predict():
+    model = NumpyMelodyModel.load('model.npz')
+    x = np.random.default_rng(0).integers(0, 25, size=(4, 8, 2))
+    outputs, _ = model.prime(x)
+    for step_out, predict_out in zip(outputs, model.predict(x)):
+        np.testing.assert_allclose(step_out, predict_out, atol=1e-6)
+
+
+@pytest.mark.parametrize('quantization, max_size, atol', [('float16', 0.55, 1e-2), ('int8', 0.35, 5e-2)])
+def test_quantized_weights_are_smaller_and_predict_about_the_same(tmp_path, quantization, max_size, atol):
+    model = NumpyMelodyModel.load('model.npz')
+    quantized = quantize_weights(model.weights, quantization)
+    np.savez(tmp_path / 'model.npz', **quantized)
+    size = sum(w.nbytes for w in quantized.values())
+    assert size < max_size * sum(w.nbytes for w in model.weights.values())
+
+    quantized_model = NumpyMelodyModel.load(tmp_path / 'model.npz')
+    assert quantized_model.quantization == quantization and model.quantization == 'float32'
+    # the weights stay quantized once loaded
+    assert sum(w.nbytes for w in quantized_model.weights.values()) == size
+
+    x = np.random.default_rng(0).integers(0, 25, size=(64, 8, 2))
+    for quantized_out, out in zip(quantized_model.predict(x), model.predict(x)):
+        np.testing.assert_allclose(quantized_out, out, atol=atol)
+        # the top-3 candidates hardly ever change
+        top3 = np.argsort(out, axis=1)[:, -3:]
+        quantized_top3 = np.argsort(quantized_out, axis=1)[:, -3:]
+        assert np.mean(np.sort(top3, axis=1) == np.sort(quantized_top3, axis=1)) > 0.95
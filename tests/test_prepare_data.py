@@ -0,0 +1,70 @@
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset import load_dataset
+from prepare_data import create_mapping_dicts, create_sequences, main, mask_start_df
+
+
+def create_sequences_loop(df_list, length, pitch_mapping, duration_mapping, horizon=1, selected_features=['pitch', 'duration']):
+    """the original one-window-at-a-time create_sequences, kept to check the vectorized version against"""
+    features_list = []
+    target_pitch = []
+    target_duration = []
+    for note_df in df_list:
+        df = note_df.copy()
+        df = mask_start_df(df, pad_length=(length // 2))
+        L_df = len(df)
+        if L_df >= (length + horizon):
+            df = df.reset_index()
+            df['pitch'] = df['pitch'].astype('int')
+            df['duration'] = df['duration'].astype('float')
+            df['pitch'] = df['pitch'].map(pitch_mapping)
+            df['duration'] = df['duration'].map(duration_mapping)
+            latest_start_index = (L_df - length - horizon)
+            for i in range(latest_start_index):
+                features_list.append(df.loc[i:(i + length - 1), selected_features])
+                target_pitch.append(df.loc[(i + length), 'pitch'])
+                target_duration.append(df.loc[(i + length), 'duration'])
+    return np.array(features_list), np.array(target_pitch), np.array(target_duration)
+
+
+def random_note_dfs(n_dfs, seed=0):
+    rng = np.random.default_rng(seed)
+    pitches = np.array([0] + list(range(55, 80)))
+    durations = np.array([0.25, 0.5, 0.75, 1.0, 1.5, 2.0])
+    dfs = []
+    for _ in range(n_dfs):
+        n = rng.integers(2, 40)
+        dfs.append(pd.DataFrame({
+            'pitch': rng.choice(pitches, n),
+            'duration': rng.choice(durations, n),
+            'beat': rng.choice([1.0, 1.5, 2.0, 3.0], n),
+            'measure': np.sort(rng.integers(1, 20, n)),
+        }))
+    return dfs
+
+
+@pytest.mark.parametrize('length, selected_features', [(8, ['pitch', 'duration']), (4, ['pitch', 'duration', 'beat'])])
+def test_create_sequences_matches_the_loop_version(length, selected_features):
+    dfs = random_note_dfs(30)
+    pitch_mapping, _, duration_mapping, _ = create_mapping_dicts(dfs)
+
+    expected = create_sequences_loop(dfs, length, pitch_mapping, duration_mapping, selected_features=selected_features)
+    result = create_sequences(dfs, length, pitch_mapping, duration_mapping, selected_features=selected_features)
+    for e, r in zip(expected, result):
+        assert e.dtype == r.dtype
+        np.testing.assert_array_equal(e, r)
+
+
+def test_main_still_takes_json_path_third(tmp_path, monkeypatch):
+    midi_path = join(dirname(dirname(abspath(__file__))), 'raw_data', 'mozart_midis', '')
+    # the midi cache goes in data/midi_cache under the working directory
+    monkeypatch.chdir(tmp_path)
+    main(midi_path, 8, str(tmp_path / 'data.json'), dataset_path=str(tmp_path / 'dataset'))
+
+    assert (tmp_path / 'data.json').is_file()
+    arrays, _ = load_dataset(str(tmp_path / 'dataset'))
+    assert arrays['X'].shape[1:] == (8, 2)
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from api.registry import LEGACY_DURATION_SYMB, LEGACY_PITCH_SYMB, ModelRegistry, ServedModel, resolve_bundle
+from CoolMelodyProject.bundle import latest_bundle, load_bundle_metadata, save_bundle
+from CoolMelodyProject.numpy_model import NumpyMelodyModel
+
+
+# model.npz has 68 pitch and 25 duration output units, one more than these vocabularies like the models
+# train_model makes (the -1 padding entry of the mapping dicts gets a unit too)
+PITCH_SYMB = LEGACY_PITCH_SYMB[:67]
+DURATION_SYMB = LEGACY_DURATION_SYMB[:24]
+
+
+def mapping_dicts(pitch_symb, duration_symb):
+    # same layout as prepare_data.create_mapping_dicts, -1 is the padding value
+    pitch_mapping = {p: i for i, p in enumerate(pitch_symb)}
+    duration_mapping = {d: i for i, d in enumerate(duration_symb)}
+    return [{**pitch_mapping, -1: -1}, {**{i: p for p, i in pitch_mapping.items()}, -1: -1},
+            {**duration_mapping, -1.0: -1}, {**{i: d for d, i in duration_mapping.items()}, -1: -1.0}]
+
+
+def publish(bundles_dir, sampling=None):
+    weights = NumpyMelodyModel.load('model.npz').weights
+    return save_bundle(bundles_dir, weights, mapping_dicts(PITCH_SYMB, DURATION_SYMB), 8, sampling)
+
+
+def test_bundles_are_numbered_and_the_newest_is_served(tmp_path):
+    assert latest_bundle(tmp_path) is None and resolve_bundle(str(tmp_path)) is None
+    first = publish(tmp_path)
+    second = publish(tmp_path, sampling={'temperature': 0.8})
+    assert first.endswith('v0001') and second.endswith('v0002')
+    assert latest_bundle(tmp_path) == second
+    assert resolve_bundle(first) == first
+
+    # the vocabulary comes out of the mapping dicts in index order, without the padding value
+    metadata = load_bundle_metadata(second)
+    assert metadata['pitch_symb'] == PITCH_SYMB
+    assert metadata['duration_symb'] == DURATION_SYMB
+
+    served = ServedModel.from_bundle(second)
+    assert served.version == 'v0002'
+    assert served.sampling['temperature'] == 0.8 and served.sampling['k'] == 12
+    assert served.encoder.decode(served.encoder.encode([[[72, 0.5]] * 8]))[0][0] == [72, 0.5]
+
+    # every weights variant is in the bundle
+    assert ServedModel.from_bundle(second, 'int8').info()['quantization'] == 'int8'
+
+
+def test_served_bundles_only_predict_notes_they_can_decode(tmp_path):
+    served = ServedModel.from_bundle(publish(tmp_path), 'int8')
+    pitch_pred, duration_pred = served.predict(np.zeros((2, 8, 2)))
+    assert pitch_pred.shape == (2, len(PITCH_SYMB)) and duration_pred.shape == (2, len(DURATION_SYMB))
+    np.testing.assert_allclose(pitch_pred.sum(axis=1), 1, atol=1e-5)
+    # the last index of each vocabulary decodes
+    assert served.encoder.decode([[len(PITCH_SYMB) - 1, len(DURATION_SYMB) - 1]]) == [[PITCH_SYMB[-1], DURATION_SYMB[-1]]]
+
+
+def test_bundles_whose_outputs_dont_match_their_vocabulary_are_rejected(tmp_path):
+    weights = NumpyMelodyModel.load('model.npz').weights
+    with pytest.raises(ValueError):
+        save_bundle(tmp_path, weights, mapping_dicts(PITCH_SYMB[:60], DURATION_SYMB), 8)
+
+    bundle_dir = publish(tmp_path)
+    metadata = load_bundle_metadata(bundle_dir)
+    metadata['pitch_symb'] = metadata['pitch_symb'][:-1]
+    with open(os.path.join(bundle_dir, 'bundle.json'), 'w') as f:
+        json.dump(metadata, f)
+    with pytest.raises(ValueError):
+        ServedModel.from_bundle(bundle_dir)
+
+
+def test_a_failed_save_leaves_nothing_behind(tmp_path):
+    weights = NumpyMelodyModel.load('model.npz').weights
+    with pytest.raises(ValueError):
+        save_bundle(tmp_path, weights, mapping_dicts(PITCH_SYMB, DURATION_SYMB), 8,
+                    quantizations=['float32', 'int4'])
+    assert os.listdir(tmp_path) == [] and latest_bundle(tmp_path) is None
+
+
+def test_swapping_models_under_load_drops_nothing(tmp_path):
+    publish(tmp_path)
+    registry = ModelRegistry(bundle_path=str(tmp_path))
+    registry.load()
+    assert registry.current.version == 'v0001' and registry.current.generation == 1
+
+    x = np.random.default_rng(0).integers(0, 25, size=(4, 8, 2))
+    expected = registry.predict(x)
+    errors, stop = [], threading.Event()
+
+    def client():
+        while not stop.is_set():
+            try:
+                served = registry.current
+                for out, exp in zip(served.predict(x), expected):
+                    np.testing.assert_allclose(out, exp, atol=1e-6)
+            except Exception as e:
+                errors.append(e)
+
+    clients = [threading.Thread(target=client) for _ in range(4)]
+    for thread in clients:
+        thread.start()
+    publish(tmp_path)
+    served = registry.load_in_background().result()
+    stop.set()
+    for thread in clients:
+        thread.join()
+
+    assert errors == []
+    assert served.version == 'v0002' and registry.current is served and served.generation == 2
+
+
+def test_a_rollback_survives_the_watcher(tmp_path):
+    first = publish(tmp_path)
+    publish(tmp_path)
+    registry = ModelRegistry(bundle_path=str(tmp_path))
+    registry.load()
+    registry.watch(0.01)
+    try:
+        registry.load(first)
+        time.sleep(0.1)
+        assert registry.current.version == 'v0001'
+
+        # a newly published bundle is still picked up
+        publish(tmp_path)
+        deadline = time.monotonic() + 5
+        while registry.current.version != 'v0003' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert registry.current.version == 'v0003'
+    finally:
+        registry.stop()
+
+
+def test_unknown_quantizations_are_refused_and_the_fallback_model_keeps_the_setting(tmp_path):
+    registry = ModelRegistry(bundle_path=str(tmp_path / 'bundles'), model_path='model.npz')
+    with pytest.raises(ValueError):
+        registry.load(quantization='bogus')
+    assert registry.quantization == 'float32' and not registry.is_loaded
+
+    # there's no bundle, so the legacy model is served and int8 isn't made the setting
+    registry.load(quantization='int8')
+    assert registry.current.version == 'legacy' and registry.quantization == 'float32'
+
+    publish(tmp_path / 'bundles')
+    registry.load(quantization='int8')
+    assert registry.current.info()['quantization'] == 'int8' and registry.quantization == 'int8'
@@ -0,0 +1,36 @@
+import numpy as np
+
+from api.sampling import Sampler, sample
+
+
+def test_sample_only_draws_from_top_k_and_top_p():
+    rng = np.random.default_rng(0)
+    probs = rng.dirichlet(np.ones(68), size=32)
+
+    picks = sample(probs, n_samples=50, k=12, rng=rng)
+    top_12 = np.argsort(-probs, axis=-1)[:, :12]
+    assert picks.shape == (32, 50)
+    assert all(np.isin(row_picks, row_top).all() for row_picks, row_top in zip(picks, top_12))
+
+    probs = np.array([[0.5, 0.3, 0.15, 0.05]])
+    assert set(sample(probs, n_samples=500, top_p=0.7, rng=rng)[0]) == {0, 1}
+    assert set(sample(probs, n_samples=500, top_p=0.5, rng=rng)[0]) == {0}
+
+
+def test_sample_follows_the_tempered_distribution():
+    probs = np.array([[0.6, 0.3, 0.1]])
+    picks = sample(probs, n_samples=20000, rng=np.random.default_rng(0))[0]
+    np.testing.assert_allclose(np.bincount(picks, minlength=3) / 20000, probs[0], atol=0.02)
+
+    picks = sample(probs, n_samples=20000, temperature=0.5, rng=np.random.default_rng(0))[0]
+    expected = probs[0] ** 2 / (probs[0] ** 2).sum()
+    np.testing.assert_allclose(np.bincount(picks, minlength=3) / 20000, expected, atol=0.02)
+
+
+def test_seeded_samplers_are_reproducible():
+    rng = np.random.default_rng(0)
+    pitch_pred, duration_pred = rng.dirichlet(np.ones(68), size=4), rng.dirichlet(np.ones(25), size=4)
+    first = Sampler(seed=7).sample_notes(pitch_pred, duration_pred, 3)
+    second = Sampler(seed=7).sample_notes(pitch_pred, duration_pred, 3)
+    assert first.shape == (4, 3, 2)
+    assert (first == second).all()
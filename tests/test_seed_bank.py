@@ -0,0 +1,22 @@
+import random
+
+import pandas as pd
+
+from api.seed_bank import SeedBank, clean_csv_paths
+
+
+def test_seed_bank_returns_same_first_notes_as_the_csv():
+    path = clean_csv_paths('raw_data/clean_csvs', [1])
+    seed_bank = SeedBank.from_csvs(path)
+    expected = [[int(note.split('-')[0]), note.split('-')[1]]
+                for note in pd.read_csv(path[0])['pitch_dur0'][:8]]
+    assert seed_bank.sample() == expected
+
+
+def test_random_offset_seeds_are_windows_of_the_piece():
+    seed_bank = SeedBank.from_csvs(clean_csv_paths('raw_data/clean_csvs'))
+    rng = random.Random(0)
+    for _ in range(50):
+        seed = seed_bank.sample(random_offset=True, rng=rng)
+        assert len(seed) == 8
+        assert all(isinstance(pitch, int) and isinstance(duration, str) for pitch, duration in seed)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from sweep import dataset_path, run_sweep, sample_trials, should_prune
+
+SPACE = {'lstm_units': [16, 32, 64], 'dropout': [0.1, 0.2], 'batch_size': [64, 256]}
+
+
+def test_sample_trials_picks_different_combinations_from_the_space():
+    trials = sample_trials(SPACE, 5, seed=1)
+    assert len(trials) == 5
+    assert len({tuple(trial.values()) for trial in trials}) == 5
+    for trial in trials:
+        assert all(trial[name] in values for name, values in SPACE.items())
+    assert sample_trials(SPACE, 5, seed=1) == trials
+
+    # asking for at least the whole grid gives every combination
+    assert len(sample_trials(SPACE, 100)) == len(sample_trials(SPACE)) == 12
+
+
+@pytest.mark.parametrize('search_space, n_trials', [(SPACE, 0), (SPACE, -1), ({**SPACE, 'dropout': []}, None)])
+def test_run_sweep_refuses_sweeps_without_trials(tmp_path, search_space, n_trials):
+    with pytest.raises(ValueError):
+        run_sweep(search_space, n_trials, sweep_dir=str(tmp_path / 'sweep'))
+    assert not (tmp_path / 'sweep').exists()
+
+
+def test_should_prune_compares_with_the_median_of_other_trials_at_the_same_epoch():
+    others = [[3.0, 2.0, 1.0], [3.0, 2.5, 2.0], [4.0, 3.0, 2.5], [5.0]]
+
+    # after 2 epochs the others' best losses are 2.0, 2.5 and 3.0 (the last trial hasn't got that far)
+    assert should_prune([3.0, 2.6], others, warmup_epochs=2, min_trials=3)
+    assert not should_prune([3.0, 2.4], others, warmup_epochs=2, min_trials=3)
+
+    # not before the warm-up, or without enough other trials to compare with
+    assert not should_prune([9.0], others, warmup_epochs=2, min_trials=3)
+    assert not should_prune([9.0, 9.0], others[:2], warmup_epochs=2, min_trials=3)
+
+
+def test_trials_read_the_sweep_dataset_from_disk_instead_of_copying_it(tmp_path):
+    pytest.importorskip('tensorflow')
+    from dataset import save_dataset
+    from train_model import load_pipelines
+
+    n = 200
+    arrays = {'X': np.zeros((n, 8, 2), dtype=np.int16), 'y_pitch': np.arange(n).reshape(-1, 1),
+              'y_duration': np.arange(n).reshape(-1, 1), 'sample_weights': np.ones((n, 1))}
+    path = dataset_path(tmp_path, 8)
+    save_dataset(path, arrays, [{}, {}, {}, {}])
+
+    # what run_trial does in every worker
+    train_data, validation_data, _, _ = load_pipelines(path, 64, seed=0)
+    np.load(f'{path}/X.npy', mmap_mode='r+')[:] = 1
+    for data in [train_data, validation_data]:
+        assert all((x.numpy() == 1).all() for x, _, _ in data)